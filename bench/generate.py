@@ -0,0 +1,99 @@
+"""Generates synthetic .mc.py programs for the benchmarks in bench.run."""
+
+from __future__ import annotations
+
+import dataclasses
+import pathlib
+import random
+
+# the std library, for print_var and the stack functions of the std lib config, which are compiled if they are used
+STD_SOURCE = pathlib.Path(__file__).parent.parent / "mcutils" / "lib" / "std2" / "stack.mc.py"
+
+ENTRY_POINT = "bench_main"
+
+_OPS = ("+", "-", "*", "/", "%")
+
+
+@dataclasses.dataclass(frozen=True)
+class ProgramConfig:
+    # number of function templates
+    functions: int = 20
+    # number of instantiations of every template, i.e. distinct compile-time args
+    instantiations: int = 2
+    # nesting depth of if/while in every function
+    depth: int = 2
+    # number of binary operators in every expression
+    expression_size: int = 3
+    seed: int = 0
+
+    def scaled(self, factor: int) -> ProgramConfig:
+        return dataclasses.replace(self, functions=self.functions * factor)
+
+
+def _expression(rng: random.Random, size: int, names: tuple[str, ...]) -> str:
+    out = rng.choice(names)
+
+    for _ in range(size):
+        operand = rng.choice(names) if rng.random() < 0.5 else str(rng.randint(1, 9))
+        out = f"({out} {rng.choice(_OPS)} {operand})"
+
+    return out
+
+
+def _body(rng: random.Random, config: ProgramConfig, depth: int, indent: str) -> list[str]:
+    names = ("a", "b", "c")
+
+    if depth == 0:
+        return [
+            f"{indent}c = {_expression(rng, config.expression_size, names)}",
+            f"{indent}print_var[\"c\", c]()",
+        ]
+
+    bound = rng.randint(2, 20)
+
+    return [
+        f"{indent}if a < {bound}:",
+        f"{indent}    while b < {bound}:",
+        f"{indent}        b += 1",
+        *_body(rng, config, depth - 1, indent + "        "),
+        f"{indent}    a = {_expression(rng, config.expression_size, names)}",
+        f"{indent}else:",
+        f"{indent}    b = {_expression(rng, config.expression_size, names)}",
+        *_body(rng, config, depth - 1, indent + "    "),
+    ]
+
+
+def generate(config: ProgramConfig) -> str:
+    """A program whose entry point ``bench_main`` instantiates every template ``config.instantiations`` times.
+
+    Every template calls the previous one with the same compile-time arg, so the call graph is a chain per
+    instantiation.
+    """
+
+    rng = random.Random(config.seed)
+    lines = [STD_SOURCE.read_text("utf-8"), ""]
+
+    for i in range(config.functions):
+        lines += [
+            "",
+            f"def bench_f{i}[k]():",
+            "    a: Int = k",
+            f"    b: Int = {rng.randint(0, 9)}",
+            "    c: Int = 0",
+            *_body(rng, config, config.depth, "    "),
+        ]
+
+        if i > 0:
+            lines.append(f"    bench_f{i - 1}[k]()")
+
+        lines.append("")
+
+    lines += ["", f"def {ENTRY_POINT}():"]
+    lines += [f"    bench_f{config.functions - 1}[{k}]()" for k in range(config.instantiations)]
+    lines.append("")
+
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    print(generate(ProgramConfig()))
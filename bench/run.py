@@ -0,0 +1,225 @@
+"""Scalability benchmarks for the compiler.
+
+Every benchmark compiles a generated program (see bench.generate) at several sizes, each in a fresh process, and
+records wall time, peak RSS and output size per stage. The ``resolve_templates_jobs`` stage lowers the program again
+on ``JOBS`` processes. The ``run`` stage runs the compiled pack with mcutils.executor and records the number of
+commands it executed. Results are compared against ``baseline.json``::
+
+    python -m bench.run                    # compare against the baseline
+    python -m bench.run --update-baseline  # store the results as the new baseline
+
+A benchmark fails if the pack executes more commands than in the baseline, or if the median time of a stage grows
+faster than ``--max-exponent`` with the program size, which catches super-linear regressions on any machine. Wall
+times depend on the machine and its load, so they are only compared against the baseline with ``--tolerance``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import dataclasses
+import json
+import math
+import pathlib
+import subprocess
+import sys
+import tempfile
+import time
+
+from . import generate
+
+BASELINE = pathlib.Path(__file__).parent / "baseline.json"
+
+BENCHMARKS: dict[str, generate.ProgramConfig] = {
+    "flat": generate.ProgramConfig(functions=10, instantiations=2, depth=0, expression_size=2),
+    "nested": generate.ProgramConfig(functions=5, instantiations=2, depth=3, expression_size=2),
+    "expressions": generate.ProgramConfig(functions=5, instantiations=2, depth=1, expression_size=12),
+    "instantiations": generate.ProgramConfig(functions=5, instantiations=8, depth=1, expression_size=2),
+}
+
+SCALES = (1, 2, 4)
+
+STAGES = ("parse", "resolve_templates", "resolve_templates_jobs", "export", "run")
+
+# processes of the resolve_templates_jobs stage, see CompileNamespace.resolve_templates
+JOBS = 4
+
+
+def _peak_rss() -> int | None:
+    from mcutils import profiling
+    return profiling.Profiler.peak_rss()
+
+
+def run_once(config: generate.ProgramConfig) -> dict[str, dict]:
+    """Compile a generated program in this process."""
+
+    from mcutils import executor
+    from mcutils.ir import blocks, commands, datapack, tree
+    from mcutils.lib.std2 import stack
+
+    source = generate.generate(config)
+    out = {}
+
+    start = time.perf_counter()
+    file = tree.File.from_source(source, py_library=stack.Library())
+    out["parse"] = {"seconds": time.perf_counter() - start, "peak_rss": _peak_rss(), "size": len(source)}
+
+    std_lib_config = blocks.StdLibConfig(
+        stack_push=(("push",), (1,)), stack_pop=(("pop",), (1,)), stack_peek=(("peek",), (1,))
+    )
+
+    namespace = commands.CompileNamespace.from_tree_namespace(file)
+    start = time.perf_counter()
+    namespace.resolve_templates([generate.ENTRY_POINT], std_lib_config)
+    out["resolve_templates"] = {
+        "seconds": time.perf_counter() - start,
+        "peak_rss": _peak_rss(),
+        "size": len(namespace.command_functions),
+    }
+
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        datapack.Datapack("bench", {"bench": namespace}).export(pathlib.Path(directory))
+        seconds = time.perf_counter() - start
+
+        size = sum(path.stat().st_size for path in pathlib.Path(directory).rglob("*") if path.is_file())
+        out["export"] = {"seconds": seconds, "peak_rss": _peak_rss(), "size": size}
+
+        game = executor.Executor.load(pathlib.Path(directory))
+        start = time.perf_counter()
+        commands_executed = game.run(f"bench:{generate.ENTRY_POINT}/0")
+        out["run"] = {
+            "seconds": time.perf_counter() - start,
+            "peak_rss": _peak_rss(),
+            "size": len(game.output),
+            "commands": commands_executed,
+        }
+
+    # a fresh parse, lowering must not see the py library state of the other build
+    parallel_namespace = commands.CompileNamespace.from_tree_namespace(
+        tree.File.from_source(source, py_library=stack.Library())
+    )
+    start = time.perf_counter()
+    parallel_namespace.resolve_templates([generate.ENTRY_POINT], std_lib_config, jobs=JOBS)
+    out["resolve_templates_jobs"] = {
+        "seconds": time.perf_counter() - start,
+        "peak_rss": _peak_rss(),
+        "size": len(parallel_namespace.command_functions),
+    }
+
+    return out
+
+
+def run_isolated(config: generate.ProgramConfig) -> dict[str, dict]:
+    """Compile a generated program in a fresh interpreter, so that peak RSS and global state are per run."""
+
+    result = subprocess.run(
+        [sys.executable, "-m", "bench.run", "--child", json.dumps(dataclasses.asdict(config))],
+        cwd=pathlib.Path(__file__).parent.parent,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def run_benchmark(config: generate.ProgramConfig, repeat: int) -> dict[str, dict[str, dict]]:
+    results = {}
+
+    for scale in SCALES:
+        runs = [run_isolated(config.scaled(scale)) for _ in range(repeat)]
+        # the median run, single runs are easily disturbed by the rest of the machine
+        results[str(scale)] = {
+            stage: sorted((run[stage] for run in runs), key=lambda r: r["seconds"])[(repeat - 1) // 2]
+            for stage in STAGES
+        }
+
+    return results
+
+
+def growth_exponent(results: dict[str, dict[str, dict]], stage: str) -> float:
+    """Exponent k of ``time ~ size^k`` between the smallest and the largest scale."""
+
+    low, high = str(SCALES[0]), str(SCALES[-1])
+    ratio = results[high][stage]["seconds"] / max(results[low][stage]["seconds"], 1e-9)
+
+    return math.log(ratio) / math.log(SCALES[-1] / SCALES[0])
+
+
+def compare(
+    name: str,
+    results: dict[str, dict[str, dict]],
+    baseline: dict[str, dict[str, dict]] | None,
+    tolerance: float | None,
+    max_exponent: float
+) -> list[str]:
+    failures = []
+
+    for stage in STAGES:
+        exponent = growth_exponent(results, stage)
+        line = f"{name:<16} {stage:<22} exponent {exponent:5.2f}"
+
+        for scale in map(str, SCALES):
+            line += f" | x{scale} {results[scale][stage]['seconds'] * 1000:9.1f} ms"
+            if "commands" in results[scale][stage]:
+                line += f" {results[scale][stage]['commands']:6} cmds"
+
+            if baseline is not None and scale in baseline and stage in baseline[scale]:
+                ratio = results[scale][stage]["seconds"] / max(baseline[scale][stage]["seconds"], 1e-9)
+                line += f" ({ratio:4.2f}x)"
+
+                if tolerance is not None and ratio > tolerance:
+                    failures.append(f"{name}/{stage} x{scale} is {ratio:.2f}x slower than the baseline.")
+
+                # executed commands don't depend on the machine, so any increase is a regression
+                commands = results[scale][stage].get("commands")
+                baseline_commands = baseline[scale][stage].get("commands")
+                if commands is not None and baseline_commands is not None and commands > baseline_commands:
+                    failures.append(
+                        f"{name}/{stage} x{scale} executes {commands} commands, {baseline_commands} in the baseline."
+                    )
+
+        if exponent > max_exponent:
+            failures.append(f"{name}/{stage} grows with exponent {exponent:.2f}.")
+
+        print(line)
+
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("benchmarks", nargs="*", default=list(BENCHMARKS))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--tolerance", type=float, default=None,
+        help="fail if the median time of a stage is more than this many times the one of the baseline"
+    )
+    parser.add_argument("--max-exponent", type=float, default=1.5)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        print(json.dumps(run_once(generate.ProgramConfig(**json.loads(args.child)))))
+        return
+
+    baselines = json.loads(BASELINE.read_text("utf-8")) if BASELINE.exists() else {}
+    failures = []
+
+    for name in args.benchmarks:
+        results = run_benchmark(BENCHMARKS[name], args.repeat)
+        failures += compare(name, results, baselines.get(name), args.tolerance, args.max_exponent)
+        baselines[name] = results
+
+    if args.update_baseline:
+        BASELINE.write_text(json.dumps(baselines, indent=2) + "\n", "utf-8")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+
+    sys.exit(1 if failures and not args.update_baseline else 0)
+
+
+if __name__ == '__main__':
+    main()
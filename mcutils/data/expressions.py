@@ -13,48 +13,103 @@ from ..ir import blocks, tree, tree_statements_base
 from ..lib import std
 
 _ARG_PRIMITIVES: dict[int, stores.NbtStore[stores.AnyDataType]] = {}
-_FETCH_TEMP = stores.NbtStore[stores.AnyDataType]("storage", "mcutils:expr_temp", "fetch")
+_FETCH_TEMP = std.temporary(stores.NbtStore[stores.AnyDataType]("storage", "mcutils:expr_temp", "fetch"))
+
+_REGISTERS: dict[int, tuple[stores.ScoreboardStore, stores.NbtStore[stores.AnyDataType]]] = {}
 
 
 def get_temp_var(i: int) -> stores.NbtStore[stores.AnyDataType]:
-    if i in _ARG_PRIMITIVES:
-        return _ARG_PRIMITIVES[i]
-    else:
-        _ARG_PRIMITIVES[i] = stores.NbtStore("storage", "mcutils:expr_temp", f"tmp{i}")
-        return _ARG_PRIMITIVES[i]
+    if i not in _ARG_PRIMITIVES:
+        _ARG_PRIMITIVES[i] = std.temporary(stores.NbtStore("storage", "mcutils:expr_temp", f"tmp{i}"))
+
+    return _ARG_PRIMITIVES[i]
+
+
+def get_register(i: int, dtype: typing.Type[stores.DataType]) -> stores.PrimitiveWritableStore:
+    """A score for whole numbers, an nbt tag for anything else."""
+
+    if i not in _REGISTERS:
+        _REGISTERS[i] = (
+            # a plain name like the temps of stores_conv, unique strings would take ids in the middle of lowering
+            std.temporary(stores.ScoreboardStore(f"expr_reg{i}", stores_conv.STD_TEMP_OBJECTIVE)),
+            std.temporary(stores.NbtStore[stores.AnyDataType]("storage", "mcutils:expr_temp", f"reg{i}")),
+        )
+
+    score, nbt = _REGISTERS[i]
+
+    return score if issubclass(dtype, stores.WholeNumberType) else nbt.with_dtype(dtype)
+
+
+def contains_call(src: stores.ReadableStore) -> bool:
+    if isinstance(src, FunctionCallExpression):
+        return True
+
+    return isinstance(src, ExpressionBase) and any(map(contains_call, src.args))
 
 
 def fetch(
     src: stores.ReadableStore,
-    dst: stores.PrimitiveWritableStore | None
+    dst: stores.PrimitiveWritableStore | None,
+    first_register: int = 0
 ) -> list[tree_statements_base.Statement]:
+    """Evaluate an expression into ``dst``.
+
+    The args of an expression are evaluated into registers from ``first_register`` on, which are live until the
+    expression is computed from them, so nested expressions use the registers after them. Calls may clobber
+    registers, so args that are live across a call are kept on the stack instead.
+    """
+
     if isinstance(src, ExpressionBase):
         if len(src.args) == 1:
             return [
-                *fetch(src.args[0], _FETCH_TEMP.with_dtype(src.args[0].dtype_obj)),
+                *fetch(src.args[0], _FETCH_TEMP.with_dtype(src.args[0].dtype_obj), first_register),
                 *src.fetch_to((_FETCH_TEMP,), dst),
             ]
         else:
             out = []
             out2 = []
             temp_vars: list[stores.PrimitiveReadableStore] = []
+            # args up to the last one that contains a call are live across a call
+            last_call = max((i for i, arg in enumerate(src.args) if contains_call(arg)), default=-1)
+            register = first_register
+
             for i, arg in enumerate(src.args):
                 if isinstance(arg, stores.PrimitiveReadableStore):
                     # TODO: This does not hold for recursion, I believe
                     temp_vars.append(arg)
-                else:
+                elif i < last_call:
                     temp_var = get_temp_var(i).with_dtype(arg.dtype_obj)
                     temp_vars.append(temp_var)
 
+                    # evaluated in a register, which is free again once the value is on the stack
+                    pushed = get_register(register, arg.dtype_obj)
+
                     out += [
-                        *fetch(arg, _FETCH_TEMP.with_dtype(arg.dtype_obj)),
-                        tree.StackPushStatement(_FETCH_TEMP),
+                        *fetch(arg, pushed, register + 1),
+                        tree.StackPushStatement(pushed),
                     ]
                     out2 += [
                         tree.StackPopStatement(temp_var)
                     ]
+                elif i == last_call:
+                    # no call follows, so the value does not need to be pushed
+                    temp_var = get_temp_var(i).with_dtype(arg.dtype_obj)
+                    temp_vars.append(temp_var)
+                    # nested expressions use the same temp vars for their args, but never the fetch temp
+                    fetched = _FETCH_TEMP.with_dtype(arg.dtype_obj)
+
+                    out += [
+                        *fetch(arg, fetched, register),
+                        blocks.SimpleAssignmentStatement(fetched, temp_var),
+                    ]
+                    # pops are calls, too, so they have to come before any register is used
+                    out += reversed(out2)
+                else:
+                    temp_var = get_register(register, arg.dtype_obj)
+                    temp_vars.append(temp_var)
+                    register += 1
 
-            out += reversed(out2)
+                    out += fetch(arg, temp_var, register)
 
             out += src.fetch_to(tuple(temp_vars), dst)
 
@@ -64,6 +119,43 @@ def fetch(
             return [blocks.SimpleAssignmentStatement(src, dst)]
 
 
+def fetch_comparison(
+    condition: stores.ReadableStore
+) -> tuple[list[tree_statements_base.Statement], blocks.ScoreComparison] | None:
+    """Evaluate the operands of a comparison of whole numbers into scores, so that ``execute if score`` can test it.
+
+    Returns None for any other condition, which has to be fetched to a score instead.
+    """
+
+    match condition:
+        case BinOpExpression(left=left, op="==" | "!=" | "<" | "<=" | ">" | ">=" as op, right=right) if (
+            left.is_data_type(stores.WholeNumberType) and right.is_data_type(stores.WholeNumberType)
+            # a call in the right operand may clobber the register of the left one
+            and not contains_call(right)
+        ):
+            pass
+        case _:
+            return None
+
+    out = []
+    operands = []
+
+    for register, operand in enumerate((left, right)):
+        if isinstance(operand, (stores.ScoreboardStore, stores.ConstInt)):
+            operands.append(operand)
+        else:
+            score = get_register(register, stores.WholeNumberType)
+            operands.append(score)
+            out += fetch(operand, score, register + 1)
+
+    comparison = blocks.ScoreComparison.from_operands(operands[0], op, operands[1])
+
+    if comparison is None:
+        return None
+
+    return out, comparison
+
+
 class ExpressionBase(stores.ReadableStore):
     args: tuple[stores.ReadableStore, ...]
 
@@ -105,9 +197,9 @@ class BinOpExpression(ExpressionBase):
     op: typing.Literal["+", "-", "*", "/", "%", "==", "!=", "<", ">", "<=", ">=", "and", "or"]
     right: stores.ReadableStore
 
-    _TEMP1: typing.ClassVar = std.get_temp_var("expr_temp1")
-    _TEMP2: typing.ClassVar = std.get_temp_var("expr_temp2")
-    _TEMP3: typing.ClassVar = std.get_temp_var("expr_temp3")
+    _TEMP1: typing.ClassVar = std.temporary(std.get_temp_var("expr_temp1"))
+    _TEMP2: typing.ClassVar = std.temporary(std.get_temp_var("expr_temp2"))
+    _TEMP3: typing.ClassVar = std.temporary(std.get_temp_var("expr_temp3"))
 
     @property
     def args(self):
@@ -183,6 +183,9 @@ def nbt_to_nbt(src: NbtStore, dst: NbtStore, scale: float = 1) -> list[String]:
                 f"information to both NbtVars."
             )
         assert scale == 1
+        # the scaled conversion keeps decimals, but overflows for whole numbers of more than 2.147
+        if src.is_data_type(WholeNumberType) or dst.is_data_type(WholeNumberType):
+            return [nbt_to_nbt_execute_store(src, dst)]
         return [nbt_number_to_nbt_number(src, dst)]
 
     # Counting items:
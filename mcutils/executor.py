@@ -0,0 +1,1047 @@
+"""A pure-Python executor for the commands that mcutils emits, to test and benchmark exported datapacks without a
+Minecraft server.
+
+The executor loads the output directory of ``Datapack.export`` (or a single pack in it), runs functions and counts
+the commands that they execute::
+
+    executor = Executor.load(pathlib.Path("testout"))
+    executor.run("test:main")
+    print(executor.output, executor.commands_executed)
+
+or ``python -m mcutils.executor testout test:main``. Only the subset of commands that mcutils emits is supported, any
+other command raises an ExecutionError. There are no players, chunks or blocks except for block entity data, and
+functions run like in Minecraft 1.20.3+: a called function runs to its end before the next command of its caller,
+``execute store ... run function`` stores the value of ``return``. Every command of a function counts once towards
+``commands_executed`` and the ``maxCommandChainLength`` game rule, which stops a run like in game. Macro functions
+take their arguments from a compound, ``function ... with`` is not supported.
+"""
+
+from __future__ import annotations
+
+import argparse
+import collections
+import copy
+import dataclasses
+import json
+import math
+import pathlib
+import re
+import typing
+
+import nbtlib
+from nbtlib import path as nbt_path
+
+from .ir import constant_folding
+
+Position = tuple[float, float, float]
+
+# (success, result) of a command, which execute store stores
+Result = tuple[bool, int]
+
+_INT_MIN, _INT_MAX = -2 ** 31, 2 ** 31 - 1
+
+_NBT_TYPES: dict[str, typing.Callable[[float], nbtlib.Base]] = {
+    "byte": lambda value: nbtlib.Byte(_clamp(int(value), -2 ** 7, 2 ** 7 - 1)),
+    "short": lambda value: nbtlib.Short(_clamp(int(value), -2 ** 15, 2 ** 15 - 1)),
+    "int": lambda value: nbtlib.Int(_clamp(int(value), _INT_MIN, _INT_MAX)),
+    "long": lambda value: nbtlib.Long(_clamp(int(value), -2 ** 63, 2 ** 63 - 1)),
+    "float": nbtlib.Float,
+    "double": nbtlib.Double,
+}
+
+_COMPARISONS = {"<": "<", "<=": "<=", "=": "==", ">=": ">=", ">": ">"}
+
+_MACRO_ARGUMENT = re.compile(r"\$\((\w+)\)")
+
+
+class ExecutionError(Exception):
+    pass
+
+
+class _CommandFailure(Exception):
+    """A command that fails in game, e.g. without the entity that it needs, which does not stop the function."""
+
+
+def _substitute(command: str, frame: _Frame) -> str:
+    def argument(match: re.Match) -> str:
+        if frame.arguments is None or match[1] not in frame.arguments:
+            raise ExecutionError(f"Missing macro argument {match[1]!r} in {frame.function}.")
+
+        return frame.arguments[match[1]]
+
+    return _MACRO_ARGUMENT.sub(argument, command)
+
+
+def _clamp(value: int, low: int, high: int) -> int:
+    return min(max(value, low), high)
+
+
+def _floor(value: float) -> int:
+    return _clamp(math.floor(value), _INT_MIN, _INT_MAX)
+
+
+@dataclasses.dataclass
+class _Reader:
+    """Splits a command into tokens. Brackets, braces and quotes keep their content in one token."""
+
+    text: str
+    pos: int = 0
+
+    def _skip_spaces(self):
+        while self.pos < len(self.text) and self.text[self.pos] == " ":
+            self.pos += 1
+
+    def at_end(self) -> bool:
+        self._skip_spaces()
+        return self.pos >= len(self.text)
+
+    def peek(self) -> str:
+        return dataclasses.replace(self).token()
+
+    def token(self) -> str:
+        self._skip_spaces()
+        start = self.pos
+        depth = 0
+        quote = None
+
+        while self.pos < len(self.text):
+            char = self.text[self.pos]
+
+            if quote is not None:
+                if char == "\\":
+                    self.pos += 1
+                elif char == quote:
+                    quote = None
+            elif char in "\"'":
+                quote = char
+            elif char in "[{(":
+                depth += 1
+            elif char in "]})":
+                depth -= 1
+            elif char == " " and depth == 0:
+                break
+
+            self.pos += 1
+
+        if start == self.pos:
+            raise ExecutionError(f"Expected an argument at the end of {self.text!r}.")
+
+        return self.text[start:self.pos]
+
+    def rest(self) -> str:
+        self._skip_spaces()
+        rest, self.pos = self.text[self.pos:], len(self.text)
+        return rest
+
+
+def _split_arguments(text: str) -> list[str]:
+    """Split the arguments of a selector or a ``scores`` argument at the commas that are not nested."""
+
+    out = []
+    depth = 0
+    start = 0
+
+    for i, char in enumerate(text):
+        if char in "[{":
+            depth += 1
+        elif char in "]}":
+            depth -= 1
+        elif char == "," and depth == 0:
+            out.append(text[start:i].strip())
+            start = i + 1
+
+    if text[start:].strip():
+        out.append(text[start:].strip())
+
+    return out
+
+
+def _range(text: str) -> tuple[int, int]:
+    low, sep, high = text.partition("..")
+
+    if not sep:
+        return int(text), int(text)
+
+    return int(low) if low else _INT_MIN, int(high) if high else _INT_MAX
+
+
+def _namespaced(name: str) -> str:
+    return name if ":" in name else f"minecraft:{name}"
+
+
+@dataclasses.dataclass
+class Entity:
+    uuid: str
+    type: str
+    nbt: nbtlib.Compound
+
+    @property
+    def tags(self) -> list[str]:
+        return [str(tag) for tag in self.nbt.get("Tags", [])]
+
+    @property
+    def position(self) -> Position:
+        x, y, z = map(float, self.nbt["Pos"])
+        return x, y, z
+
+    def set_tags(self, tags: list[str]):
+        self.nbt["Tags"] = nbtlib.List[nbtlib.String](map(nbtlib.String, tags))
+
+
+@dataclasses.dataclass(frozen=True)
+class Context:
+    entity: Entity | None = None
+    position: Position = (0.0, 0.0, 0.0)
+
+
+@dataclasses.dataclass
+class _Frame:
+    function: str
+    commands: list[str]
+    context: Context
+    # receives the value of return, None if the function ends without one
+    on_return: typing.Callable[[Result | None], None] | None = None
+    index: int = 0
+    returned: bool = False
+    # None if a return run function passed the on_return to the function that it runs
+    return_value: Result | None = None
+    # the arguments of a macro function, which its lines starting with $ substitute
+    arguments: dict[str, str] | None = None
+
+
+@dataclasses.dataclass
+class Executor:
+    functions: dict[str, list[str]] = dataclasses.field(default_factory=dict)
+    function_tags: dict[str, list[str]] = dataclasses.field(default_factory=dict)
+
+    objectives: dict[str, str] = dataclasses.field(default_factory=dict)
+    scores: dict[str, dict[str, int]] = dataclasses.field(default_factory=dict)
+    storage: dict[str, nbtlib.Compound] = dataclasses.field(default_factory=dict)
+    blocks: dict[tuple[int, int, int], nbtlib.Compound] = dataclasses.field(default_factory=dict)
+    entities: list[Entity] = dataclasses.field(default_factory=list)
+    game_rules: dict[str, str] = dataclasses.field(default_factory=lambda: {"maxCommandChainLength": "65536"})
+    # the text of tellraw and say
+    output: list[str] = dataclasses.field(default_factory=list)
+
+    game_time: int = 0
+    # (tick, function) of schedule function
+    scheduled: list[tuple[int, str]] = dataclasses.field(default_factory=list)
+
+    commands_executed: int = 0
+    function_calls: collections.Counter[str] = dataclasses.field(default_factory=collections.Counter)
+    # commands executed in each function, not counting the functions that it calls
+    function_commands: collections.Counter[str] = dataclasses.field(default_factory=collections.Counter)
+    # whether the last run hit maxCommandChainLength
+    truncated: bool = False
+
+    _entity_ids: int = 0
+    _stack: list[_Frame] = dataclasses.field(default_factory=list, repr=False)
+    _pending: list[_Frame] = dataclasses.field(default_factory=list, repr=False)
+
+    @classmethod
+    def load(cls, path: pathlib.Path) -> Executor:
+        """Load the functions and function tags of a pack, or of every pack in a directory."""
+
+        out = cls()
+        packs = [path] if (path / "pack.mcmeta").exists() else [p for p in path.iterdir() if (p / "data").is_dir()]
+
+        for pack in packs:
+            for namespace in (pack / "data").iterdir():
+                # the folders were renamed in pack format 45
+                for folder in ("functions", "function"):
+                    for file in sorted((namespace / folder).rglob("*.mcfunction")):
+                        name = file.relative_to(namespace / folder).with_suffix("").as_posix()
+                        out.functions[f"{namespace.name}:{name}"] = file.read_text("utf-8").splitlines()
+
+                    for file in sorted((namespace / "tags" / folder).rglob("*.json")):
+                        name = file.relative_to(namespace / "tags" / folder).with_suffix("").as_posix()
+                        values = json.loads(file.read_text("utf-8"))["values"]
+                        out.function_tags.setdefault(f"{namespace.name}:{name}", []).extend(
+                            value if isinstance(value, str) else value["id"] for value in values
+                        )
+
+        return out
+
+    def run(self, function: str, context: Context = Context()) -> int:
+        """Run a function (or a function tag, ``#namespace:path``) and return the number of commands executed."""
+
+        before = self.commands_executed
+        self.truncated = False
+
+        for location in reversed(self._resolve_function(function)):
+            self._call(location, context)
+        self._run_stack()
+
+        return self.commands_executed - before
+
+    def tick(self, ticks: int = 1) -> int:
+        """Advance the game time, running the scheduled functions and ``#minecraft:tick``."""
+
+        before = self.commands_executed
+
+        for _ in range(ticks):
+            self.game_time += 1
+
+            due = [function for time, function in self.scheduled if time <= self.game_time]
+            self.scheduled = [(time, function) for time, function in self.scheduled if time > self.game_time]
+
+            for function in due:
+                self.run(function)
+
+            if "minecraft:tick" in self.function_tags:
+                self.run("#minecraft:tick")
+
+        return self.commands_executed - before
+
+    def get_score(self, holder: str, objective: str) -> int | None:
+        return self.scores.get(objective, {}).get(holder)
+
+    def get_storage(self, storage: str, path: str = "") -> nbtlib.Base | None:
+        matches = self._get(self.storage.get(_namespaced(storage), nbtlib.Compound()), path)
+        return matches[0] if matches else None
+
+    # functions
+
+    def _resolve_function(self, name: str) -> list[str]:
+        if not name.startswith("#"):
+            if _namespaced(name) not in self.functions:
+                raise ExecutionError(f"Unknown function {name!r}.")
+            return [_namespaced(name)]
+
+        out = []
+        for value in self.function_tags.get(_namespaced(name[1:]), []):
+            out += self._resolve_function(value)
+        return out
+
+    def _call(self, location: str, context: Context, on_return: typing.Callable[[Result | None], None] | None = None):
+        self.function_calls[location] += 1
+        self._stack.append(_Frame(location, self.functions[location], context, on_return))
+
+    def _run_stack(self):
+        limit = int(self.game_rules["maxCommandChainLength"])
+        executed = 0
+
+        while self._stack:
+            frame = self._stack[-1]
+
+            if frame.index >= len(frame.commands):
+                self._stack.pop()
+                if frame.on_return is not None:
+                    frame.on_return(None)
+                continue
+
+            command = frame.commands[frame.index].strip()
+            frame.index += 1
+
+            if not command or command.startswith("#"):
+                continue
+
+            if command.startswith("$"):
+                command = _substitute(command[1:], frame)
+
+            if executed >= limit:
+                self.truncated = True
+                self._stack.clear()
+                break
+
+            executed += 1
+            self.commands_executed += 1
+            self.function_commands[frame.function] += 1
+
+            try:
+                self._command(_Reader(command), frame.context, frame, ())
+            except _CommandFailure:
+                pass
+            except ExecutionError as e:
+                self._stack.clear()
+                raise ExecutionError(f"{e} In {frame.function}, line {frame.index}: {command}") from e
+
+            if frame.returned:
+                # the function that returned is still on top, the functions that the command called are pending
+                self._stack.remove(frame)
+                if frame.on_return is not None and frame.return_value is not None:
+                    frame.on_return(frame.return_value)
+
+            # called functions run before the next command, in the order of their calls
+            self._stack += reversed(self._pending)
+            self._pending.clear()
+
+    # commands
+
+    def _command(
+        self,
+        reader: _Reader,
+        context: Context,
+        frame: _Frame,
+        stores: tuple[typing.Callable[[Result], None], ...]
+    ):
+        name = reader.token()
+
+        match name:
+            case "execute":
+                return self._execute(reader, context, frame, stores)
+            case "function":
+                def on_return(result: Result | None):
+                    if result is not None:
+                        for store in stores:
+                            store(result)
+
+                return self._function(reader, context, on_return)
+            case "return":
+                return self._return(reader, context, frame)
+
+        handler = getattr(self, f"_command_{name}", None)
+        if handler is None:
+            raise ExecutionError(f"Unsupported command {name!r}.")
+
+        try:
+            result = handler(reader, context)
+        except _CommandFailure:
+            result = False, 0
+
+        for store in stores:
+            store(result)
+
+    def _function(
+        self,
+        reader: _Reader,
+        context: Context,
+        on_return: typing.Callable[[Result | None], None] | None
+    ):
+        function = reader.token()
+        arguments = None
+
+        if not reader.at_end():
+            if reader.peek() == "with":
+                raise ExecutionError("Macro arguments from data are not supported.")
+
+            arguments = {
+                key: str(value) if isinstance(value, nbtlib.String) else value.snbt()
+                for key, value in nbtlib.parse_nbt(reader.rest()).items()
+            }
+
+        for location in self._resolve_function(function):
+            self.function_calls[location] += 1
+            self._pending.append(_Frame(location, self.functions[location], context, on_return, arguments=arguments))
+
+    def _return(self, reader: _Reader, context: Context, frame: _Frame):
+        frame.returned = True
+        argument = reader.token()
+
+        if argument == "fail":
+            frame.return_value = False, 0
+        elif argument != "run":
+            frame.return_value = True, int(argument)
+        elif reader.peek() == "function":
+            # the called function returns for this one
+            frame.return_value = None
+            reader.token()
+            self._function(reader, context, frame.on_return)
+        else:
+            frame.return_value = False, 0
+
+            def store(result: Result):
+                frame.return_value = result
+
+            self._command(reader, context, frame, (store,))
+
+    def _execute(
+        self,
+        reader: _Reader,
+        context: Context,
+        frame: _Frame,
+        stores: tuple[typing.Callable[[Result], None], ...]
+    ):
+        if frame.returned:
+            # return ended the function in an earlier branch
+            return
+
+        if reader.at_end():
+            for store in stores:
+                store((True, 1))
+            return
+
+        subcommand = reader.token()
+
+        match subcommand:
+            case "run":
+                self._command(reader, context, frame, stores)
+            case "as" | "at":
+                for entity in self._select(reader.token(), context):
+                    branch = (
+                        dataclasses.replace(context, entity=entity) if subcommand == "as"
+                        else dataclasses.replace(context, position=entity.position)
+                    )
+                    self._execute(dataclasses.replace(reader), branch, frame, stores)
+            case "positioned":
+                position = self._position(reader, context)
+                self._execute(reader, dataclasses.replace(context, position=position), frame, stores)
+            case "if" | "unless":
+                value = self._condition(reader, context)
+                passed = bool(value) == (subcommand == "if")
+
+                if reader.at_end():
+                    # a condition at the end is the result of the command, also if it fails
+                    for store in stores:
+                        store((passed, value if subcommand == "if" else int(passed)))
+                elif passed:
+                    self._execute(reader, context, frame, stores)
+            case "store":
+                store = self._store_target(reader, context)
+                self._execute(reader, context, frame, (*stores, store))
+            case _:
+                raise ExecutionError(f"Unsupported execute subcommand {subcommand!r}.")
+
+    def _condition(self, reader: _Reader, context: Context) -> int:
+        kind = reader.token()
+
+        match kind:
+            case "score":
+                (holder,) = self._holders(reader.token(), context)
+                value = self.get_score(holder, reader.token())
+                op = reader.token()
+
+                if op == "matches":
+                    low, high = _range(reader.token())
+                    return int(value is not None and low <= value <= high)
+
+                (other,) = self._holders(reader.token(), context)
+                other_value = self.get_score(other, reader.token())
+
+                if value is None or other_value is None or op not in _COMPARISONS:
+                    return 0
+                return constant_folding.evaluate(_COMPARISONS[op], value, other_value)
+            case "entity":
+                return len(self._select(reader.token(), context))
+            case "data":
+                root = self._data_target(reader, context)
+                return len(self._get(root, reader.token()))
+
+        raise ExecutionError(f"Unsupported execute condition {kind!r}.")
+
+    def _store_target(self, reader: _Reader, context: Context) -> typing.Callable[[Result], None]:
+        kind = reader.token()
+        target = reader.token()
+
+        def value_of(result: Result) -> int:
+            return result[1] if kind == "result" else int(result[0])
+
+        match target:
+            case "score":
+                holders = self._holders(reader.token(), context)
+                objective = reader.token()
+
+                def store(result: Result):
+                    for holder in holders:
+                        self._set_score(holder, objective, value_of(result))
+
+                return store
+            case "storage" | "entity" | "block":
+                root = self._data_target(reader, context, target)
+                path = reader.token()
+                convert = _NBT_TYPES[reader.token()]
+                scale = float(reader.token())
+
+                def store(result: Result):
+                    self._set(root, path, convert(value_of(result) * scale))
+
+                return store
+
+        raise ExecutionError(f"Unsupported store target {target!r}.")
+
+    def _command_scoreboard(self, reader: _Reader, context: Context) -> Result:
+        kind, action = reader.token(), reader.token()
+
+        if kind == "objectives":
+            match action:
+                case "add":
+                    name = reader.token()
+                    if name in self.objectives:
+                        return False, 0
+                    self.objectives[name] = reader.token()
+                    self.scores[name] = {}
+                    return True, len(self.objectives)
+                case "remove":
+                    name = reader.token()
+                    self.objectives.pop(name, None)
+                    self.scores.pop(name, None)
+                    return True, len(self.objectives)
+
+            raise ExecutionError(f"Unsupported scoreboard objectives action {action!r}.")
+
+        holders = self._holders(reader.token(), context)
+
+        if action == "reset":
+            for holder in holders:
+                for scores in self.scores.values():
+                    scores.pop(holder, None)
+            return True, len(holders)
+
+        objective = reader.token()
+        if objective not in self.objectives:
+            return False, 0
+
+        match action:
+            case "set" | "add" | "remove":
+                amount = int(reader.token())
+                total = 0
+
+                for holder in holders:
+                    value = amount if action == "set" else self.get_score(holder, objective) or 0
+                    if action != "set":
+                        value = constant_folding.wrap(value + (amount if action == "add" else -amount))
+                    self._set_score(holder, objective, value)
+                    total += value
+
+                return True, total
+            case "get":
+                value = self.get_score(holders[0], objective)
+                return (False, 0) if value is None else (True, value)
+            case "operation":
+                op = reader.token()
+                sources = self._holders(reader.token(), context)
+                source_objective = reader.token()
+                if source_objective not in self.objectives:
+                    return False, 0
+
+                for holder in holders:
+                    for source in sources:
+                        self._operation(holder, objective, op, source, source_objective)
+
+                return True, sum(self.get_score(holder, objective) for holder in holders)
+
+        raise ExecutionError(f"Unsupported scoreboard players action {action!r}.")
+
+    def _operation(self, holder: str, objective: str, op: str, source: str, source_objective: str):
+        a = self.get_score(holder, objective) or 0
+        b = self.get_score(source, source_objective) or 0
+
+        match op:
+            case "=":
+                value = b
+            case "<":
+                value = min(a, b)
+            case ">":
+                value = max(a, b)
+            case "><":
+                self._set_score(source, source_objective, a)
+                value = b
+            case "+=" | "-=" | "*=" | "/=" | "%=":
+                # unchanged when dividing by zero
+                value = constant_folding.evaluate(op[0], a, b)
+                value = a if value is None else value
+            case _:
+                raise ExecutionError(f"Unsupported scoreboard operation {op!r}.")
+
+        self._set_score(holder, objective, value)
+
+    def _set_score(self, holder: str, objective: str, value: int):
+        self.scores.setdefault(objective, {})[holder] = value
+
+    def _command_data(self, reader: _Reader, context: Context) -> Result:
+        action = reader.token()
+        root = self._data_target(reader, context)
+
+        match action:
+            case "get":
+                path = reader.token() if not reader.at_end() else ""
+                matches = self._get(root, path)
+                if len(matches) != 1:
+                    return False, 0
+
+                scale = float(reader.token()) if not reader.at_end() else 1.0
+                match matches[0]:
+                    case nbtlib.String() as tag:
+                        # Java strings count UTF-16 code units
+                        return True, len(tag.encode("utf-16-le")) // 2
+                    case nbtlib.Compound() | nbtlib.List() | nbtlib.Array() as tag:
+                        return True, len(tag)
+                    case tag:
+                        return True, _floor(float(tag) * scale)
+            case "modify":
+                path = reader.token()
+                operation = reader.token()
+                index = int(reader.token()) if operation == "insert" else None
+                source = reader.token()
+
+                if source == "value":
+                    values = [nbtlib.parse_nbt(reader.rest())]
+                elif source == "from":
+                    source_root = self._data_target(reader, context)
+                    values = self._get(source_root, reader.token() if not reader.at_end() else "")
+                    if not values:
+                        return False, 0
+                else:
+                    raise ExecutionError(f"Unsupported data modify source {source!r}.")
+
+                return True, self._modify(root, path, operation, index, values[-1])
+            case "merge":
+                root.merge(nbtlib.parse_nbt(reader.rest()))
+                return True, 1
+            case "remove":
+                return True, self._remove(root, reader.token())
+
+        raise ExecutionError(f"Unsupported data action {action!r}.")
+
+    def _data_target(self, reader: _Reader, context: Context, kind: str | None = None) -> nbtlib.Compound:
+        kind = kind or reader.token()
+
+        match kind:
+            case "storage":
+                return self.storage.setdefault(_namespaced(reader.token()), nbtlib.Compound())
+            case "entity":
+                entities = self._select(reader.token(), context)
+                if len(entities) != 1:
+                    raise _CommandFailure()
+                return entities[0].nbt
+            case "block":
+                x, y, z = map(math.floor, self._position(reader, context))
+                return self.blocks.setdefault((x, y, z), nbtlib.Compound())
+
+        raise ExecutionError(f"Unsupported data target {kind!r}.")
+
+    # nbt paths
+
+    @staticmethod
+    def _accessors(path: str) -> list:
+        return list(nbt_path.Path(path)) if path else []
+
+    def _get(self, root: nbtlib.Compound, path: str) -> list[nbtlib.Base]:
+        tags = [root]
+
+        for accessor in self._accessors(path):
+            tags = self._step(tags, accessor, None)
+
+        return tags
+
+    def _step(self, tags: list[nbtlib.Base], accessor, create_for) -> list[nbtlib.Base]:
+        """The tags that an accessor leads to from each of the tags. Missing keys are created if ``create_for`` is
+        the accessor that follows."""
+
+        out = []
+
+        for tag in tags:
+            match accessor:
+                case nbt_path.NamedKey(key=key) if isinstance(tag, nbtlib.Compound):
+                    if key not in tag and create_for is not None:
+                        tag[key] = nbtlib.List() if isinstance(create_for, nbt_path.ListIndex) else nbtlib.Compound()
+                    if key in tag:
+                        out.append(tag[key])
+                case nbt_path.ListIndex(index=None) if isinstance(tag, (nbtlib.List, nbtlib.Array)):
+                    out += tag
+                case nbt_path.ListIndex(index=index) if isinstance(tag, (nbtlib.List, nbtlib.Array)):
+                    if -len(tag) <= index < len(tag):
+                        out.append(tag[index])
+                case nbt_path.CompoundMatch(compound=compound) if isinstance(tag, nbtlib.Compound):
+                    if tag.match(compound):
+                        out.append(tag)
+
+        return out
+
+    def _slots(self, root: nbtlib.Compound, path: str) -> list[tuple[nbtlib.Compound | nbtlib.List, str | int]]:
+        """The containers and keys of the tags of a path, creating missing compounds on the way."""
+
+        accessors = self._accessors(path)
+        if not accessors:
+            raise ExecutionError("Cannot modify the root of a data target.")
+
+        tags = [root]
+        for accessor, following in zip(accessors, accessors[1:]):
+            tags = self._step(tags, accessor, following)
+
+        out = []
+        for tag in tags:
+            match accessors[-1]:
+                case nbt_path.NamedKey(key=key) if isinstance(tag, nbtlib.Compound):
+                    out.append((tag, key))
+                case nbt_path.ListIndex(index=None) if isinstance(tag, nbtlib.List):
+                    out += ((tag, i) for i in range(len(tag)))
+                case nbt_path.ListIndex(index=index) if isinstance(tag, nbtlib.List) and -len(tag) <= index < len(tag):
+                    out.append((tag, index % len(tag)))
+
+        return out
+
+    def _set(self, root: nbtlib.Compound, path: str, value: nbtlib.Base) -> int:
+        slots = self._slots(root, path)
+
+        for container, key in slots:
+            if isinstance(container, nbtlib.List) and container and type(container[0]) is not type(value):
+                # lists keep the type of their elements
+                value = type(container[0])(value)
+            container[key] = copy.deepcopy(value)
+
+        return len(slots)
+
+    def _modify(self, root: nbtlib.Compound, path: str, operation: str, index: int | None, value: nbtlib.Base) -> int:
+        if operation == "set":
+            return self._set(root, path, value)
+
+        if operation == "merge":
+            if not self._get(root, path):
+                self._set(root, path, nbtlib.Compound())
+
+            targets = self._get(root, path)
+            for target in targets:
+                target.merge(copy.deepcopy(value))
+            return len(targets)
+
+        slots = self._slots(root, path)
+
+        for container, key in slots:
+            if isinstance(container, nbtlib.Compound) and key not in container:
+                container[key] = nbtlib.List()
+
+            items = [*container[key]]
+            items.insert({"append": len(items), "prepend": 0, "insert": index}[operation], copy.deepcopy(value))
+            container[key] = nbtlib.List(items)
+
+        return len(slots)
+
+    def _remove(self, root: nbtlib.Compound, path: str) -> int:
+        slots = self._slots(root, path)
+
+        # backwards, so that the indices of a list stay valid
+        for container, key in reversed(slots):
+            if isinstance(container, nbtlib.Compound) and key not in container:
+                continue
+            del container[key]
+
+        return len(slots)
+
+    # entities
+
+    def _select(self, selector: str, context: Context) -> list[Entity]:
+        kind, _, arguments = selector.partition("[")
+
+        match kind:
+            case "@s":
+                candidates = [context.entity] if context.entity in self.entities else []
+            case "@e":
+                candidates = list(self.entities)
+            case "@a" | "@p" | "@r":
+                # no players
+                return []
+            case _:
+                raise ExecutionError(f"Unsupported selector {selector!r}.")
+
+        limit = None
+
+        for argument in _split_arguments(arguments.removesuffix("]")):
+            key, _, value = (part.strip() for part in argument.partition("="))
+            negate = value.startswith("!")
+            value = value.removeprefix("!")
+
+            match key:
+                case "tag":
+                    candidates = [e for e in candidates if (value in e.tags if value else not e.tags) != negate]
+                case "type":
+                    candidates = [e for e in candidates if (e.type == _namespaced(value)) != negate]
+                case "limit":
+                    limit = int(value)
+                case "sort" if value in ("arbitrary", "nearest", "furthest"):
+                    if value != "arbitrary":
+                        candidates.sort(
+                            key=lambda e: math.dist(e.position, context.position), reverse=value == "furthest"
+                        )
+                case "scores":
+                    for score in _split_arguments(value.strip("{}")):
+                        objective, _, range_ = (part.strip() for part in score.partition("="))
+                        low, high = _range(range_)
+                        candidates = [
+                            e for e in candidates
+                            if (value := self.get_score(e.uuid, objective)) is not None and low <= value <= high
+                        ]
+                case _:
+                    raise ExecutionError(f"Unsupported selector argument {key!r}.")
+
+        return candidates[:limit]
+
+    def _holders(self, holder: str, context: Context) -> list[str]:
+        if holder.startswith("@"):
+            return [entity.uuid for entity in self._select(holder, context)]
+
+        return [holder]
+
+    def _position(self, reader: _Reader, context: Context) -> Position:
+        out = []
+
+        for origin in context.position:
+            coordinate = reader.token()
+
+            if coordinate.startswith("^"):
+                raise ExecutionError("Local coordinates are not supported.")
+
+            if coordinate.startswith("~"):
+                out.append(origin + float(coordinate[1:] or 0))
+            else:
+                out.append(float(coordinate))
+
+        x, y, z = out
+        return x, y, z
+
+    def _command_summon(self, reader: _Reader, context: Context) -> Result:
+        type_ = _namespaced(reader.token())
+        position = self._position(reader, context) if not reader.at_end() else context.position
+        nbt = nbtlib.parse_nbt(reader.rest()) if not reader.at_end() else nbtlib.Compound()
+
+        self._entity_ids += 1
+        entity = Entity(uuid=f"00000000-0000-0000-0000-{self._entity_ids:012x}", type=type_, nbt=nbt)
+        entity.nbt["id"] = nbtlib.String(type_)
+        entity.nbt["Pos"] = nbtlib.List[nbtlib.Double](map(nbtlib.Double, position))
+        if type_ == "minecraft:marker":
+            entity.nbt.setdefault("data", nbtlib.Compound())
+
+        self.entities.append(entity)
+        return True, 1
+
+    def _command_kill(self, reader: _Reader, context: Context) -> Result:
+        entities = self._select(reader.token(), context) if not reader.at_end() else [context.entity]
+
+        for entity in entities:
+            self.entities.remove(entity)
+            for scores in self.scores.values():
+                scores.pop(entity.uuid, None)
+
+        return bool(entities), len(entities)
+
+    def _command_tag(self, reader: _Reader, context: Context) -> Result:
+        entities = self._select(reader.token(), context)
+        action = reader.token()
+
+        if action == "list":
+            return True, sum(len(entity.tags) for entity in entities)
+
+        tag = reader.token()
+        changed = 0
+
+        for entity in entities:
+            tags = entity.tags
+            if (action == "add") != (tag in tags):
+                entity.set_tags([*tags, tag] if action == "add" else [t for t in tags if t != tag])
+                changed += 1
+
+        return bool(changed), changed
+
+    def _command_tp(self, reader: _Reader, context: Context) -> Result:
+        first = reader.token()
+
+        if not first.startswith("@"):
+            raise ExecutionError("Teleporting the executing entity without a selector is not supported.")
+
+        if reader.at_end():
+            entities = [context.entity]
+            destination = self._select(first, context)[0].position
+        else:
+            entities = self._select(first, context)
+
+            if reader.peek().startswith("@"):
+                destination = self._select(reader.token(), context)[0].position
+            else:
+                destination = self._position(reader, context)
+
+        for entity in entities:
+            entity.nbt["Pos"] = nbtlib.List[nbtlib.Double](map(nbtlib.Double, destination))
+
+        return bool(entities), len(entities)
+
+    _command_teleport = _command_tp
+
+    def _command_tellraw(self, reader: _Reader, context: Context) -> Result:
+        reader.token()
+        self.output.append(self._text(json.loads(reader.rest()), context))
+        return True, 1
+
+    def _command_say(self, reader: _Reader, context: Context) -> Result:
+        self.output.append(reader.rest())
+        return True, 1
+
+    def _command_gamerule(self, reader: _Reader, context: Context) -> Result:
+        rule = reader.token()
+        if not reader.at_end():
+            self.game_rules[rule] = reader.token()
+        value = self.game_rules.get(rule, "0")
+        return True, int(value) if value.lstrip("-").isdigit() else int(value == "true")
+
+    def _command_schedule(self, reader: _Reader, context: Context) -> Result:
+        action = reader.token()
+        function = reader.token()
+
+        if action == "clear":
+            count = sum(scheduled == function for _, scheduled in self.scheduled)
+            self.scheduled = [(time, scheduled) for time, scheduled in self.scheduled if scheduled != function]
+            return bool(count), count
+
+        duration = reader.token()
+        ticks = max(int(float(duration.rstrip("tsd")) * {"s": 20, "d": 24000}.get(duration[-1], 1)), 1)
+        mode = reader.token() if not reader.at_end() else "replace"
+
+        if mode == "replace":
+            self.scheduled = [(time, scheduled) for time, scheduled in self.scheduled if scheduled != function]
+
+        self.scheduled.append((self.game_time + ticks, function))
+        return True, self.game_time + ticks
+
+    def _text(self, component, context: Context) -> str:
+        """The plain text of a text component."""
+
+        match component:
+            case str():
+                return component
+            case bool() | int() | float():
+                return str(component).lower() if isinstance(component, bool) else str(component)
+            case list():
+                return "".join(self._text(part, context) for part in component)
+            case dict():
+                if "text" in component:
+                    text = str(component["text"])
+                elif "score" in component:
+                    score = component["score"]
+                    holders = self._holders(score["name"], context)
+                    value = self.get_score(holders[0], score["objective"]) if holders else None
+                    text = "" if value is None else str(value)
+                elif "nbt" in component:
+                    reader = _Reader(next(
+                        f"{kind} {component[kind]}" for kind in ("storage", "entity", "block") if kind in component
+                    ))
+                    matches = self._get(self._data_target(reader, context), component["nbt"])
+                    # strings without quotes, like in game
+                    text = ", ".join(
+                        str(tag) if isinstance(tag, nbtlib.String) else nbtlib.serialize_tag(tag) for tag in matches
+                    )
+                elif "selector" in component:
+                    text = ", ".join(entity.type for entity in self._select(component["selector"], context))
+                else:
+                    text = component.get("translate", "")
+
+                return text + "".join(self._text(part, context) for part in component.get("extra", []))
+
+        raise ExecutionError(f"Invalid text component {component!r}.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", type=pathlib.Path, help="output directory of Datapack.export or a pack in it")
+    parser.add_argument("functions", nargs="+", help="functions or function tags to run, in order")
+    parser.add_argument("--ticks", type=int, default=0, help="ticks to run afterwards, for scheduled functions")
+    parser.add_argument("--top", type=int, default=10, help="number of functions with the most commands to show")
+    args = parser.parse_args()
+
+    executor = Executor.load(args.path)
+
+    for function in args.functions:
+        commands = executor.run(function)
+        print(f"{function}: {commands} commands{' (maxCommandChainLength reached)' if executor.truncated else ''}")
+
+    if args.ticks:
+        print(f"{args.ticks} ticks: {executor.tick(args.ticks)} commands")
+
+    for line in executor.output:
+        print(f"> {line}")
+
+    print(f"{executor.commands_executed} commands in total")
+    for function, commands in executor.function_commands.most_common(args.top):
+        print(f"{commands:>10} {executor.function_calls[function]:>8} calls  {function}")
+
+
+if __name__ == '__main__':
+    main()
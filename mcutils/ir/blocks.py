@@ -4,13 +4,33 @@ import ast
 import dataclasses
 import typing
 
-from . import tree, compile_control_flow
+from . import tree, compile_control_flow, constant_folding, control_flow_graph, inlining, passes
+from .. import strings
 from ..data import stores, expressions, object_model
 from ..errors import compile_assert
 from ..lib import std
 from ..ir import tree_statements_base
 
-_IF_TEMP = std.get_temp_var("conditional")
+# read by the second ConditionalBlockCallStatement of an if after the __if_reset_cond_var block returned
+_IF_TEMP = std.temporary(std.get_temp_var("conditional"), live_out=True)
+
+
+def _conditional_call(
+    condition: stores.ReadableStore,
+    true_block: tuple[str, ...],
+    return_: bool = False
+) -> list[tree_statements_base.Statement]:
+    match expressions.fetch_comparison(condition):
+        case operand_statements, comparison:
+            return [
+                *operand_statements,
+                ConditionalBlockCallStatement(condition=comparison, true_block=true_block, return_=return_)
+            ]
+        case None:
+            return [
+                *expressions.fetch(condition, _IF_TEMP),
+                ConditionalBlockCallStatement(condition=_IF_TEMP, true_block=true_block, return_=return_)
+            ]
 
 
 @dataclasses.dataclass
@@ -20,72 +40,88 @@ class BlockedFunction:
     entry_point: tuple[str, ...] = ()
     symbols: dict[str, stores.ReadableStore | stores.WritableStore] = dataclasses.field(default_factory=dict)
 
-    @staticmethod
-    def _find_free(container, base: tuple[str, ...], name: str):
-        i = 2
-        new_name = name
-        while base + (new_name,) in container:
-            new_name = f"{name}{i}"
-            i += 1
-
-        return base + (new_name,)
-
     @classmethod
     def process_block(
         cls,
         statements: list[tree_statements_base.Statement],
         continuation_info: ContinuationInfo,
         blocks: dict[tuple[str, ...], Block],
-        path: tuple[str, ...] = ()
+        path: tuple[str, ...] = (),
+        names: control_flow_graph.NameAllocator | None = None
     ):
-        b = Block([], continuation_info.with_())
-        blocks[path] = b
+        if names is None:
+            names = control_flow_graph.NameAllocator(taken={*blocks, path})
+
+        # reserve the path, the block is only built once all of its children have been named
+        blocks[path] = Block((), continuation_info)
+        block_statements = []
 
         for statement in statements:
             if isinstance(statement, tree.IfStatement):
                 stmt = IfStatement(
                     condition=statement.condition,
-                    true_block=cls._find_free(blocks, path, "__if_true"),
-                    false_block=cls._find_free(blocks, path, "__if_false")
+                    true_block=names.allocate(path, "__if_true"),
+                    false_block=names.allocate(path, "__if_false")
                 )
 
-                b.statements.append(stmt)
+                block_statements.append(stmt)
                 cls.process_block(statements=statement.true_body, continuation_info=continuation_info,
-                                  path=stmt.true_block, blocks=blocks)
+                                  path=stmt.true_block, blocks=blocks, names=names)
                 cls.process_block(statements=statement.false_body, continuation_info=continuation_info,
-                                  path=stmt.false_block, blocks=blocks)
+                                  path=stmt.false_block, blocks=blocks, names=names)
 
             elif isinstance(statement, tree.WhileLoopStatement):
-                while_path = cls._find_free(blocks, path, "__while")
+                while_path = names.allocate(path, "__while")
 
                 stmt = WhileStatement(
                     condition=statement.condition,
-                    body=while_path
+                    body=while_path,
+                    iterations_per_tick=statement.iterations_per_tick
                 )
 
-                b.statements.append(stmt)
+                block_statements.append(stmt)
                 cls.process_block(
                     statements=statement.body,
                     continuation_info=continuation_info,
                     path=stmt.body,
-                    blocks=blocks
+                    blocks=blocks,
+                    names=names
                 )
             else:
                 compile_assert(not isinstance(statement, tree.NestedStatement))
-                b.statements.append(statement)
+                block_statements.append(statement)
+
+        blocks[path] = Block(tuple(block_statements), continuation_info)
 
     @classmethod
-    def from_tree_function(cls, func: tree.TreeFunction, std_lib_config: StdLibConfig) -> BlockedFunction:
+    def from_tree_function(
+        cls,
+        func: tree.TreeFunction,
+        std_lib_config: StdLibConfig,
+        pass_manager: passes.PassManager | None = None,
+        inliner: inlining.Inliner | None = None,
+        return_commands: bool = False
+    ) -> BlockedFunction:
+        """With ``return_commands``, an if calls its true block with ``return run`` and continues with its false block
+        in place, so the condition is tested once and needs no reset block. This needs pack format 26."""
+
+        if pass_manager is None:
+            pass_manager = passes.middle_end()
+
+        if inliner is None:
+            inliner = inlining.Inliner()
+
         out = cls(
-            blocks={("__return",): Block([], ContinuationInfo(return_=None))},
+            blocks={("__return",): Block((), ContinuationInfo(return_=None))},
             args=func.args,
             entry_point=(),
             symbols=func.scope.collapse().variables
         )
-        cls.process_block(statements=func.statements, blocks=out.blocks,
+        cls.process_block(statements=constant_folding.fold_statements(func.statements), blocks=out.blocks,
                           continuation_info=ContinuationInfo(return_=("__return",)))
 
         out.blocks = compile_control_flow.transform_all(out.blocks)
+        names = control_flow_graph.NameAllocator(taken=set(out.blocks))
 
         for block_path in list(out.blocks.keys()):
             block = out.blocks[block_path]
@@ -93,25 +129,44 @@ class BlockedFunction:
 
             for statement in block.statements:
                 match statement:
+                    case IfStatement(
+                        condition=condition, true_block=true_block, false_block=false_block
+                    ) if not out.blocks[false_block].statements:
+                        # nothing is called if the condition is false, so the true block needs no reset block
+                        new_statements += _conditional_call(condition, true_block)
+                    case IfStatement(
+                        condition=condition, true_block=true_block, false_block=false_block
+                    ) if return_commands:
+                        # return run stops this mcfunction even if the true block does not return, so the false block
+                        # only runs if the condition was false
+                        new_statements += [
+                            *_conditional_call(condition, true_block, return_=True),
+                            BlockCallStatement(false_block)
+                        ]
                     case IfStatement(condition=condition, true_block=true_block, false_block=false_block):
-                        if_reset_cond_var_path = cls._find_free(out.blocks, block_path, "__if_reset_cond_var")
+                        if_reset_cond_var_path = names.allocate(block_path, "__if_reset_cond_var")
                         # noinspection PyTypeChecker
                         if_reset_cond_var = Block(
-                            statements=[
+                            statements=(
                                 BlockCallStatement(true_block),
                                 SimpleAssignmentStatement(
                                     src=stores.ConstInt(1),
                                     dst=_IF_TEMP
                                 ),
-                            ],
+                            ),
 
                             continuation_info=None
                         )
 
                         out.blocks[if_reset_cond_var_path] = if_reset_cond_var
 
+                        match expressions.fetch_comparison(condition):
+                            case operand_statements, comparison:
+                                new_statements += [*operand_statements, comparison.store_success(_IF_TEMP)]
+                            case None:
+                                new_statements += expressions.fetch(condition, _IF_TEMP)
+
                         new_statements += [
-                            *expressions.fetch(condition, _IF_TEMP),
                             ConditionalBlockCallStatement(
                                 condition=_IF_TEMP,
                                 true_block=if_reset_cond_var_path,
@@ -126,51 +181,27 @@ class BlockedFunction:
                     case _:
                         new_statements.append(statement)
 
-            block.statements = new_statements
+            out.blocks[block_path] = dataclasses.replace(block, statements=tuple(new_statements))
 
-        for block in out.blocks.values():
-            new_statements = cls.transform_returns(block.statements)
-            new_statements = cls.transform_assignments(new_statements)
-            new_statements = cls.transform_stack_ops(new_statements, std_lib_config)
-            new_statements = cls.transform_assignments(new_statements)
-            new_statements = cls.transform_stack_ops(new_statements, std_lib_config)
-            new_statements = cls.transform_assignments(new_statements)
-
-            new2_statements = []
-            for statement in new_statements:
-                match statement:
-                    case FunctionCallStatement(
-                        function=function,
-                        compile_time_args=compile_time_args
-                    ) if len(function) == 1 and func.scope.contains(function[0], "pyfunc"):
-                        new2_statements += func.scope.get(function[0], "pyfunc")(*compile_time_args)
-                    case _:
-                        new2_statements.append(statement)
+        context = passes.PassContext(std_lib_config=std_lib_config, scope=func.scope)
 
-            block.statements = new2_statements
+        for block_path, block in out.blocks.items():
+            out.blocks[block_path] = dataclasses.replace(
+                block,
+                statements=tuple(pass_manager.run(block.statements, context))
+            )
 
         used_blocks = out.get_used_blocks(out.entry_point)
-        out.blocks = {k: v for k, v in out.blocks.items() if k in used_blocks}
+        out.blocks = inliner.run({k: v for k, v in out.blocks.items() if k in used_blocks}, out.entry_point)
 
         return out
 
-    def _get_used_blocks(self, block: tuple[str, ...], out: set[tuple[str, ...]]):
-        if block in out:
-            return
-
-        out.add(block)
-
-        for call in self.blocks[block].get_calls():
-            self._get_used_blocks(call, out)
-
     def get_used_blocks(self, block: tuple[str, ...]) -> set[tuple[str, ...]]:
-        out = set()
-        self._get_used_blocks(block, out)
-        return out
+        return control_flow_graph.ControlFlowGraph.from_blocks(self.blocks).reachable_paths(block)
 
     @staticmethod
     def transform_returns(
-        statements: list[tree_statements_base.Statement]
+        statements: typing.Sequence[tree_statements_base.Statement]
     ) -> list[tree_statements_base.Statement]:
         out = []
 
@@ -185,7 +216,9 @@ class BlockedFunction:
         return out
 
     @staticmethod
-    def transform_assignments(statements: list[tree_statements_base.Statement]) -> list[tree_statements_base.Statement]:
+    def transform_assignments(
+        statements: typing.Sequence[tree_statements_base.Statement]
+    ) -> list[tree_statements_base.Statement]:
         out = []
 
         for statement in statements:
@@ -197,9 +230,28 @@ class BlockedFunction:
 
         return out
 
+    @staticmethod
+    def expand_pyfuncs(
+        statements: typing.Sequence[tree_statements_base.Statement],
+        scope: tree.Scope
+    ) -> list[tree_statements_base.Statement]:
+        out = []
+
+        for statement in statements:
+            match statement:
+                case FunctionCallStatement(
+                    function=function,
+                    compile_time_args=compile_time_args
+                ) if len(function) == 1 and scope.contains(function[0], "pyfunc"):
+                    out += scope.get(function[0], "pyfunc")(*compile_time_args)
+                case _:
+                    out.append(statement)
+
+        return out
+
     @staticmethod
     def transform_stack_ops(
-        statements: list[tree_statements_base.Statement],
+        statements: typing.Sequence[tree_statements_base.Statement],
         std_lib_config: StdLibConfig
     ) -> list[tree_statements_base.Statement]:
         out = []
@@ -234,28 +286,29 @@ class BlockedFunction:
 class ContinuationInfo:
     return_: tuple[str, ...] | None
     default: tuple[str, ...] | None = None
-    loops: list[LoopContinuationInfo] = dataclasses.field(default_factory=list)
-    children: list[ContinuationInfo] = dataclasses.field(default_factory=list)
+    loops: tuple[LoopContinuationInfo, ...] = ()
+    children: tuple[ContinuationInfo, ...] = ()
 
     def with_(self, default: tuple[str, ...] | None = None,
-              new_loops: list[LoopContinuationInfo] = None) -> typing.Self:
+              new_loops: tuple[LoopContinuationInfo, ...] = ()) -> typing.Self:
         # noinspection PyArgumentList
         return self.__class__(
             default=self.default if default is None else default,
             return_=self.return_,
-            loops=self.loops.copy() if new_loops is None else self.loops + new_loops
+            loops=self.loops + new_loops
         )
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(frozen=True)
 class LoopContinuationInfo:
     continue_: tuple[str, ...]
     break_: tuple[str, ...]
 
 
-@dataclasses.dataclass
+# Blocks and block statements are immutable and shared between passes, edit them with dataclasses.replace.
+@dataclasses.dataclass(frozen=True)
 class Block:
-    statements: list[tree_statements_base.Statement]
+    statements: tuple[tree_statements_base.Statement, ...]
     continuation_info: ContinuationInfo
     parent_block: tuple[str, ...] | None = None
 
@@ -263,16 +316,22 @@ class Block:
         out = []
         for statement in self.statements:
             match statement:
-                case BlockCallStatement(block=block):
+                case BlockCallStatement(block=block) | ScheduledBlockCallStatement(block=block):
                     out.append(block)
                 case ConditionalBlockCallStatement(true_block=true_block):
                     out.append(true_block)
+                case IfStatement(true_block=true_block, false_block=false_block):
+                    out.append(true_block)
+                    if false_block is not None:
+                        out.append(false_block)
+                case WhileStatement(body=body):
+                    out.append(body)
                 case _:
                     pass
         return out
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(frozen=True)
 class IfStatement(tree_statements_base.StoppingStatement):
     condition: stores.ReadableStore
     true_block: tuple[str, ...]
@@ -280,31 +339,122 @@ class IfStatement(tree_statements_base.StoppingStatement):
     no_redirect_branches: bool = False
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(frozen=True)
 class WhileStatement(tree_statements_base.Statement):
     condition: stores.ReadableStore
     body: tuple[str, ...]
+    iterations_per_tick: int | None = None
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(frozen=True)
 class BlockCallStatement(tree_statements_base.StoppingStatement):
     block: tuple[str, ...]
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(frozen=True)
+class ScheduledBlockCallStatement(tree_statements_base.Statement):
+    """Calls a block in a later tick, as the server at the world spawn."""
+
+    block: tuple[str, ...]
+    ticks: int = 1
+
+
+@dataclasses.dataclass(frozen=True)
 class FunctionCallStatement(tree_statements_base.Statement):
     function: tuple[str, ...]
     compile_time_args: tuple[ast.Constant | ast.Name, ...]
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(frozen=True)
+class ScoreComparison:
+    """A condition that ``execute if score`` tests directly, without evaluating it to a score first."""
+
+    left: stores.ScoreboardStore
+    op: typing.Literal["==", "!=", "<", "<=", ">", ">="]
+    right: stores.ScoreboardStore | stores.ConstInt
+
+    _SWAPPED_OPS: typing.ClassVar = {"==": "==", "!=": "!=", "<": ">", "<=": ">=", ">": "<", ">=": "<="}
+
+    @classmethod
+    def from_operands(
+        cls,
+        left: stores.ScoreboardStore | stores.ConstInt,
+        op: str,
+        right: stores.ScoreboardStore | stores.ConstInt
+    ) -> ScoreComparison | None:
+        if isinstance(left, stores.ConstInt):
+            if isinstance(right, stores.ConstInt):
+                return None
+
+            left, op, right = right, cls._SWAPPED_OPS[op], left
+
+        comparison = cls(left, op, right)
+
+        # e.g. x < -2147483648 has no range
+        if isinstance(right, stores.ConstInt) and comparison._range() is None:
+            return None
+
+        return comparison
+
+    def _range(self) -> str | None:
+        value = int(self.right.value)
+
+        match self.op:
+            case "==" | "!=":
+                return f"{value}"
+            case "<" if value > -2 ** 31:
+                return f"..{value - 1}"
+            case "<=":
+                return f"..{value}"
+            case ">" if value < 2 ** 31 - 1:
+                return f"{value + 1}.."
+            case ">=":
+                return f"{value}.."
+
+        return None
+
+    def subcommand(self, unless: bool = False) -> strings.LiteralString:
+        """The ``if score`` subcommand, or the ``unless score`` subcommand with ``unless``."""
+
+        if (self.op == "!=") != unless:
+            keyword = "unless"
+        else:
+            keyword = "if"
+
+        if isinstance(self.right, stores.ConstInt):
+            return strings.LiteralString(f"{keyword} score %s %s matches {self._range()}", *self.left)
+
+        op = {"==": "=", "!=": "="}.get(self.op, self.op)
+
+        return strings.LiteralString(f"{keyword} score %s %s {op} %s %s", *self.left, *self.right)
+
+    def store_success(self, dst: stores.ScoreboardStore) -> tree.LiteralStatement:
+        """Set ``dst`` to 1 if the condition holds and to 0 otherwise."""
+
+        return tree.LiteralStatement([
+            strings.LiteralString("execute store success score %s %s %s", *dst, self.subcommand())
+        ])
+
+
+@dataclasses.dataclass(frozen=True)
 class ConditionalBlockCallStatement(tree_statements_base.Statement):
-    condition: stores.ScoreboardStore
+    # a score that is tested for being non-zero, or a comparison
+    condition: stores.ScoreboardStore | ScoreComparison
     true_block: tuple[str, ...]
     unless: bool = False
+    # the calling mcfunction stops after the call (return run function), see BlockedFunction.from_tree_function
+    return_: bool = False
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(frozen=True)
+class ConditionalReturnStatement(tree_statements_base.Statement):
+    """Stops the mcfunction if the condition holds, a ConditionalBlockCallStatement with return_ of an empty block."""
+
+    condition: stores.ScoreboardStore | ScoreComparison
+    unless: bool = False
+
+
+@dataclasses.dataclass(frozen=True)
 class SimpleAssignmentStatement(tree_statements_base.Statement):
     src: stores.PrimitiveReadableStore
     dst: stores.PrimitiveWritableStore
@@ -315,3 +465,23 @@ class StdLibConfig:
     stack_push: tuple[tuple[str, ...], tuple]
     stack_pop: tuple[tuple[str, ...], tuple]
     stack_peek: tuple[tuple[str, ...], tuple]
+
+    @classmethod
+    def entity_stack(cls, stack_nr: int = 1) -> StdLibConfig:
+        """The stack of std2.stack that keeps values in marker entities. Every operation scans all entities."""
+
+        return cls(
+            stack_push=(("push",), (stack_nr,)),
+            stack_pop=(("pop",), (stack_nr,)),
+            stack_peek=(("peek",), (stack_nr,)),
+        )
+
+    @classmethod
+    def storage_stack(cls, stack_nr: int = 1) -> StdLibConfig:
+        """The stack of std2.stack that keeps values in a storage list. Every operation takes constant time."""
+
+        return cls(
+            stack_push=(("storage_push",), (stack_nr,)),
+            stack_pop=(("storage_pop",), (stack_nr,)),
+            stack_peek=(("storage_peek",), (stack_nr,)),
+        )
@@ -1,15 +1,63 @@
 from __future__ import annotations
 
+import concurrent.futures
 import dataclasses
+import multiprocessing
 import typing
 
-from . import blocks
-from .. import strings
+from . import blocks, compile_cache, control_flow_graph, dependency_graph, inlining, invocation_counters, passes
+from .. import profiling, strings
 from ..ir import tree
 from ..data import stores, stores_conv
-from ..errors import CompilationError, compile_assert
+from ..errors import CompilationError, compile_assert, issue_warning
 from ..location import Location
 
+# what the forked workers of CompileNamespace.lower_wave lower: the namespace, the instantiations of the wave, the std
+# lib config, the cache and the first string id of the wave
+_forked_wave: tuple[
+    CompileNamespace, list[tuple[tuple[str, ...], tuple]], blocks.StdLibConfig | None,
+    compile_cache.CompilationCache | None, int
+] | None = None
+
+
+def _lower_forked(i: int) -> tuple[
+    bytes, inlining.InliningStatistics, dict[str, passes.PassStatistics], tuple[int, int, int]
+] | None:
+    """Lower the ``i``-th instantiation of the forked wave. Returns it pickled with compile_cache.dumps, together
+    with the inlining, pass and cache statistics of its lowering, or None if the parent has to lower it itself."""
+
+    namespace, instantiations, std_lib_config, cache, first_wave_id = _forked_wave
+    func_name, args = instantiations[i]
+
+    # a worker lowers several instantiations, only the statistics of this one are reported
+    namespace.inliner.statistics = inlining.InliningStatistics()
+    namespace.pass_manager.statistics = {name: passes.PassStatistics() for name in namespace.pass_manager.statistics}
+    if cache is not None:
+        cache.hits = cache.misses = cache.stores = 0
+
+    library_state = compile_cache.library_state(namespace.scope)
+    first_id = strings.get_next_id()
+
+    result = namespace.lower_template(func_name, args, std_lib_config, cache)
+
+    # changes of the py library (e.g. lazily created tags) would not reach the parent
+    if compile_cache.library_state(namespace.scope) != library_state:
+        return None
+
+    # strings of the instantiations that this worker lowered before do not exist in the parent
+    data = compile_cache.dumps(
+        compile_cache.CacheEntry(result.blocked_function, result.dependencies), first_id, args, first_wave_id
+    )
+    if data is None:
+        return None
+
+    return (
+        data,
+        namespace.inliner.statistics,
+        namespace.pass_manager.statistics,
+        (cache.hits, cache.misses, cache.stores) if cache is not None else (0, 0, 0),
+    )
+
 
 @dataclasses.dataclass
 class CompileNamespace:
@@ -18,6 +66,12 @@ class CompileNamespace:
     tree_functions: dict[tuple[str, ...], tree.TreeFunction] = dataclasses.field(default_factory=dict)
     blocked_functions: dict[tuple[str, ...], blocks.BlockedFunction] = dataclasses.field(default_factory=dict)
     command_functions: dict[tuple[str, ...], CommandFunction] = dataclasses.field(default_factory=dict)
+    pass_manager: passes.PassManager = dataclasses.field(default_factory=passes.middle_end)
+    inliner: inlining.Inliner = dataclasses.field(default_factory=inlining.Inliner)
+    # instruments every mcfunction with a runtime invocation counter, see invocation_counters
+    invocation_counters: invocation_counters.InvocationCounters | None = None
+    # lowers conditionals with return run, needs pack format 26 (see BlockedFunction.from_tree_function)
+    return_commands: bool = False
 
     @classmethod
     def from_tree_namespace(cls, namespace: tree.File) -> CompileNamespace:
@@ -26,89 +80,266 @@ class CompileNamespace:
             scope=namespace.scope
         )
 
-    def resolve_templates(self, start: list[str], std_lib_config: blocks.StdLibConfig | None = None):
-        stack: list[tuple[tuple[str, ...], tuple]] = (
-            [std_lib_config.stack_peek, std_lib_config.stack_pop, std_lib_config.stack_push]
-            + [((name,), ()) for name in start]
-        )
-        processed_command_functions: set[tuple[str, ...]] = set()
-
-        iterations_with_no_change = 0
-        while stack:
-            changed = False
-            for i, (func_name, args) in enumerate(stack):
-                print(f"=> Attempting to compile {func_name} with {args=}.")
-                try:
-                    func_template = self.function_templates[func_name]
-                except KeyError:
-                    raise CompilationError(f"Undefined function {func_name!r}")
+    def resolve_templates(
+        self,
+        start: typing.Sequence[str] = (),
+        std_lib_config: blocks.StdLibConfig | None = None,
+        allow_recursion: bool = False,
+        jobs: int = 1,
+        cache: compile_cache.CompilationCache | None = None
+    ):
+        """Compile all instantiations reachable from ``start`` and from the entry points, the templates decorated
+        with ``@load``, ``@tick`` or ``@export`` (see tree.ENTRY_POINT_DECORATORS). Nothing else is instantiated, the
+        std library templates only if the stack is used.
 
-                func_path = (*func_name, tree.compile_time_args_to_str(args))
+        With ``jobs > 1``, the instantiations of every discovery wave are lowered on ``jobs`` forked processes, see
+        ``lower_wave``. The pack is the same as the one of a serial build.
 
-                if func_path in processed_command_functions:
-                    print(" -> Already processed.")
-                    stack.pop(i)
-                    changed = True
-                    break
+        With a ``cache``, instantiations are looked up in and stored to a persistent compilation cache.
+        """
 
-                ctime_arg_names = func_template.get_compile_time_args()
-                compile_assert(len(ctime_arg_names) == len(args), "Missing compile time args.")
+        compile_assert(jobs >= 1, f"Invalid number of jobs {jobs!r}.")
 
-                scope = tree.Scope(
-                    parent_scope=self.scope,
-                    compile_time_args=dict(zip(ctime_arg_names, args))
-                )
+        if jobs > 1 and "fork" not in multiprocessing.get_all_start_methods():
+            issue_warning("Parallel lowering needs the fork start method. Lowering serially.")
+            jobs = 1
 
-                if func_path not in self.command_functions:
-                    self.tree_functions[func_path] = tree.TreeFunction.from_py_ast(
-                        func_template.node, scope
-                    )
+        roots = [((name,), ()) for name in start] + [(func_name, ()) for func_name in self.entry_points()]
 
-                    self.blocked_functions[func_path] = blocks.BlockedFunction.from_tree_function(
-                        func=self.tree_functions[func_path],
-                        std_lib_config=std_lib_config
-                    )
+        if not roots:
+            issue_warning("No entry points. Nothing is compiled.")
 
-                    self.command_functions[func_path] = CommandFunction()
-                    self.command_functions[func_path].preprocess(self.blocked_functions[func_path])
+        graph: dependency_graph.DependencyGraph[tuple[str, ...]] = dependency_graph.DependencyGraph()
+        lowered: set[tuple[str, ...]] = set()
 
-                    # print(f" -> Got {len(dependencies)} dependencies.")
+        # discover and lower every instantiation reachable from the roots exactly once, one wave at a time
+        wave = roots
+        while wave:
+            instantiations: dict[tuple[str, ...], tuple[tuple[str, ...], tuple]] = {}
+            for func_name, args in wave:
+                func_path = (*func_name, tree.compile_time_args_to_str(args))
 
-                    dependencies = self.command_functions[func_path].get_dependencies(self.blocked_functions[func_path])
+                if func_path in self.command_functions or func_path in instantiations:
+                    continue
 
-                    for (template_path, compile_time_args) in dependencies:
-                        stack.append((template_path, compile_time_args))
-                else:
-                    dependencies = self.command_functions[func_path].get_dependencies(self.blocked_functions[func_path])
-                all_deps_compiled = True
-                for template_path, compile_time_args in dependencies:
-                    dep_func_path = (*template_path, tree.compile_time_args_to_str(compile_time_args))
+                instantiations[func_path] = func_name, args
+
+            if jobs > 1 and len(instantiations) > 1:
+                results = self.lower_wave(list(instantiations.values()), std_lib_config, cache, jobs)
+            else:
+                results = [
+                    self.lower_template(func_name, args, std_lib_config, cache)
+                    for func_name, args in instantiations.values()
+                ]
+
+            wave = []
+            for func_path, result in zip(instantiations, results):
+                if result.tree_function is not None:
+                    self.tree_functions[func_path] = result.tree_function
+                self.blocked_functions[func_path] = result.blocked_function
+                self.command_functions[func_path] = result.command_function
+
+                graph.add_node(func_path)
+                lowered.add(func_path)
+
+                for template_path, compile_time_args in result.dependencies:
+                    graph.add_edge(func_path, (*template_path, tree.compile_time_args_to_str(compile_time_args)))
+                    wave.append((template_path, compile_time_args))
+
+        # link in dependency order, callees first
+        for component in graph.topological_order():
+            if graph.is_cyclic(component) and not allow_recursion:
+                cycle = " -> ".join("/".join(path) for path in graph.find_cycle(component))
+                raise CompilationError(
+                    f"Recursive functions are not supported: {cycle}. "
+                    f"Involved functions: {', '.join('/'.join(path) for path in component)}."
+                )
 
-                    if dep_func_path not in self.command_functions:
-                        all_deps_compiled = False
-                        break
+            for func_path in component:
+                if func_path not in lowered:
+                    # linked by an earlier call
+                    continue
 
-                if all_deps_compiled:
+                with profiling.phase("CommandFunction.process", function=func_path):
                     self.command_functions[func_path].process(
                         func=self.blocked_functions[func_path],
                         functions=self.command_functions,
+                        func_path=func_path,
+                        counters=self.invocation_counters,
                     )
-                    stack.pop(i)
-                    processed_command_functions.add(func_path)
-                    # breakpoint()
-                    print(f" -> Done! {func_path}")
-                    changed = True
-                    break
-                else:
-                    print(" -> Waiting for dependencies.")
-
-            if changed:
-                iterations_with_no_change = 0
+                profiling.logger.debug(" -> Done! %s", func_path)
 
-            else:
-                iterations_with_no_change += 1
-                if iterations_with_no_change > 1:
-                    raise CompilationError("Circular dependency detected... Or something like that.")
+        profiling.logger.info(self.inliner.report())
+        profiling.logger.info(
+            "reachability: %s of %s templates instantiated",
+            len({func_path[:-1] for func_path in self.command_functions}), len(self.function_templates)
+        )
+
+    def entry_points(self) -> list[tuple[str, ...]]:
+        out = []
+
+        for func_name, template in self.function_templates.items():
+            if template.get_entry_point_decorators():
+                compile_assert(
+                    not template.get_compile_time_args() and not template.node.args.args,
+                    f"Entry point {'/'.join(func_name)} must not take arguments."
+                )
+                out.append(func_name)
+
+        return out
+
+    def function_tags(self) -> dict[str, list[CommandFunction]]:
+        """The compiled functions that every function tag runs, see tree.ENTRY_POINT_DECORATORS."""
+
+        out = {}
+
+        for func_path, func in self.command_functions.items():
+            for tag in self.function_templates[func_path[:-1]].get_function_tags():
+                out.setdefault(tag, []).append(func)
+
+        return out
+
+    def lower_wave(
+        self,
+        instantiations: list[tuple[tuple[str, ...], tuple]],
+        std_lib_config: blocks.StdLibConfig | None,
+        cache: compile_cache.CompilationCache | None,
+        jobs: int
+    ) -> list[LoweredTemplate]:
+        """Lower instantiations on ``jobs`` forked processes, which inherit the namespace.
+
+        The workers return the lowered instantiations pickled like cache entries, with the ids of their own strings
+        relative to their first id (see compile_cache.dumps). They are unpickled in the given order, which numbers
+        the strings like a serial build. Instantiations that change the py library or can't be pickled are lowered
+        again in this process, in order. The profiling phases of the workers are not recorded.
+        """
+
+        global _forked_wave
+
+        _forked_wave = self, instantiations, std_lib_config, cache, strings.get_next_id()
+        try:
+            with concurrent.futures.ProcessPoolExecutor(
+                min(jobs, len(instantiations)), multiprocessing.get_context("fork")
+            ) as executor:
+                lowered = list(executor.map(_lower_forked, range(len(instantiations))))
+        finally:
+            _forked_wave = None
+
+        out = []
+        for (func_name, args), result in zip(instantiations, lowered):
+            entry = None
+            if result is not None:
+                data, inlining_statistics, pass_statistics, cache_statistics = result
+                entry = compile_cache.loads(data, args)
+
+            if entry is None:
+                out.append(self.lower_template(func_name, args, std_lib_config, cache))
+                continue
+
+            self.inliner.statistics.add(inlining_statistics)
+            for name, statistics in pass_statistics.items():
+                self.pass_manager.statistics[name].add(statistics)
+            if cache is not None:
+                hits, misses, stores_ = cache_statistics
+                cache.hits += hits
+                cache.misses += misses
+                cache.stores += stores_
+
+            command_function = CommandFunction()
+            command_function.preprocess(entry.blocked_function)
+
+            out.append(LoweredTemplate(
+                tree_function=None,
+                blocked_function=entry.blocked_function,
+                command_function=command_function,
+                dependencies=entry.dependencies
+            ))
+
+        return out
+
+    def lower_template(
+        self,
+        func_name: tuple[str, ...],
+        args: tuple,
+        std_lib_config: blocks.StdLibConfig,
+        cache: compile_cache.CompilationCache | None = None
+    ) -> LoweredTemplate:
+        """Run the tree, blocked and command stages up to linking.
+
+        This does not modify the namespace. On a cache hit, the tree stage is skipped and ``tree_function`` is None.
+        """
+
+        profiling.logger.info("=> Attempting to compile %s with args=%r.", func_name, args)
+        profiling.count("instantiations")
+        try:
+            func_template = self.function_templates[func_name]
+        except KeyError:
+            raise CompilationError(f"Undefined function {func_name!r}")
+
+        ctime_arg_names = func_template.get_compile_time_args()
+        compile_assert(len(ctime_arg_names) == len(args), "Missing compile time args.")
+
+        if cache is not None:
+            key = cache.key(
+                func_template, args, self.scope, std_lib_config, self.pass_manager, self.inliner, self.return_commands
+            )
+            entry = cache.load(key, args)
+
+            if entry is not None:
+                profiling.logger.debug(" -> Loaded from cache.")
+                profiling.count("cache_hits")
+                command_function = CommandFunction()
+                command_function.preprocess(entry.blocked_function)
+
+                return LoweredTemplate(
+                    tree_function=None,
+                    blocked_function=entry.blocked_function,
+                    command_function=command_function,
+                    dependencies=entry.dependencies
+                )
+
+            first_id = strings.get_next_id()
+            library_state = compile_cache.library_state(self.scope)
+
+        scope = tree.Scope(
+            parent_scope=self.scope,
+            compile_time_args=dict(zip(ctime_arg_names, args))
+        )
+
+        with profiling.phase("TreeFunction", template=func_name):
+            tree_function = tree.TreeFunction.from_py_ast(func_template.node, scope)
+
+        with profiling.phase("BlockedFunction", template=func_name):
+            blocked_function = blocks.BlockedFunction.from_tree_function(
+                func=tree_function,
+                std_lib_config=std_lib_config,
+                pass_manager=self.pass_manager,
+                inliner=self.inliner,
+                return_commands=self.return_commands
+            )
+
+        with profiling.phase("CommandFunction.preprocess", template=func_name):
+            command_function = CommandFunction()
+            command_function.preprocess(blocked_function)
+        dependencies = command_function.get_dependencies(blocked_function)
+
+        if cache is not None and compile_cache.library_state(self.scope) == library_state:
+            cache.store(key, first_id, args, compile_cache.CacheEntry(blocked_function, dependencies))
+
+        return LoweredTemplate(
+            tree_function=tree_function,
+            blocked_function=blocked_function,
+            command_function=command_function,
+            dependencies=dependencies
+        )
+
+
+@dataclasses.dataclass
+class LoweredTemplate:
+    tree_function: tree.TreeFunction | None
+    blocked_function: blocks.BlockedFunction
+    command_function: CommandFunction
+    dependencies: list[tuple[tuple[str, ...], tuple]]
 
 
 class CommandFunction:
@@ -121,30 +352,75 @@ class CommandFunction:
         self,
         func: blocks.BlockedFunction,
         functions: dict[tuple[str, ...], CommandFunction],
+        func_path: tuple[str, ...] = (),
+        counters: invocation_counters.InvocationCounters | None = None,
     ):
+        back_edges = set()
+        if counters is not None:
+            back_edges = control_flow_graph.ControlFlowGraph.from_blocks(func.blocks).back_edge_paths(self.entry_point)
+
         for path, block in func.blocks.items():
             commands = []
 
+            if counters is not None:
+                commands.append(strings.LiteralString(counters.add(func_path, path, self.mcfunctions[path])))
+
+            def count_back_edge(target: tuple[str, ...], execute: str = "", *args: strings.String | str):
+                # under the condition of the call, which the counter command does not change
+                if (path, target) in back_edges:
+                    command = counters.add(func_path, path, self.mcfunctions[path], self.mcfunctions[target])
+                    commands.append(strings.LiteralString(execute + command, *args))
+
             for statement in block.statements:
                 # transform stack operations to function calls
                 match statement:
-                    case blocks.ConditionalBlockCallStatement(condition=condition, true_block=true_block, unless=unless):
+                    case blocks.ConditionalBlockCallStatement(
+                        condition=blocks.ScoreComparison() as comparison, true_block=true_block, unless=unless,
+                        return_=return_
+                    ):
                         mcfunction = self.mcfunctions[true_block]
+                        count_back_edge(true_block, "execute %s run ", comparison.subcommand(unless))
                         commands.append(
                             strings.LiteralString(
-                                f"execute {'if' if unless else 'unless'} score %s %s matches 0 run function %s",
-                                *condition, LocationOfString(mcfunction))
+                                f"execute %s run {'return run ' if return_ else ''}function %s",
+                                comparison.subcommand(unless), LocationOfString(mcfunction)
+                            )
                         )
-                        pass
+                    case blocks.ConditionalBlockCallStatement(
+                        condition=condition, true_block=true_block, unless=unless, return_=return_
+                    ):
+                        mcfunction = self.mcfunctions[true_block]
+                        execute = f"execute {'if' if unless else 'unless'} score %s %s matches 0 run "
+                        count_back_edge(true_block, execute, *condition)
+                        commands.append(
+                            strings.LiteralString(
+                                execute + f"{'return run ' if return_ else ''}function %s",
+                                *condition, LocationOfString(mcfunction)
+                            )
+                        )
+                    case blocks.ConditionalReturnStatement(
+                        condition=blocks.ScoreComparison() as comparison, unless=unless
+                    ):
+                        commands.append(strings.LiteralString("execute %s run return 0", comparison.subcommand(unless)))
+                    case blocks.ConditionalReturnStatement(condition=condition, unless=unless):
+                        commands.append(strings.LiteralString(
+                            f"execute {'if' if unless else 'unless'} score %s %s matches 0 run return 0", *condition
+                        ))
                     case blocks.BlockCallStatement(block=mcfunction_path):
                         mcfunction = self.mcfunctions[mcfunction_path]
+                        count_back_edge(mcfunction_path)
                         commands.append(
                             strings.LiteralString("function %s", LocationOfString(mcfunction))
                         )
+                    case blocks.ScheduledBlockCallStatement(block=mcfunction_path, ticks=ticks):
+                        mcfunction = self.mcfunctions[mcfunction_path]
+                        count_back_edge(mcfunction_path)
+                        commands.append(
+                            strings.LiteralString(f"schedule function %s {ticks}t", LocationOfString(mcfunction))
+                        )
                     case blocks.FunctionCallStatement(function=function, compile_time_args=compile_time_args):
-                        func_path = (*function, tree.compile_time_args_to_str(tuple(compile_time_args)))
-                        func = functions[func_path]
-                        mcfunction = func.mcfunctions[func.entry_point]
+                        callee = functions[(*function, tree.compile_time_args_to_str(tuple(compile_time_args)))]
+                        mcfunction = callee.mcfunctions[callee.entry_point]
                         commands.append(
                             strings.LiteralString("function %s", LocationOfString(mcfunction))
                         )
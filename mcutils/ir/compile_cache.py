@@ -0,0 +1,337 @@
+from __future__ import annotations
+
+import ast
+import dataclasses
+import functools
+import hashlib
+import inspect
+import io
+import os
+import pathlib
+import pickle
+import typing
+
+from . import blocks, inlining, passes, tree
+from .. import strings
+from ..data import stores
+
+_FORMAT_VERSION = 2
+
+
+class _Uncacheable(Exception):
+    pass
+
+
+@functools.cache
+def _compiler_hash() -> str:
+    """Hash of the compiler's own sources. Any change to mcutils invalidates the whole cache."""
+
+    h = hashlib.sha256()
+    root = pathlib.Path(__file__).parent.parent
+
+    for path in sorted(root.rglob("*.py")):
+        h.update(path.relative_to(root).as_posix().encode())
+        h.update(path.read_bytes())
+
+    return h.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def _source_hash(func: typing.Callable) -> str:
+    try:
+        source = inspect.getsource(func)
+    except (OSError, TypeError):
+        source = ""
+
+    return hashlib.sha256(source.encode()).hexdigest()
+
+
+def describe(obj: typing.Any, ids: bool = True) -> str:
+    """A deterministic description of compile-time values, used for cache keys and validation. Without ``ids``,
+    strings are only described by their contents."""
+
+    def describe_(value: typing.Any) -> str:
+        return describe(value, ids)
+
+    id_ = f"#{obj._id}" if ids and isinstance(obj, strings.String) and hasattr(obj, "_id") else ""
+
+    match obj:
+        case None | bool() | int() | float() | str():
+            return repr(obj)
+        case strings.LiteralString():
+            return f"LiteralString{id_}({obj.literal!r}, {', '.join(map(describe_, obj.args))})"
+        case strings.UniqueString():
+            return f"{type(obj).__name__}{id_}({describe_(obj.string)})"
+        case strings.String() if hasattr(obj, "_id"):
+            return f"{type(obj).__name__}{id_}"
+        case stores.ScoreboardStore():
+            return f"ScoreboardStore({describe_(obj.player)}, {describe_(obj.objective)})"
+        case stores.NbtStore():
+            return (
+                f"NbtStore[{obj.dtype_name}]({obj.nbt_container_type}, {describe_(obj.nbt_container_argument)}, "
+                f"{describe_(obj.path)})"
+            )
+        case stores.ConstStore():
+            return repr(obj)
+        case list() | tuple():
+            return f"{type(obj).__name__}({', '.join(map(describe_, obj))})"
+        case dict():
+            return "{" + ", ".join(f"{describe_(k)}: {describe_(v)}" for k, v in obj.items()) + "}"
+        case type():
+            return f"{obj.__module__}.{obj.__qualname__}"
+        case _ if dataclasses.is_dataclass(obj):
+            fields = {field.name: getattr(obj, field.name) for field in dataclasses.fields(obj)}
+            return f"{type(obj).__qualname__}({describe_(fields)})"
+        case _ if inspect.ismethod(obj) or inspect.isfunction(obj):
+            return f"{obj.__module__}.{obj.__qualname__}:{_source_hash(obj)}"
+        case _:
+            # may contain a memory address, which only leads to cache misses
+            return f"{type(obj).__qualname__}:{obj!r}"
+
+
+def _libraries(scope: tree.Scope) -> list[typing.Any]:
+    return list({id(f.__self__): f.__self__ for f in scope.pyfuncs.values() if inspect.ismethod(f)}.values())
+
+
+def library_state(scope: tree.Scope) -> str:
+    return describe([vars(library) for library in _libraries(scope)])
+
+
+def _strings_of(obj: typing.Any) -> list[strings.String]:
+    """The strings in compile-time values and the strings they consist of, in a deterministic order."""
+
+    match obj:
+        case strings.LiteralString():
+            return [obj, *(string for arg in obj.args for string in _strings_of(arg))]
+        case strings.UniqueString():
+            return [obj, *_strings_of(obj.string)]
+        case strings.String():
+            return [obj]
+        case stores.ScoreboardStore():
+            return [*_strings_of(obj.player), *_strings_of(obj.objective)]
+        case stores.NbtStore():
+            return [*_strings_of(obj.nbt_container_argument), *_strings_of(obj.path)]
+        case list() | tuple():
+            return [string for value in obj for string in _strings_of(value)]
+        case _:
+            return []
+
+
+def _restore_string(cls: type[strings.String], local_id: int, state: dict, first_id: int = 0) -> strings.String:
+    string = cls.__new__(cls)
+    string.__dict__.update(state)
+    string.__dict__["_id"] = first_id + local_id
+    strings.register(string)
+    return string
+
+
+def _restore_generic(base_class: type, generic_args: tuple, state: dict) -> typing.Any:
+    cls = base_class[generic_args]
+    obj = cls.__new__(cls)
+    obj.__dict__.update(state)
+    return obj
+
+
+class _Pickler(pickle.Pickler):
+    def __init__(self, file: typing.BinaryIO, first_id: int, args: tuple, shared_below: int | None = None):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.first_id = first_id
+        self.shared_below = first_id if shared_below is None else shared_below
+        self.references: dict[int, str] = {}
+        self.arg_strings: dict[int, int] = {}
+
+        for i, string in enumerate(_strings_of(args)):
+            self.arg_strings.setdefault(string._id, i)
+
+    def persistent_id(self, obj: typing.Any) -> typing.Any:
+        # strings that existed before the instantiation was lowered belong to the rest of the build, the ones in the
+        # compile-time args are found by their position, since the caller may number them differently next time
+        if isinstance(obj, strings.String) and getattr(obj, "_id", self.first_id) < self.first_id:
+            if obj._id in self.arg_strings:
+                return "arg", self.arg_strings[obj._id]
+
+            if obj._id >= self.shared_below:
+                raise _Uncacheable(f"String #{obj._id} is not shared with the rest of the build.")
+
+            self.references[obj._id] = describe(obj)
+            return "id", obj._id
+
+        return None
+
+    def reducer_override(self, obj: typing.Any) -> typing.Any:
+        if isinstance(obj, strings.String) and hasattr(obj, "_id"):
+            # the ids of the strings of the instantiation are relative to its first id, see _Unpickler.find_class
+            state = {name: value for name, value in obj.__dict__.items() if name != "_id"}
+            return _restore_string, (type(obj), obj._id - self.first_id, state)
+
+        # classes created by subscripting a runtime generic can't be found by name
+        if isinstance(obj, stores.ReadableStore) and "__base_class__" in type(obj).__dict__:
+            return _restore_generic, (type(obj).__base_class__, type(obj).__generic_args__, obj.__dict__)
+
+        return NotImplemented
+
+
+class _Unpickler(pickle.Unpickler):
+    def __init__(self, file: typing.BinaryIO, first_id: int, args: tuple):
+        super().__init__(file)
+        self.first_id = first_id
+        self.arg_strings = _strings_of(args)
+
+    def find_class(self, module: str, name: str) -> typing.Any:
+        if module == __name__ and name == _restore_string.__name__:
+            return functools.partial(_restore_string, first_id=self.first_id)
+
+        return super().find_class(module, name)
+
+    def persistent_load(self, pid: typing.Any) -> typing.Any:
+        match pid:
+            case "arg", int(i) if i < len(self.arg_strings):
+                return self.arg_strings[i]
+            case "id", int(id_) if (string := strings.get_by_id(id_)) is not None:
+                return string
+
+        raise _Uncacheable(f"String {pid!r} does not exist in this build.")
+
+
+@dataclasses.dataclass
+class CacheEntry:
+    blocked_function: blocks.BlockedFunction
+    dependencies: list[tuple[tuple[str, ...], tuple]]
+
+
+def dumps(entry: CacheEntry, first_id: int, args: tuple, shared_below: int | None = None) -> bytes | None:
+    """Pickle an entry for an instantiation with the compile-time ``args`` whose lowering allocated the string ids
+    starting at ``first_id``. Strings below ``first_id`` are referenced by id, which fails for the ones from
+    ``shared_below`` on. Returns None if the entry can't be pickled."""
+
+    payload = io.BytesIO()
+    pickler = _Pickler(payload, first_id, args, shared_below)
+
+    try:
+        pickler.dump(entry)
+    except (_Uncacheable, pickle.PicklingError, TypeError, AttributeError):
+        # e.g. closures in DynamicStrings
+        return None
+
+    header = pickle.dumps((strings.get_next_id() - first_id, pickler.references), protocol=pickle.HIGHEST_PROTOCOL)
+
+    return header + payload.getvalue()
+
+
+def loads(data: bytes, args: tuple) -> CacheEntry | None:
+    """Unpickle an entry of ``dumps`` for an instantiation with the compile-time ``args``. The strings of the entry
+    are numbered from the next free id and the string id counter is advanced past them. Returns None if the entry
+    refers to strings that differ in this build."""
+
+    file = io.BytesIO(data)
+    first_id = strings.get_next_id()
+
+    try:
+        id_count, references = pickle.load(file)
+
+        for id_, description in references.items():
+            if id_ >= first_id or describe(strings.get_by_id(id_)) != description:
+                raise _Uncacheable(f"String #{id_} differs from the cached build.")
+
+        entry: CacheEntry = _Unpickler(file, first_id, args).load()
+    except (_Uncacheable, pickle.UnpicklingError, AttributeError, EOFError, ImportError, ValueError):
+        return None
+
+    strings.skip_ids(id_count)
+
+    return entry
+
+
+@dataclasses.dataclass
+class CompilationCache:
+    """Persistent, content-addressed cache of lowered template instantiations.
+
+    An entry is keyed by the template's AST, its compile-time args, the module-scope symbols it references, the
+    std lib config and the compiler version. The args are described by their contents, not by the ids of their
+    strings, so an entry stays valid when earlier instantiations allocate a different number of strings. The
+    strings of an instantiation are numbered relative to its first id and are renumbered from the next free id on
+    load, which is the numbering that lowering would have given them, so a warm build is byte-identical to a cold
+    one. Instantiations whose lowering changes the state of the py library (e.g. lazily creating a tag) or produces
+    unpicklable IR are not cached.
+    """
+
+    path: pathlib.Path
+    hits: int = 0
+    misses: int = 0
+    stores: int = 0
+
+    def key(
+        self,
+        template: tree.FunctionTemplate,
+        args: tuple,
+        scope: tree.Scope,
+        std_lib_config: blocks.StdLibConfig | None,
+        pass_manager: passes.PassManager,
+        inliner: inlining.Inliner,
+        return_commands: bool = False,
+    ) -> str:
+        names = sorted({node.id for node in ast.walk(template.node) if isinstance(node, ast.Name)})
+        symbols = {}
+        for name in names:
+            symbol = scope.lookup(name, ("string", "variable_type", "variable", "pyfunc", "compile_time_arg"))
+            if symbol is not tree.UNDEFINED:
+                symbols[name] = symbol
+
+        shared: dict[int, int] = {}
+        h = hashlib.sha256()
+        for part in (
+            str(_FORMAT_VERSION),
+            _compiler_hash(),
+            ast.dump(template.node),
+            describe(args, ids=False),
+            # which of the strings in the args are the same string
+            describe([shared.setdefault(string._id, len(shared)) for string in _strings_of(args)]),
+            describe(symbols),
+            describe(std_lib_config),
+            describe([pass_.name for pass_ in pass_manager.passes]),
+            describe((inliner.enabled, inliner.threshold)),
+            describe(return_commands),
+        ):
+            h.update(part.encode())
+            h.update(b"\0")
+
+        return h.hexdigest()
+
+    def _entry_path(self, key: str) -> pathlib.Path:
+        return self.path / key[:2] / f"{key}.pickle"
+
+    def load(self, key: str, args: tuple) -> CacheEntry | None:
+        """Load an entry for an instantiation with the compile-time ``args``. On a hit, the strings of the entry are
+        numbered from the next free id and the string id counter is advanced past them."""
+
+        try:
+            data = self._entry_path(key).read_bytes()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+
+        entry = loads(data, args)
+
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return entry
+
+    def store(self, key: str, first_id: int, args: tuple, entry: CacheEntry):
+        """Store an entry for an instantiation with the compile-time ``args`` whose lowering allocated the string ids
+        starting at ``first_id``."""
+
+        data = dumps(entry, first_id, args)
+        if data is None:
+            return
+
+        path = self._entry_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        temp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        temp_path.write_bytes(data)
+        os.replace(temp_path, path)
+
+        self.stores += 1
@@ -1,65 +1,95 @@
 from __future__ import annotations
 
-import copy
+import dataclasses
 
-from . import blocks, tree, tree_statements_base
+from . import blocks, control_flow_graph, tree, tree_statements_base
+from ..data import stores
 from ..errors import compile_assert
+from ..lib import std
 
 
 def transform_whiles(mcfunctions: dict[tuple[str, ...], blocks.Block]) -> dict[tuple[str, ...], blocks.Block]:
+    # loop bodies get a new continuation info before they are visited, the caller's dict stays untouched
+    mcfunctions = dict(mcfunctions)
     new_mcfunctions: dict[tuple[str, ...], blocks.Block] = {}
 
     for mcfunction_name, mcfunction in mcfunctions.items():
+        if not any(isinstance(statement, blocks.WhileStatement) for statement in mcfunction.statements):
+            new_mcfunctions[mcfunction_name] = mcfunction
+            continue
+
         mcfunction_children: dict[tuple[str, ...], blocks.Block] = {}
 
         current_child_i = 0
-        current_child = blocks.Block([], copy.copy(mcfunction.continuation_info))
+        current_statements = []
 
         for statement in mcfunction.statements:
             if isinstance(statement, blocks.WhileStatement):
                 while_chk_cond_func_name = f"__while_chk_cond{current_child_i}"
+                chk_cond = (*mcfunction_name, while_chk_cond_func_name)
 
-                current_child.continuation_info = mcfunction.continuation_info.with_(
-                    default=(*mcfunction_name, while_chk_cond_func_name)
-                )
+                if statement.iterations_per_tick is None:
+                    # the loop is entered and continued by checking the condition
+                    entry = next_iteration = chk_cond
+                else:
+                    entry = (*mcfunction_name, f"__while_start{current_child_i}")
+                    next_iteration = (*mcfunction_name, f"__while_next{current_child_i}")
+                    pause = (*mcfunction_name, f"__while_pause{current_child_i}")
 
                 mcfunction_children |= {
-                    (f"{current_child_i}",): current_child
+                    (f"{current_child_i}",): blocks.Block(
+                        tuple(current_statements),
+                        mcfunction.continuation_info.with_(default=entry)
+                    )
                 }
                 current_child_i += 1
-                current_child = blocks.Block([], mcfunction.continuation_info)
+                current_statements = []
 
                 in_loop_continuation_info = mcfunction.continuation_info.with_(
-                    default=(*mcfunction_name, while_chk_cond_func_name),
-                    new_loops=[
+                    default=next_iteration,
+                    new_loops=(
                         blocks.LoopContinuationInfo(
-                            continue_=(*mcfunction_name, while_chk_cond_func_name),
+                            continue_=next_iteration,
                             break_=(*mcfunction_name, f"{current_child_i}")
-                        )
-                    ]
+                        ),
+                    )
                 )
 
-                mcfunctions[statement.body].continuation_info = in_loop_continuation_info
+                mcfunctions[statement.body] = dataclasses.replace(
+                    mcfunctions[statement.body],
+                    continuation_info=in_loop_continuation_info
+                )
 
                 mcfunction_children.update({
                     (while_chk_cond_func_name,): blocks.Block(
                         # although break/continue in the loop condition check is a bit weird
                         continuation_info=in_loop_continuation_info,
-                        statements=[
+                        statements=(
                             blocks.IfStatement(
                                 condition=statement.condition,
                                 true_block=statement.body,
                                 false_block=in_loop_continuation_info.loops[-1].break_,
                                 no_redirect_branches=True
-                            )
-                        ]
+                            ),
+                        )
                     )
                 })
+
+                if statement.iterations_per_tick is not None:
+                    new_mcfunctions |= tick_sliced_loop_blocks(
+                        statement.iterations_per_tick,
+                        entry=entry,
+                        next_iteration=next_iteration,
+                        pause=pause,
+                        chk_cond=chk_cond,
+                        continuation_info=mcfunction.continuation_info,
+                        in_loop_continuation_info=in_loop_continuation_info
+                    )
             else:
-                current_child.statements.append(statement)
+                current_statements.append(statement)
 
         mcfunction_children |= {
-            (f"{current_child_i}",): current_child
+            (f"{current_child_i}",): blocks.Block(tuple(current_statements), mcfunction.continuation_info)
         }
 
         new_mcfunctions |= {(*mcfunction_name, *key): value for key, value in mcfunction_children.items()
@@ -69,53 +99,96 @@ def transform_whiles(mcfunctions: dict[tuple[str, ...], blocks.Block]) -> dict[t
     return new_mcfunctions
 
 
+def tick_sliced_loop_blocks(
+    iterations_per_tick: int,
+    entry: tuple[str, ...],
+    next_iteration: tuple[str, ...],
+    pause: tuple[str, ...],
+    chk_cond: tuple[str, ...],
+    continuation_info: blocks.ContinuationInfo,
+    in_loop_continuation_info: blocks.ContinuationInfo
+) -> dict[tuple[str, ...], blocks.Block]:
+    """The blocks that count the iterations of a loop and continue it in the next tick once the budget is used up.
+
+    The entry block is called when the loop is entered and scheduled when it is paused. It resets the budget, so
+    every tick runs at most ``iterations_per_tick`` iterations. There is one budget score per loop, which a second
+    run of the loop shares, see tree.slice_loops.
+    """
+
+    budget = std.get_temp_var("while_budget")
+    # the blocks end with conditional calls, nothing else is called after them
+    no_default = dataclasses.replace(in_loop_continuation_info, default=None)
+
+    return {
+        entry: blocks.Block(
+            (tree.AssignmentStatement(stores.ConstInt(iterations_per_tick), budget),),
+            continuation_info.with_(default=chk_cond)
+        ),
+        next_iteration: blocks.Block(
+            (
+                tree.InPlaceOperationStatement(budget, stores.ConstInt(1), "-"),
+                # the pause block does not change the budget, so the loop is not continued after it returned
+                blocks.ConditionalBlockCallStatement(
+                    blocks.ScoreComparison(budget, "<=", stores.ConstInt(0)), pause
+                ),
+                blocks.ConditionalBlockCallStatement(
+                    blocks.ScoreComparison(budget, ">", stores.ConstInt(0)), chk_cond
+                ),
+            ),
+            no_default
+        ),
+        pause: blocks.Block((blocks.ScheduledBlockCallStatement(entry),), no_default),
+    }
+
+
 def transform_conditionals(mcfunctions: dict[tuple[str, ...], blocks.Block]) -> dict[tuple[str, ...], blocks.Block]:
     """Transform conditionals such that they only occur at most once per mcfunction at the end."""
+    # branches get a new continuation info before they are visited, the caller's dict stays untouched
+    mcfunctions = dict(mcfunctions)
     new_mcfunctions: dict[tuple[str, ...], blocks.Block] = {}
 
     for mcfunction_name, mcfunction in mcfunctions.items():
+        if not any(isinstance(node, blocks.IfStatement) for node in mcfunction.statements):
+            new_mcfunctions[mcfunction_name] = mcfunction
+            continue
+
         mcfunction_children: dict[tuple[str, ...], blocks.Block] = {}
 
         current_child_i = 0
-        current_child = blocks.Block([], copy.copy(mcfunction.continuation_info))
+        current_statements = []
 
         for node in mcfunction.statements:
-            node = copy.deepcopy(node)
-
-            current_child.statements.append(node)
-
             if isinstance(node, blocks.IfStatement):
-                mcfunction_children |= {
-                    (f"{current_child_i}",): current_child
-                }
+                child_i = current_child_i
 
                 current_child_i += 1
                 while (*mcfunction_name, f"{current_child_i}") in mcfunctions:
                     current_child_i += 1
 
-                current_child.continuation_info = current_child.continuation_info.with_(default=None)
+                next_child = (*mcfunction_name, f"{current_child_i}")
 
-                if node.no_redirect_branches:
-                    pass
-                else:
-                    mcfunctions[node.true_block].continuation_info = (
-                        mcfunctions[node.true_block].continuation_info.with_(
-                            default=(*mcfunction_name, f"{current_child_i}")
-                        )
-                    )
-                    if node.false_block is not None:
-                        mcfunctions[node.false_block].continuation_info = (
-                            mcfunctions[node.false_block].continuation_info.with_(
-                                default=(*mcfunction_name, f"{current_child_i}")
+                if not node.no_redirect_branches:
+                    for branch in (node.true_block, node.false_block):
+                        if branch is not None:
+                            mcfunctions[branch] = dataclasses.replace(
+                                mcfunctions[branch],
+                                continuation_info=mcfunctions[branch].continuation_info.with_(default=next_child)
                             )
-                        )
-                    else:
-                        node.false_block = (*mcfunction_name, f"{current_child_i}")
 
-                current_child = blocks.Block([], mcfunction.continuation_info)
+                    if node.false_block is None:
+                        node = dataclasses.replace(node, false_block=next_child)
+
+                current_statements.append(node)
+
+                mcfunction_children |= {
+                    (f"{child_i}",): blocks.Block(tuple(current_statements), mcfunction.continuation_info)
+                }
+                current_statements = []
+            else:
+                current_statements.append(node)
 
         mcfunction_children |= {
-            (f"{current_child_i}",): current_child
+            (f"{current_child_i}",): blocks.Block(tuple(current_statements), mcfunction.continuation_info)
         }
         new_mcfunctions |= {(*mcfunction_name, *key): value for key, value in mcfunction_children.items()
                             if key != ("0",)}
@@ -126,40 +199,16 @@ def transform_conditionals(mcfunctions: dict[tuple[str, ...], blocks.Block]) ->
 
 def remove_stopping_statements(mcfunctions: dict[tuple[str, ...], blocks.Block]) -> dict[tuple[str, ...], blocks.Block]:
     out = {}
+    cfg = control_flow_graph.ControlFlowGraph.from_blocks(mcfunctions)
 
     for mcfunction_name, mcfunction in mcfunctions.items():
         statements = []
         for statement in mcfunction.statements:
             if isinstance(statement, tree_statements_base.StoppingStatement):
                 if isinstance(statement, tree_statements_base.ContinueStatement):
-                    mcfunction_name_copy = list(mcfunction_name)
-                    # TODO: remove this icky code
-                    while mcfunction_name_copy:
-                        try:
-                            if mcfunctions[tuple(mcfunction_name_copy)].continuation_info.loops:
-                                break
-                        except KeyError:
-                            pass
-                        mcfunction_name_copy.pop()
-                    else:
-                        compile_assert(False)
-
-                    statements.append(blocks.BlockCallStatement(mcfunctions[tuple(mcfunction_name_copy)].continuation_info.loops[-1].continue_))
+                    statements.append(blocks.BlockCallStatement(cfg.loop_of(mcfunction_name).continue_))
                 elif isinstance(statement, tree_statements_base.BreakStatement):
-                    mcfunction_name_copy = list(mcfunction_name)
-                    while mcfunction_name_copy:
-                        try:
-                            if mcfunctions[tuple(mcfunction_name_copy)].continuation_info.loops:
-                                break
-                        except KeyError:
-                            pass
-
-                        mcfunction_name_copy.pop()
-                    else:
-                        compile_assert(False)
-
-                    statements.append(blocks.BlockCallStatement(
-                        mcfunctions[tuple(mcfunction_name_copy)].continuation_info.loops[-1].break_))
+                    statements.append(blocks.BlockCallStatement(cfg.loop_of(mcfunction_name).break_))
                 elif isinstance(statement, tree.ReturnStatement):
                     statements.append(statement)
                     statements.append(blocks.BlockCallStatement(mcfunction.continuation_info.return_))
@@ -176,7 +225,7 @@ def remove_stopping_statements(mcfunctions: dict[tuple[str, ...], blocks.Block])
 
         statements = [s for s in statements if not (isinstance(s, blocks.BlockCallStatement) and s.block is None)]
 
-        out[mcfunction_name] = blocks.Block(statements, mcfunction.continuation_info)
+        out[mcfunction_name] = blocks.Block(tuple(statements), mcfunction.continuation_info)
 
     return out
 
@@ -0,0 +1,162 @@
+"""Compile-time evaluation of expressions with the 32-bit int semantics of scoreboard operations."""
+
+from __future__ import annotations
+
+import dataclasses
+
+from . import tree, tree_statements_base
+from ..data import expressions, stores
+
+_COMPARISONS = {
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+}
+
+
+def wrap(value: int) -> int:
+    return (value + 2 ** 31) % 2 ** 32 - 2 ** 31
+
+
+def evaluate(op: str, left: int, right: int) -> int | None:
+    """The result of ``left op right`` at runtime, or None if it cannot be known at compile time."""
+
+    match op:
+        case "+":
+            return wrap(left + right)
+        case "-":
+            return wrap(left - right)
+        case "*":
+            return wrap(left * right)
+        # scoreboard operations use floorDiv and floorMod and leave the score unchanged when dividing by zero
+        case "/" if right != 0:
+            return wrap(left // right)
+        case "%" if right != 0:
+            return wrap(left % right)
+        case "and":
+            # like BinOpExpression.fetch_to, which keeps the left value unless both are non-zero
+            return 1 if left and right else left
+        case _ if op in _COMPARISONS:
+            return int(_COMPARISONS[op](left, right))
+
+    return None
+
+
+def const_value(store: stores.ReadableStore | None) -> int | None:
+    if isinstance(store, stores.ConstInt):
+        return int(store.value)
+
+    return None
+
+
+def is_pure(store: stores.ReadableStore) -> bool:
+    """Whether evaluating the expression has no side effects, i.e. it does not call a function."""
+
+    if isinstance(store, expressions.FunctionCallExpression):
+        return False
+
+    if isinstance(store, expressions.ExpressionBase):
+        return all(map(is_pure, store.args))
+
+    return True
+
+
+def _same(a: stores.ReadableStore, b: stores.ReadableStore) -> bool:
+    """Whether two pure expressions compute the same value, compared structurally."""
+
+    # ScoreboardStore.__eq__ only works with other ScoreboardStores, so the types are checked at every level
+    if type(a) is not type(b):
+        return False
+
+    match a:
+        case expressions.BinOpExpression(left=left, op=op, right=right):
+            return op == b.op and _same(left, b.left) and _same(right, b.right)
+        case expressions.ExpressionBase():
+            return False
+        case stores.ConstStore():
+            return a.value == b.value
+
+    return a == b
+
+
+def _simplify(expression: expressions.BinOpExpression) -> stores.ReadableStore:
+    left, op, right = expression.left, expression.op, expression.right
+
+    # identities only hold if the other operand is computed like the result, i.e. on a scoreboard
+    if not (left.is_data_type(stores.WholeNumberType) and right.is_data_type(stores.WholeNumberType)):
+        return expression
+
+    match const_value(left), op, const_value(right):
+        case (_, "+" | "-", 0) | (_, "*" | "/", 1):
+            return left
+        case (0, "+", _) | (1, "*", _):
+            return right
+        case (_, "*", 0) | (_, "%", 1) if is_pure(left):
+            return stores.ConstInt(0)
+        case (0, "*" | "and", _) if is_pure(right):
+            return stores.ConstInt(0)
+
+    if is_pure(left) and _same(left, right):
+        match op:
+            case "-" | "!=" | "<" | ">":
+                return stores.ConstInt(0)
+            case "==" | "<=" | ">=":
+                return stores.ConstInt(1)
+
+    return expression
+
+
+def fold_expression(store: stores.ReadableStore | None) -> stores.ReadableStore | None:
+    match store:
+        case expressions.BinOpExpression(left=left, op=op, right=right):
+            expression = dataclasses.replace(store, left=fold_expression(left), right=fold_expression(right))
+
+            a, b = const_value(expression.left), const_value(expression.right)
+            if a is not None and b is not None and (value := evaluate(op, a, b)) is not None:
+                return stores.ConstInt(value)
+
+            return _simplify(expression)
+        case expressions.FunctionCallExpression(args=args):
+            return dataclasses.replace(store, args=tuple(map(fold_expression, args)))
+
+    return store
+
+
+def fold_statements(statements: list[tree_statements_base.Statement]) -> list[tree_statements_base.Statement]:
+    """Fold the expressions of the statements and replace ifs and whiles with constant conditions."""
+
+    out = []
+
+    for statement in statements:
+        match statement:
+            case tree.AssignmentStatement(src=src) | tree.InPlaceOperationStatement(src=src):
+                out.append(dataclasses.replace(statement, src=fold_expression(src)))
+            case tree.ReturnStatement(value=value):
+                out.append(dataclasses.replace(statement, value=fold_expression(value)))
+            case tree.IfStatement(condition=condition, true_body=true_body, false_body=false_body):
+                condition = fold_expression(condition)
+
+                match const_value(condition):
+                    case None:
+                        out.append(dataclasses.replace(
+                            statement,
+                            condition=condition,
+                            true_body=fold_statements(true_body),
+                            false_body=fold_statements(false_body)
+                        ))
+                    case 0:
+                        out += fold_statements(false_body)
+                    case _:
+                        out += fold_statements(true_body)
+            case tree.WhileLoopStatement(condition=condition, body=body):
+                condition = fold_expression(condition)
+
+                if const_value(condition) != 0:
+                    out.append(dataclasses.replace(statement, condition=condition, body=fold_statements(body)))
+            case _:
+                out.append(statement)
+
+    return out
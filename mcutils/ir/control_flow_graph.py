@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import dataclasses
+
+from . import blocks
+from ..errors import compile_assert
+
+
+@dataclasses.dataclass
+class NameAllocator:
+    """Hands out unused block paths ``base + (name,)``, ``base + (name2,)``, ... without probing from the start."""
+
+    taken: set[tuple[str, ...]]
+    _next_suffix: dict[tuple[tuple[str, ...], str], int] = dataclasses.field(default_factory=dict)
+
+    def allocate(self, base: tuple[str, ...], name: str) -> tuple[str, ...]:
+        i = self._next_suffix.get((base, name), 1)
+
+        while True:
+            path = (*base, name if i == 1 else f"{name}{i}")
+            if path not in self.taken:
+                break
+            i += 1
+
+        self._next_suffix[base, name] = i + 1
+        self.taken.add(path)
+
+        return path
+
+
+@dataclasses.dataclass
+class ControlFlowGraph:
+    """The blocks of a function indexed by integer ids.
+
+    Paths are only kept as the names that the blocks are exported under, all analyses work on the ids.
+    """
+
+    paths: list[tuple[str, ...]]
+    ids: dict[tuple[str, ...], int]
+    blocks: list[blocks.Block]
+    successors: list[list[int]]
+    predecessors: list[list[int]]
+    # innermost loop that a block belongs to, i.e. the loop of the closest block on its path that has one
+    loops: list[blocks.LoopContinuationInfo | None]
+
+    @classmethod
+    def from_blocks(cls, blocks_: dict[tuple[str, ...], blocks.Block]) -> ControlFlowGraph:
+        paths = list(blocks_)
+        ids = {path: i for i, path in enumerate(paths)}
+
+        successors: list[list[int]] = [[] for _ in paths]
+        predecessors: list[list[int]] = [[] for _ in paths]
+
+        for i, block in enumerate(blocks_.values()):
+            for call in block.get_calls():
+                compile_assert(call in ids, f"Call of undefined block {call!r}.")
+                successors[i].append(ids[call])
+                predecessors[ids[call]].append(i)
+
+        innermost: dict[tuple[str, ...], blocks.LoopContinuationInfo | None] = {(): None}
+
+        for path in paths:
+            unresolved = []
+            prefix = path
+
+            while prefix not in innermost:
+                block = blocks_.get(prefix)
+
+                if block is not None and block.continuation_info is not None and block.continuation_info.loops:
+                    innermost[prefix] = block.continuation_info.loops[-1]
+                    break
+
+                unresolved.append(prefix)
+                prefix = prefix[:-1]
+
+            for unresolved_prefix in unresolved:
+                innermost[unresolved_prefix] = innermost[prefix]
+
+        return cls(
+            paths=paths,
+            ids=ids,
+            blocks=list(blocks_.values()),
+            successors=successors,
+            predecessors=predecessors,
+            loops=[innermost[path] for path in paths]
+        )
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def loop_of(self, path: tuple[str, ...]) -> blocks.LoopContinuationInfo:
+        loop = self.loops[self.ids[path]]
+        compile_assert(loop is not None, f"Block {path!r} is not in a loop.")
+        return loop
+
+    def reachable(self, entry: int) -> list[bool]:
+        """Depth-first search without recursion."""
+
+        seen = [False] * len(self)
+        seen[entry] = True
+        stack = [entry]
+
+        while stack:
+            for successor in self.successors[stack.pop()]:
+                if not seen[successor]:
+                    seen[successor] = True
+                    stack.append(successor)
+
+        return seen
+
+    def reachable_paths(self, entry: tuple[str, ...]) -> set[tuple[str, ...]]:
+        return {path for path, seen in zip(self.paths, self.reachable(self.ids[entry])) if seen}
+
+    def back_edges(self, entry: int) -> set[tuple[int, int]]:
+        """The edges of a depth-first search that lead back to a block on the current path, i.e. the calls that
+        start the next iteration of a loop."""
+
+        on_path = [False] * len(self)
+        seen = [False] * len(self)
+        out = set()
+
+        seen[entry] = on_path[entry] = True
+        stack = [(entry, iter(self.successors[entry]))]
+
+        while stack:
+            node, successors = stack[-1]
+
+            for successor in successors:
+                if on_path[successor]:
+                    out.add((node, successor))
+                elif not seen[successor]:
+                    seen[successor] = on_path[successor] = True
+                    stack.append((successor, iter(self.successors[successor])))
+                    break
+            else:
+                on_path[node] = False
+                stack.pop()
+
+        return out
+
+    def back_edge_paths(self, entry: tuple[str, ...]) -> set[tuple[tuple[str, ...], tuple[str, ...]]]:
+        return {(self.paths[a], self.paths[b]) for a, b in self.back_edges(self.ids[entry])}
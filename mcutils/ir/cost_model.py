@@ -0,0 +1,226 @@
+"""Static estimate of the number of commands that the functions of a datapack run.
+
+The estimate works on the resolved commands of every mcfunction, so it sees the calls and selectors of literal
+commands, too. Calls out of macro lines (``$function ...``) count like any other, a callee with ``$(...)``
+placeholders stands for the most expensive of the given functions that it can expand to. Costs are propagated over
+the call graph condensed to its strongly connected components, callees first and without recursion. A cyclic
+component is a loop (or a recursion) and runs ``trip_count`` times per call, counting every function in it once per
+iteration.
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import json
+import math
+import pathlib
+import re
+import typing
+
+from . import dependency_graph
+
+_CALL = re.compile(r"(?:^|\s)(schedule\s+)?function\s+([\w.\-]+:(?:[\w./\-]|\$\(\w+\))+)")
+# a macro placeholder in a callee after re.escape
+_PLACEHOLDER = re.compile(r"\\\$\\\(\w+\\\)")
+
+
+def _callees(function: str, costs: dict[str, FunctionCost]) -> list[str]:
+    """The given functions that a call of ``function`` may run, any of them if it has macro placeholders."""
+
+    if "$(" not in function:
+        return [function] if function in costs else []
+
+    pattern = re.compile(_PLACEHOLDER.sub(r"[\\w./\\-]+", re.escape(function)))
+    return [location for location in costs if pattern.fullmatch(location)]
+
+
+def entity_selectors(command: str) -> list[str]:
+    """The ``@e`` selectors of a command, which scan all loaded entities."""
+
+    out = []
+    start = command.find("@e")
+
+    while start != -1:
+        end = start + 2
+
+        if command.startswith("[", end):
+            depth = 0
+
+            for end in range(end, len(command)):
+                depth += {"[": 1, "]": -1}.get(command[end], 0)
+                if depth == 0:
+                    end += 1
+                    break
+
+        out.append(command[start:end])
+        start = command.find("@e", end)
+
+    return out
+
+
+def _number(value: float) -> float | int | None:
+    # JSON has no infinity, None stands for more than a float can hold
+    if not math.isfinite(value):
+        return None
+
+    return int(value) if value.is_integer() else round(value, 3)
+
+
+@dataclasses.dataclass
+class Call:
+    function: str
+    # e.g. execute if ... run function
+    conditional: bool
+    # schedule function, which runs in a later tick and does not add to the cost of the caller
+    scheduled: bool
+
+
+@dataclasses.dataclass
+class FunctionCost:
+    commands: int
+    calls: list[Call]
+    entity_selectors: list[str]
+    # whether the function is part of a loop or a recursion
+    loop: bool = False
+    # floats, nested loops quickly exceed any integer that is worth printing
+    worst_case: float = 0.0
+    expected: float = 0.0
+    # deepest nesting of function calls, in this function included
+    call_depth: int = 0
+    # @e selectors evaluated in the worst case
+    entity_scans: float = 0.0
+
+    @classmethod
+    def from_commands(cls, commands: typing.Iterable[str]) -> FunctionCost:
+        count = 0
+        calls = []
+        selectors = []
+
+        for command in commands:
+            command = command.strip()
+
+            if not command or command.startswith("#"):
+                continue
+
+            # macro lines, the calls and selectors are the same once the arguments are substituted
+            command = command.removeprefix("$")
+
+            count += 1
+            selectors += entity_selectors(command)
+
+            for match in _CALL.finditer(command):
+                calls.append(Call(
+                    function=match[2],
+                    conditional=command.startswith("execute"),
+                    scheduled=match[1] is not None
+                ))
+
+        return cls(commands=count, calls=calls, entity_selectors=selectors)
+
+    def summary(self) -> dict[str, typing.Any]:
+        return {
+            "worst_case": _number(self.worst_case),
+            "expected": _number(self.expected),
+            "call_depth": self.call_depth,
+            "entity_scans": _number(self.entity_scans),
+        }
+
+
+@dataclasses.dataclass
+class CostModel:
+    # iterations of every loop
+    trip_count: int = 10
+    # probability that a conditional call is taken, for the expected cost
+    branch_probability: float = 0.5
+
+    def analyze(self, functions: dict[str, typing.Iterable[str]]) -> dict[str, FunctionCost]:
+        """Estimate the cost of the given mcfunctions, which are given as their commands by location.
+
+        Calls of functions that are not given (e.g. of other datapacks) are free.
+        """
+
+        costs = {location: FunctionCost.from_commands(commands) for location, commands in functions.items()}
+
+        graph: dependency_graph.DependencyGraph[str] = dependency_graph.DependencyGraph()
+        for location, cost in costs.items():
+            graph.add_node(location)
+            for call in cost.calls:
+                if not call.scheduled:
+                    for callee in _callees(call.function, costs):
+                        graph.add_edge(location, callee)
+
+        # callees first, so the costs of all calls out of a component are known when it is visited
+        for component in graph.strongly_connected_components():
+            members = set(component)
+            cyclic = graph.is_cyclic(component)
+
+            worst_case = 0.0
+            expected = 0.0
+            entity_scans = 0.0
+            callee_depth = 0
+
+            for location in component:
+                cost = costs[location]
+                worst_case += cost.commands
+                expected += cost.commands
+                entity_scans += len(cost.entity_selectors)
+
+                for call in cost.calls:
+                    if call.scheduled:
+                        continue
+
+                    callees = [costs[callee] for callee in _callees(call.function, costs) if callee not in members]
+                    if not callees:
+                        continue
+
+                    callee = max(callees, key=lambda callee_: callee_.worst_case)
+                    worst_case += callee.worst_case
+                    expected += (self.branch_probability if call.conditional else 1) * callee.expected
+                    entity_scans += callee.entity_scans
+                    callee_depth = max(callee_depth, max(callee_.call_depth for callee_ in callees))
+
+            if cyclic:
+                worst_case *= self.trip_count
+                expected *= self.trip_count
+                entity_scans *= self.trip_count
+                # loops are recursive calls, every iteration nests as deep as the functions of the loop
+                depth = callee_depth + self.trip_count * len(component)
+            else:
+                depth = callee_depth + 1
+
+            for location in component:
+                cost = costs[location]
+                cost.loop = cyclic
+                cost.worst_case = worst_case
+                cost.expected = expected
+                cost.call_depth = depth
+                cost.entity_scans = entity_scans
+
+        return costs
+
+    def report(self, functions: dict[str, typing.Iterable[str]], entry_points: typing.Iterable[str]) -> dict:
+        costs = self.analyze(functions)
+
+        return {
+            "parameters": dataclasses.asdict(self),
+            "entry_points": {location: costs[location].summary() for location in entry_points},
+            "functions": {
+                location: {
+                    "commands": cost.commands,
+                    "loop": cost.loop,
+                    **cost.summary(),
+                    "calls": [call.function for call in cost.calls if not call.scheduled],
+                    "scheduled": [call.function for call in cost.calls if call.scheduled],
+                    "entity_selectors": cost.entity_selectors,
+                }
+                for location, cost in costs.items()
+            },
+        }
+
+    def write_report(
+        self,
+        path: pathlib.Path,
+        functions: dict[str, typing.Iterable[str]],
+        entry_points: typing.Iterable[str]
+    ):
+        path.write_text(json.dumps(self.report(functions, entry_points), indent=2), "utf-8")
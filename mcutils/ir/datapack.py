@@ -1,12 +1,15 @@
 import dataclasses
+import json
 import pathlib
+import typing
 
 import beet
 
-from .. import strings
+from .. import profiling, strings
 # noinspection PyCompatibility
-from . import commands
+from . import commands, cost_model, deduplication, invocation_counters, macros, pack_writer
 from .. import location
+from ..errors import compile_assert
 
 
 @dataclasses.dataclass
@@ -15,31 +18,232 @@ class Datapack:
     namespaces: dict[str, commands.CompileNamespace]
     description: str = "A Datapack generated by the mcutils_reborn module."
     pack_format: int = -2
+    # merge instantiations of the same template into macro functions, see macros
+    macro_functions: bool = False
+    # share one file between identical mcfunctions, see deduplication. Like macro_functions, this keeps all resolved
+    # mcfunctions in memory instead of streaming them
+    deduplicate: bool = False
 
-    def export(self, path: pathlib.Path) -> beet.DataPack:
-        out = beet.DataPack(
-            name=self.name,
-            path=path / self.name,
-            zipped=False,
-            description=self.description,
-            pack_format=self.pack_format,
-        )
-
+    def _assign_locations(self):
         for ns_name, namespace in self.namespaces.items():
             for func_name, func in namespace.command_functions.items():
                 for mcfunc_name, mcfunc in func.mcfunctions.items():
                     mcfunc.location = location.Location(ns_name, func_name + mcfunc_name)
 
+    def _entry_points(self) -> list[str]:
+        return [
+            func.mcfunctions[func.entry_point].location.to_str()
+            for namespace in self.namespaces.values()
+            for func in namespace.command_functions.values()
+        ]
+
+    def _resolve_functions(self) -> typing.Iterator[tuple[location.Location, str]]:
+        """Yield the text of every mcfunction, one at a time unless the mcfunctions are deduplicated or merged into
+        macro functions. Strings are resolved in a fixed order."""
+
+        compile_assert(
+            self.pack_format >= 26 or not any(namespace.return_commands for namespace in self.namespaces.values()),
+            "The return command needs pack format 26 or later."
+        )
+
+        if not (self.macro_functions or self.deduplicate):
+            yield from self._resolve_function_texts()
+            return
+
+        functions = {location_.to_str(): text for location_, text in self._resolve_function_texts()}
+
+        if self.macro_functions:
+            compile_assert(self.pack_format >= 18, "Macro functions need pack format 18 or later.")
+
+            with profiling.phase("macro_functions"):
+                merger = macros.MacroMerger(functions, [
+                    macros.Instantiation(
+                        template=func_path[:-1],
+                        root=f"{ns_name}:{'/'.join(func_path)}",
+                        entry=func.mcfunctions[func.entry_point].location.to_str(),
+                        mcfunctions=[mcfunc.location.to_str() for mcfunc in func.mcfunctions.values()]
+                    )
+                    for ns_name, namespace in self.namespaces.items()
+                    for func_path, func in namespace.command_functions.items()
+                ])
+                merger.run()
+
+            profiling.logger.info(merger.statistics.report())
+
+        if self.deduplicate:
+            with profiling.phase("deduplication"):
+                deduplicator = deduplication.Deduplicator(functions, keep=set(self._entry_points()))
+                deduplicator.run()
+
+            profiling.logger.info(deduplicator.statistics.report())
+
+        for name, text in functions.items():
+            namespace, path = name.split(":", 1)
+            yield location.Location(namespace, tuple(path.split("/"))), text
+
+    def resolve_functions(self) -> list[tuple[location.Location, str]]:
+        """The text of every mcfunction, to be shared between ``export`` or ``write`` and ``write_cost_report``
+        instead of resolving the strings (and merging and deduplicating) once for each of them."""
+
+        return list(self._resolve_functions())
+
+    def _resolve_function_texts(self) -> typing.Iterator[tuple[location.Location, str]]:
+        self._assign_locations()
+
         string_resolver = strings.StringResolver()
 
         for ns_name, namespace in self.namespaces.items():
             for func_name, func in namespace.command_functions.items():
                 for mcfunc_name, mcfunc in func.mcfunctions.items():
-                    commands = list(map(string_resolver.resolve_identifier, mcfunc.commands))
+                    with profiling.phase("StringResolver"):
+                        commands = list(map(string_resolver.resolve_identifier, mcfunc.commands))
+
+                    profiling.count("mcfunctions")
+                    yield mcfunc.location, "\n".join(commands)
+
+    def _function_tags(self) -> dict[str, list[str]]:
+        """The functions of every function tag, once the locations are assigned."""
+
+        out = {}
+
+        for namespace in self.namespaces.values():
+            for tag, functions in namespace.function_tags().items():
+                out.setdefault(tag, []).extend(
+                    func.mcfunctions[func.entry_point].location.to_str() for func in functions
+                )
+
+        return out
+
+    def write_cost_report(
+        self,
+        path: pathlib.Path,
+        model: cost_model.CostModel | None = None,
+        functions: typing.Iterable[tuple[location.Location, str]] | None = None
+    ) -> pathlib.Path:
+        """Write the static cost estimate of all functions (see cost_model) to ``path / f"{name}.cost.json"``, next to
+        the pack. Every compiled function is reported as an entry point. The ``functions`` are resolved unless they
+        are given, see ``resolve_functions``."""
+
+        if model is None:
+            model = cost_model.CostModel()
+
+        if functions is None:
+            functions = self._resolve_functions()
 
-                    # noinspection PyTypeChecker
-                    out[mcfunc.location.to_str()] = beet.Function("\n".join(commands), tags=[])
+        functions = {location_.to_str(): text.splitlines() for location_, text in functions}
+        entry_points = [location_ for location_ in self._entry_points() if location_ in functions]
+
+        out = path / f"{self.name}.cost.json"
+
+        with profiling.phase("cost_report"):
+            model.write_report(out, functions, entry_points)
+
+        return out
+
+    def write_counter_manifest(self, path: pathlib.Path) -> pathlib.Path:
+        """Write the invocation counters of all namespaces (see invocation_counters) to
+        ``path / f"{name}.counters.json"``, next to the pack."""
+
+        self._assign_locations()
+
+        counters = {
+            id(namespace.invocation_counters): namespace.invocation_counters for namespace in self.namespaces.values()
+        }
+        compile_assert(None not in counters.values(), "Invocation counters are not enabled for every namespace.")
+        # counter names are only unique within one InvocationCounters
+        compile_assert(len(counters) == 1, "All namespaces must share the same InvocationCounters.")
+
+        (counter,) = counters.values()
+        manifest = counter.manifest()
+
+        out = path / f"{self.name}.counters.json"
+        out.write_text(json.dumps(manifest, indent=2), "utf-8")
+
+        return out
+
+    def export(
+        self,
+        path: pathlib.Path,
+        functions: typing.Iterable[tuple[location.Location, str]] | None = None
+    ) -> beet.DataPack:
+        """Build the pack with beet and save it to ``path / name``. The ``functions`` are resolved unless they are
+        given, see ``resolve_functions``."""
+
+        with profiling.phase("export"):
+            return self._export(path, self._resolve_functions() if functions is None else functions)
+
+    def _export(self, path: pathlib.Path, functions: typing.Iterable[tuple[location.Location, str]]) -> beet.DataPack:
+        out = beet.DataPack(
+            name=self.name,
+            path=path / self.name,
+            zipped=False,
+            description=self.description,
+            pack_format=self.pack_format,
+        )
+
+        for function_location, text in functions:
+            # noinspection PyTypeChecker
+            out[function_location.to_str()] = beet.Function(text, tags=[])
+
+        for tag, values in self._function_tags().items():
+            out[tag] = beet.FunctionTag({"values": values})
 
         out.save(overwrite=True)
 
         return out
+
+    def write(
+        self,
+        path: pathlib.Path,
+        zipped: bool = False,
+        jobs: int = 1,
+        functions: typing.Iterable[tuple[location.Location, str]] | None = None
+    ) -> pack_writer.WriteStatistics:
+        """Stream the pack to ``path / name`` (or a zip archive ``path / name.zip``) without building it in memory.
+
+        The files are the same as the ones of ``export``. Unchanged files of a previous ``write`` are not rewritten.
+        Given ``functions`` (see ``resolve_functions``) are written instead of resolving them while streaming.
+        """
+
+        with profiling.phase("export", zipped=zipped, jobs=jobs):
+            return self._write(path, zipped, jobs, self._resolve_functions() if functions is None else functions)
+
+    def _write(
+        self,
+        path: pathlib.Path,
+        zipped: bool,
+        jobs: int,
+        functions: typing.Iterable[tuple[location.Location, str]]
+    ) -> pack_writer.WriteStatistics:
+        if zipped:
+            writer: pack_writer.PackWriter = pack_writer.ZipWriter(path / f"{self.name}.zip")
+        else:
+            writer = pack_writer.DirectoryWriter(path / self.name, jobs=jobs)
+
+        try:
+            writer.write("pack.mcmeta", (json.dumps({
+                "pack": {
+                    "description": self.description,
+                    "pack_format": self.pack_format,
+                }
+            }, indent=2) + "\n").encode())
+
+            for function_location, text in functions:
+                writer.write(
+                    f"data/{function_location.namespace}/functions/{'/'.join(function_location.path)}.mcfunction",
+                    text.encode()
+                )
+
+            for tag, values in self._function_tags().items():
+                namespace, tag_path = tag.split(":", 1)
+                writer.write(
+                    f"data/{namespace}/tags/functions/{tag_path}.json",
+                    (json.dumps({"values": values}, indent=2) + "\n").encode()
+                )
+        except BaseException:
+            writer.abort()
+            raise
+
+        writer.close()
+
+        return writer.statistics
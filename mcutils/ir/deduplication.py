@@ -0,0 +1,111 @@
+"""Deduplication of mcfunctions whose resolved commands are identical, see Datapack.deduplicate.
+
+Different instantiations and blocks often lower to the same commands, e.g. continuation blocks that only call the
+next block. Comments are ignored. Two mcfunctions are also identical if they only differ in the functions that they
+call and those are identical themselves, which includes loops that call themselves. The mcfunctions are partitioned
+by their commands without the called locations first, and the partition is refined by the classes of the callees
+until it is stable.
+
+Every class keeps one canonical mcfunction, the calls of the others are rewritten to it. Kept mcfunctions (the entry
+points, which may be called from outside the pack) are never removed, but calls of them are still redirected.
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import re
+import typing
+
+# calls and scheduled calls
+_CALL = re.compile(r"(?<=function )[\w.\-]+:[\w./\-]+(?![\w./\-])")
+# stands for a called location in the commands of a mcfunction
+_CALLEE = "\x00"
+
+
+@dataclasses.dataclass
+class DeduplicationStatistics:
+    classes: int = 0
+    mcfunctions_before: int = 0
+    mcfunctions_after: int = 0
+
+    def report(self) -> str:
+        return (
+            f"deduplication: {self.mcfunctions_before - self.mcfunctions_after} of {self.mcfunctions_before} "
+            f"files removed, {self.classes} distinct"
+        )
+
+
+def _skeleton(text: str, functions: dict[str, str]) -> tuple[str, list[str]]:
+    """The commands of a mcfunction without comments and called locations, and the called locations in order."""
+
+    callees = []
+
+    def callee(match: re.Match) -> str:
+        if match[0] not in functions:
+            return match[0]
+
+        callees.append(match[0])
+        return _CALLEE
+
+    commands = "\n".join(
+        _CALL.sub(callee, line)
+        for line in map(str.strip, text.splitlines())
+        if line and not line.startswith("#")
+    )
+
+    return commands, callees
+
+
+@dataclasses.dataclass
+class Deduplicator:
+    functions: dict[str, str]
+    keep: typing.Collection[str] = ()
+    statistics: DeduplicationStatistics = dataclasses.field(default_factory=DeduplicationStatistics)
+
+    def run(self) -> dict[str, str]:
+        self.statistics.mcfunctions_before = len(self.functions)
+
+        classes = self.partition()
+        canonical = {}
+
+        for location, class_ in classes.items():
+            # the first kept mcfunction of a class, otherwise its first mcfunction
+            if class_ not in canonical or (location in self.keep and canonical[class_] not in self.keep):
+                canonical[class_] = location
+
+        replacements = {
+            location: canonical[class_] for location, class_ in classes.items() if canonical[class_] != location
+        }
+
+        for location in replacements:
+            if location not in self.keep:
+                del self.functions[location]
+
+        for location, text in self.functions.items():
+            self.functions[location] = _CALL.sub(lambda match: replacements.get(match[0], match[0]), text)
+
+        self.statistics.classes = len(canonical)
+        self.statistics.mcfunctions_after = len(self.functions)
+
+        return self.functions
+
+    def partition(self) -> dict[str, int]:
+        """The class of every mcfunction, identical mcfunctions share their class."""
+
+        skeletons = {location: _skeleton(text, self.functions) for location, text in self.functions.items()}
+
+        ids: dict[typing.Hashable, int] = {}
+        classes = {location: ids.setdefault(commands, len(ids)) for location, (commands, _) in skeletons.items()}
+
+        # every round splits classes whose members call different classes, until no class is split
+        while True:
+            ids = {}
+            refined = {
+                location: ids.setdefault((classes[location], *(classes[callee] for callee in callees)), len(ids))
+                for location, (_, callees) in skeletons.items()
+            }
+
+            if len(ids) == len(set(classes.values())):
+                return refined
+
+            classes = refined
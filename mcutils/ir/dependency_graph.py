@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import collections
+import dataclasses
+import typing
+
+K = typing.TypeVar("K", bound=typing.Hashable)
+
+
+@dataclasses.dataclass
+class DependencyGraph(typing.Generic[K]):
+    """A directed graph where an edge ``a -> b`` means that ``a`` depends on ``b``.
+
+    Adjacency is stored in dicts instead of sets so that every traversal is deterministic.
+    """
+
+    dependencies: dict[K, dict[K, None]] = dataclasses.field(default_factory=dict)
+    dependents: dict[K, dict[K, None]] = dataclasses.field(default_factory=dict)
+
+    def add_node(self, node: K):
+        self.dependencies.setdefault(node, {})
+        self.dependents.setdefault(node, {})
+
+    def add_edge(self, node: K, dependency: K):
+        self.add_node(node)
+        self.add_node(dependency)
+
+        self.dependencies[node][dependency] = None
+        self.dependents[dependency][node] = None
+
+    def __contains__(self, node: K) -> bool:
+        return node in self.dependencies
+
+    def __len__(self) -> int:
+        return len(self.dependencies)
+
+    def strongly_connected_components(self) -> list[tuple[K, ...]]:
+        """Tarjan's algorithm without recursion. Components are returned dependencies-first."""
+
+        index: dict[K, int] = {}
+        low_link: dict[K, int] = {}
+        on_stack: set[K] = set()
+        stack: list[K] = []
+        out: list[tuple[K, ...]] = []
+
+        for root in self.dependencies:
+            if root in index:
+                continue
+
+            work: list[tuple[K, typing.Iterator[K]]] = [(root, iter(self.dependencies[root]))]
+            index[root] = low_link[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+
+            while work:
+                node, children = work[-1]
+
+                for child in children:
+                    if child not in index:
+                        index[child] = low_link[child] = len(index)
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(self.dependencies[child])))
+                        break
+                    elif child in on_stack:
+                        low_link[node] = min(low_link[node], index[child])
+                else:
+                    work.pop()
+
+                    if work:
+                        parent = work[-1][0]
+                        low_link[parent] = min(low_link[parent], low_link[node])
+
+                    if low_link[node] == index[node]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.remove(member)
+                            component.append(member)
+                            if member == node:
+                                break
+
+                        out.append(tuple(reversed(component)))
+
+        return out
+
+    def is_cyclic(self, component: tuple[K, ...]) -> bool:
+        return len(component) > 1 or component[0] in self.dependencies[component[0]]
+
+    def topological_order(self) -> typing.Iterator[tuple[K, ...]]:
+        """Yield strongly connected components such that every component comes after all of its dependencies.
+
+        This is Kahn's algorithm on the condensation, driven by the reverse (dependent) edges.
+        """
+
+        components = self.strongly_connected_components()
+        component_of = {node: i for i, component in enumerate(components) for node in component}
+
+        remaining: list[int] = [0] * len(components)
+        dependents: list[set[int]] = [set() for _ in components]
+
+        for i, component in enumerate(components):
+            for node in component:
+                for dependent in self.dependents[node]:
+                    j = component_of[dependent]
+                    if j != i and j not in dependents[i]:
+                        dependents[i].add(j)
+                        remaining[j] += 1
+
+        ready = collections.deque(i for i, count in enumerate(remaining) if count == 0)
+
+        while ready:
+            i = ready.popleft()
+            yield components[i]
+
+            for j in sorted(dependents[i]):
+                remaining[j] -= 1
+                if remaining[j] == 0:
+                    ready.append(j)
+
+    def find_cycle(self, component: tuple[K, ...]) -> list[K]:
+        """Return a closed path ``[a, b, ..., a]`` through the given cyclic component."""
+
+        members = set(component)
+        start = component[0]
+        parents: dict[K, K | None] = {start: None}
+        queue = collections.deque([start])
+
+        while queue:
+            node = queue.popleft()
+
+            for child in self.dependencies[node]:
+                if child == start:
+                    path = [node]
+                    while parents[path[-1]] is not None:
+                        path.append(parents[path[-1]])
+                    return [*reversed(path), start]
+
+                if child in members and child not in parents:
+                    parents[child] = node
+                    queue.append(child)
+
+        return list(component)
@@ -0,0 +1,176 @@
+"""Inlining of block calls, which saves mcfunction files and the ``function`` commands that call them.
+
+Lowering leaves many tiny blocks (``__if_reset_cond_var``, ``__while_chk_cond``, continuations, ``__return``) that
+are called from a single site or only forward to the next block. An unconditional ``function`` command runs the
+commands of the called function in place, so a BlockCallStatement can be replaced with the statements of its block.
+"""
+
+from __future__ import annotations
+
+import collections
+import dataclasses
+
+from . import blocks, dependency_graph, tree, tree_statements_base
+
+# blocks imports this module, so the alias cannot refer to blocks.Block directly
+Blocks = dict[tuple[str, ...], "blocks.Block"]
+
+
+def size(statement: tree_statements_base.Statement) -> int:
+    """The number of commands that a lowered statement takes, roughly."""
+
+    match statement:
+        case tree.CommentStatement():
+            return 0
+        case tree.LiteralStatement(strings=strings_):
+            return len(strings_)
+
+    return 1
+
+
+def block_size(block: blocks.Block) -> int:
+    return sum(map(size, block.statements))
+
+
+def call_graph(blocks_: Blocks) -> dependency_graph.DependencyGraph[tuple[str, ...]]:
+    graph: dependency_graph.DependencyGraph[tuple[str, ...]] = dependency_graph.DependencyGraph()
+
+    for path, block in blocks_.items():
+        graph.add_node(path)
+        for call in block.get_calls():
+            graph.add_edge(path, call)
+
+    return graph
+
+
+def forwarded_to(block: blocks.Block) -> tuple[str, ...] | None:
+    """The block that a block only calls, if it does nothing else."""
+
+    match block.statements:
+        case (blocks.BlockCallStatement(block=target),):
+            return target
+
+    return None
+
+
+@dataclasses.dataclass
+class InliningStatistics:
+    functions: int = 0
+    blocks_before: int = 0
+    blocks_after: int = 0
+    commands_before: int = 0
+    commands_after: int = 0
+
+    def add(self, other: InliningStatistics):
+        for field in dataclasses.fields(self):
+            setattr(self, field.name, getattr(self, field.name) + getattr(other, field.name))
+
+
+@dataclasses.dataclass
+class Inliner:
+    """Inlines block calls of a function.
+
+    A block is inlined if it has a single caller, which merges it into that caller, or if it takes at most
+    ``threshold`` commands and is not part of a loop (or at most one command), which copies it into every caller.
+    Conditional calls of empty blocks are removed (a conditional ``return run`` becomes a conditional ``return``) and
+    conditional calls of blocks that only call another block call that block directly.
+    """
+
+    threshold: int = 4
+    enabled: bool = True
+    statistics: InliningStatistics = dataclasses.field(default_factory=InliningStatistics)
+
+    def run(self, blocks_: Blocks, entry_point: tuple[str, ...]) -> Blocks:
+        """Inline the blocks reachable from the entry point, which is kept even if it is inlined somewhere."""
+
+        if not self.enabled:
+            return blocks_
+
+        out = dict(blocks_)
+        graph = call_graph(out)
+        components = graph.strongly_connected_components()
+        # blocks that may call themselves, e.g. the blocks of a loop
+        cyclic = {path for component in components if graph.is_cyclic(component) for path in component}
+        callers = collections.Counter(call for block in out.values() for call in block.get_calls())
+        callers[entry_point] += 1
+
+        def remove_call(path: tuple[str, ...]):
+            callers[path] -= 1
+
+            # the block may have been inlined at its last call site, its own calls are gone with it
+            if callers[path] == 0:
+                for call in out.pop(path).get_calls():
+                    remove_call(call)
+
+        def inline_into(path: tuple[str, ...]) -> blocks.Block:
+            # every statement remembers the blocks it was inlined from, which are not inlined again in it
+            statements = [(statement, frozenset({path})) for statement in reversed(out[path].statements)]
+            new_statements = []
+
+            while statements:
+                statement, inlined_from = statements.pop()
+
+                match statement:
+                    case blocks.BlockCallStatement(block=block) if block not in inlined_from and (
+                        callers[block] == 1
+                        or block_size(out[block]) <= 1
+                        or (block not in cyclic and block_size(out[block]) <= self.threshold)
+                    ):
+                        callee = out[block]
+
+                        for call in callee.get_calls():
+                            callers[call] += 1
+                        remove_call(block)
+
+                        # the inlined statements are visited next, so calls at their end are inlined too
+                        inlined_from = inlined_from | {block}
+                        statements += ((inlined, inlined_from) for inlined in reversed(callee.statements))
+                        continue
+                    case blocks.ConditionalBlockCallStatement(true_block=block) if block_size(out[block]) == 0:
+                        remove_call(block)
+
+                        # the caller still stops
+                        if statement.return_:
+                            new_statements.append(
+                                blocks.ConditionalReturnStatement(statement.condition, statement.unless)
+                            )
+                        continue
+                    case blocks.ConditionalBlockCallStatement(true_block=block) if block not in inlined_from and (
+                        (target := forwarded_to(out[block])) is not None
+                    ):
+                        callers[target] += 1
+                        remove_call(block)
+
+                        # the target may forward as well
+                        statements.append((dataclasses.replace(statement, true_block=target), inlined_from | {block}))
+                        continue
+
+                new_statements.append(statement)
+
+            return dataclasses.replace(out[path], statements=tuple(new_statements))
+
+        # callees first, so that the blocks that are inlined have already been inlined into
+        for component in components:
+            for path in component:
+                if path in out:
+                    out[path] = inline_into(path)
+
+        self._record(blocks_, out)
+
+        return out
+
+    def _record(self, before: Blocks, after: Blocks):
+        self.statistics.functions += 1
+        self.statistics.blocks_before += len(before)
+        self.statistics.blocks_after += len(after)
+        self.statistics.commands_before += sum(map(block_size, before.values()))
+        self.statistics.commands_after += sum(map(block_size, after.values()))
+
+    def report(self) -> str:
+        statistics = self.statistics
+
+        return (
+            f"inlining: {statistics.functions} functions, "
+            f"{statistics.blocks_before - statistics.blocks_after} of {statistics.blocks_before} files and "
+            f"{statistics.commands_before - statistics.commands_after} of {statistics.commands_before} commands saved"
+        )
@@ -0,0 +1,147 @@
+"""Optional runtime invocation counters, which show the functions of a datapack that run most often in game.
+
+With ``CompileNamespace.invocation_counters`` set, every mcfunction starts with
+``scoreboard players add <counter> mcutils_prof 1``. Every back edge of a loop (the call that starts the next
+iteration) gets a counter of its own, which is added to right before the call and under the same condition.
+``Datapack.write_counter_manifest`` maps the counters back to their template, compile-time args and block. Namespaces
+of the same datapack should share one InvocationCounters, otherwise their counter names collide.
+
+The objective has to exist in game before anything is counted::
+
+    scoreboard objectives add mcutils_prof dummy
+
+After running the pack, the counters are read from the ``data/scoreboard.dat`` of the world::
+
+    python -m mcutils.ir.invocation_counters testout/test.counters.json path/to/world
+"""
+
+from __future__ import annotations
+
+import argparse
+import dataclasses
+import json
+import pathlib
+import typing
+
+import nbtlib
+
+if typing.TYPE_CHECKING:
+    from . import commands
+
+
+@dataclasses.dataclass
+class Counter:
+    name: str
+    template: tuple[str, ...]
+    # the compile-time args as they appear in the name of the instantiation, see tree.compile_time_args_to_str
+    args: str
+    block: tuple[str, ...]
+    mcfunction: commands.McFunction = dataclasses.field(repr=False)
+    # the mcfunction that the back edge calls, None for the counter of a whole mcfunction
+    back_edge_to: commands.McFunction | None = dataclasses.field(default=None, repr=False)
+
+    def describe(self) -> dict[str, typing.Any]:
+        return {
+            "template": "/".join(self.template),
+            "args": self.args,
+            "block": "/".join(self.block),
+            "location": self.mcfunction.location.to_str(),
+            "back_edge_to": None if self.back_edge_to is None else self.back_edge_to.location.to_str(),
+        }
+
+
+@dataclasses.dataclass
+class InvocationCounters:
+    objective: str = "mcutils_prof"
+    prefix: str = "prof"
+    counters: list[Counter] = dataclasses.field(default_factory=list)
+
+    def add(
+        self,
+        func_path: tuple[str, ...],
+        block: tuple[str, ...],
+        mcfunction: commands.McFunction,
+        back_edge_to: commands.McFunction | None = None
+    ) -> str:
+        """Allocate a counter and return the command that counts it."""
+
+        counter = Counter(
+            name=f"{self.prefix}{len(self.counters)}",
+            template=func_path[:-1],
+            args=func_path[-1],
+            block=block,
+            mcfunction=mcfunction,
+            back_edge_to=back_edge_to
+        )
+        self.counters.append(counter)
+
+        return f"scoreboard players add {counter.name} {self.objective} 1"
+
+    def manifest(self) -> dict[str, typing.Any]:
+        """Requires the locations of the mcfunctions, see Datapack.write_counter_manifest."""
+
+        return {
+            "objective": self.objective,
+            "counters": {counter.name: counter.describe() for counter in self.counters},
+        }
+
+
+def read_scores(world: pathlib.Path, objective: str) -> dict[str, int]:
+    """The scores of an objective, from a world folder or its ``scoreboard.dat``."""
+
+    if world.is_dir():
+        world = world / "data" / "scoreboard.dat"
+
+    root = nbtlib.load(world)
+
+    return {
+        str(score["Name"]): int(score["Score"])
+        for score in root["data"]["PlayerScores"]
+        if str(score["Objective"]) == objective
+    }
+
+
+def hot_functions(manifest: dict[str, typing.Any], scores: dict[str, int]) -> list[dict[str, typing.Any]]:
+    """The counters of the manifest with their counts, most frequent first."""
+
+    rows = [
+        {"counter": name, "count": scores.get(name, 0), **counter}
+        for name, counter in manifest["counters"].items()
+    ]
+    rows.sort(key=lambda row: (-row["count"], row["counter"]))
+
+    return rows
+
+
+def format_table(rows: list[dict[str, typing.Any]], limit: int | None = None) -> str:
+    total = sum(row["count"] for row in rows if row["back_edge_to"] is None)
+    lines = [f"{'count':>10} {'share':>7}  {'kind':<9} function"]
+
+    for row in rows[:limit]:
+        share = row["count"] / total if total else 0
+        kind = "function" if row["back_edge_to"] is None else "back edge"
+        target = "" if row["back_edge_to"] is None else f" -> {row['back_edge_to']}"
+
+        lines.append(
+            f"{row['count']:>10} {share:>7.1%}  {kind:<9} {row['location']}{target}"
+            f" ({row['template']}[{row['args']}], block {row['block'] or '<entry>'})"
+        )
+
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("manifest", type=pathlib.Path)
+    parser.add_argument("world", type=pathlib.Path, help="world folder or its data/scoreboard.dat")
+    parser.add_argument("--limit", type=int, default=30)
+    args = parser.parse_args()
+
+    manifest = json.loads(args.manifest.read_text("utf-8"))
+    scores = read_scores(args.world, manifest["objective"])
+
+    print(format_table(hot_functions(manifest, scores), args.limit))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,300 @@
+"""Merging of template instantiations into macro functions, which need pack format 18 (see Datapack.macro_functions).
+
+Every distinct set of compile-time args monomorphizes a full copy of a template. Instantiations of a template whose
+mcfunctions only differ in some words of their commands, typically the text of the compile-time args, are merged
+into one macro function ``<template>/__macro``. The differing words become the macro arguments ``$(a0)``,
+``$(a1)``, ... and every call site passes the words of the instantiation that it called::
+
+    function test:print_var/__macro {a0:"i + 1",a1:"__var_i"}
+
+The merge works on the resolved commands, so it sees exactly what the instantiations do differently: an
+instantiation is only merged if substituting its arguments into the macro function gives back its commands. Calls
+of its own blocks pass the arguments on. Instantiations that contain a loop or are called from one stay specialized,
+since the commands of a macro function are parsed again on every call.
+"""
+
+from __future__ import annotations
+
+import collections
+import dataclasses
+import difflib
+import re
+
+from . import cost_model
+
+_LOCATION = re.compile(r"[\w.\-]+:[\w./\-]+")
+_TOKEN = re.compile(r"\w+|\s+|[^\w\s]")
+# arguments are passed on as quoted snbt strings, within a line
+_VALUE = r'([^"\\\n$\x00]*?)'
+
+# stands for the root of the instantiation in its normalized commands
+_SELF = "\x00"
+# between the mcfunctions of an instantiation in its normalized commands
+_SEPARATOR = "\n\x01\n"
+
+
+@dataclasses.dataclass
+class Instantiation:
+    template: tuple[str, ...]
+    # location of the instantiation, the mcfunctions of its blocks are below it
+    root: str
+    entry: str
+    mcfunctions: list[str]
+
+    @property
+    def namespace(self) -> str:
+        return self.root.split(":", 1)[0]
+
+    def relative(self, location: str) -> str:
+        return location[len(self.root):]
+
+
+@dataclasses.dataclass
+class MacroStatistics:
+    templates: int = 0
+    instantiations: int = 0
+    mcfunctions_before: int = 0
+    mcfunctions_after: int = 0
+
+    def report(self) -> str:
+        return (
+            f"macro functions: {self.instantiations} instantiations of {self.templates} templates merged, "
+            f"{self.mcfunctions_before - self.mcfunctions_after} of {self.mcfunctions_before} files saved"
+        )
+
+
+def _references(functions: dict[str, str], roots: set[str]) -> dict[str, list[tuple[str, int]]]:
+    """The functions that mention each root, with the position of every mention."""
+
+    out = collections.defaultdict(list)
+
+    for location, text in functions.items():
+        for match in _LOCATION.finditer(text):
+            name = match[0]
+
+            while name not in roots and "/" in name:
+                name = name.rsplit("/", 1)[0]
+
+            if name in roots:
+                out[name].append((location, match.start()))
+
+    return out
+
+
+def _is_call(text: str, position: int) -> bool:
+    return text.startswith("function ", position - 9) and not text.startswith("schedule ", position - 18)
+
+
+def _arguments(names: list[str], values: list[str]) -> str:
+    return "{" + ",".join(f'{name}:"{value}"' for name, value in zip(names, values)) + "}"
+
+
+@dataclasses.dataclass
+class MacroMerger:
+    functions: dict[str, str]
+    instantiations: list[Instantiation]
+    # upper bound of the macro arguments of a template, beyond that the instantiations have little in common
+    max_arguments: int = 8
+    statistics: MacroStatistics = dataclasses.field(default_factory=MacroStatistics)
+
+    def run(self) -> dict[str, str]:
+        self.statistics.mcfunctions_before = len(self.functions)
+
+        hot = self._hot()
+
+        # hot instantiations stay specialized
+        candidates: dict[tuple[str, ...], list[Instantiation]] = collections.defaultdict(list)
+        for inst in self.instantiations:
+            if hot.isdisjoint(inst.mcfunctions):
+                candidates[inst.namespace, *inst.template].append(inst)
+
+        # merged callers pass arguments to their callees, which may make the callers of those mergeable
+        while candidates:
+            merged = [key for key, group in candidates.items() if self._merge(group)]
+            if not merged:
+                break
+
+            for key in merged:
+                del candidates[key]
+
+        self.statistics.mcfunctions_after = len(self.functions)
+
+        return self.functions
+
+    def _hot(self) -> set[str]:
+        """The mcfunctions that run in a loop, i.e. that are part of one or called from one."""
+
+        costs = cost_model.CostModel().analyze(
+            {location: text.splitlines() for location, text in self.functions.items()}
+        )
+        stack = [location for location, cost in costs.items() if cost.loop]
+        out = set(stack)
+
+        while stack:
+            for call in costs[stack.pop()].calls:
+                if not call.scheduled and call.function in costs and call.function not in out:
+                    out.add(call.function)
+                    stack.append(call.function)
+
+        return out
+
+    def _normalized(self, inst: Instantiation) -> str:
+        """The commands of all mcfunctions of an instantiation, with its own location replaced."""
+
+        root = re.compile(re.escape(inst.root) + r"(?![\w.\-])")
+
+        return _SEPARATOR.join(
+            root.sub(_SELF, self.functions[location])
+            for location in sorted(inst.mcfunctions, key=inst.relative)
+        )
+
+    def _mergeable(self, inst: Instantiation, references: list[tuple[str, int]]) -> bool:
+        for location, position in references:
+            text = self.functions[location]
+
+            if location in inst.mcfunctions:
+                # calls of its own blocks
+                if not _is_call(text, position):
+                    return False
+            elif not (_is_call(text, position) and _LOCATION.match(text, position)[0] == inst.entry):
+                return False
+
+        return True
+
+    def _merge(self, group: list[Instantiation]) -> bool:
+        references = _references(self.functions, {inst.root for inst in group})
+        group = [
+            inst for inst in group
+            if all(location in self.functions for location in inst.mcfunctions)
+            and self._mergeable(inst, references[inst.root])
+        ]
+
+        # the instantiations must consist of the same blocks
+        shapes = collections.Counter(tuple(sorted(map(inst.relative, inst.mcfunctions))) for inst in group)
+        if not shapes:
+            return False
+        shape = shapes.most_common(1)[0][0]
+        group = [inst for inst in group if tuple(sorted(map(inst.relative, inst.mcfunctions))) == shape]
+
+        texts = {inst.root: self._normalized(inst) for inst in group}
+
+        # drop the instantiations that do not fit the others until all of them fit
+        while len(group) >= 2:
+            result = self._anti_unify([texts[inst.root] for inst in group])
+
+            if result is None:
+                return False
+
+            pattern, values = result
+            fitting = [inst for inst, inst_values in zip(group, values) if inst_values is not None]
+
+            if len(fitting) == len(group):
+                break
+
+            group = fitting
+        else:
+            return False
+
+        if not self._replace(group, pattern, values):
+            return False
+
+        self.statistics.templates += 1
+        self.statistics.instantiations += len(group)
+
+        return True
+
+    def _anti_unify(self, texts: list[str]) -> tuple[list[str], list[list[str] | None]] | None:
+        """Split the first text into constant pieces with the arguments between them, and find the arguments of
+        every text. The arguments of a text are None if it does not fit."""
+
+        base = _TOKEN.findall(texts[0])
+        spans: list[list[int]] = []
+
+        for text in texts[1:]:
+            matcher = difflib.SequenceMatcher(None, base, _TOKEN.findall(text), autojunk=False)
+            spans += ([i1, i2] for tag, i1, i2, _, _ in matcher.get_opcodes() if tag != "equal")
+
+        merged: list[list[int]] = []
+        for start, end in sorted(spans):
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+
+        if len(merged) > self.max_arguments:
+            return None
+
+        pieces = []
+        previous = 0
+        for start, end in merged:
+            pieces.append("".join(base[previous:start]))
+            previous = end
+        pieces.append("".join(base[previous:]))
+
+        regex = re.compile(_VALUE.join(map(re.escape, pieces)))
+        values = []
+
+        for text in texts:
+            match = regex.fullmatch(text)
+            values.append(None if match is None else list(match.groups()))
+
+        return pieces, values
+
+    def _replace(self, group: list[Instantiation], pieces: list[str], values: list[list[str]]) -> bool:
+        # holes that are the same for every instantiation are constants, holes that are always equal share an argument
+        columns = {}
+        for i in range(len(pieces) - 1):
+            column = tuple(inst_values[i] for inst_values in values)
+            if len(set(column)) > 1:
+                columns.setdefault(column, f"a{len(columns)}")
+
+        names = list(columns.values())
+        arguments = list(columns)
+
+        text = pieces[0]
+        for i, piece in enumerate(pieces[1:]):
+            column = tuple(inst_values[i] for inst_values in values)
+            text += (f"$({columns[column]})" if column in columns else column[0]) + piece
+
+        # the called functions must be known, otherwise they could be merged away
+        if re.search(r"function [^\s]*\$\(", text):
+            return False
+
+        macro_root = f"{group[0].namespace}:{'/'.join(group[0].template)}/__macro"
+        passed_on = f" {_arguments(names, [f'$({name})' for name in names])}" if names else ""
+
+        lines_of = {}
+        for relative, member in zip(sorted(map(group[0].relative, group[0].mcfunctions)), text.split(_SEPARATOR)):
+            lines = []
+            for line in member.split("\n"):
+                line = re.sub(
+                    f"function {_SELF}([\\w./\\-]*)$",
+                    lambda match: f"function {macro_root}{match[1]}{passed_on}",
+                    line
+                )
+                lines.append(f"${line}" if "$(" in line else line)
+            lines_of[macro_root + relative] = "\n".join(lines)
+
+        # e.g. a block called with schedule, which cannot pass the arguments on
+        if any(_SELF in text for text in lines_of.values()):
+            return False
+
+        for inst in group:
+            for location in inst.mcfunctions:
+                del self.functions[location]
+
+        self.functions.update(lines_of)
+
+        # the call sites pass the arguments of the instantiation that they called
+        calls = {
+            inst.entry: f"function {macro_root}{inst.relative(inst.entry)}"
+                        + (f" {_arguments(names, [column[k] for column in arguments])}" if names else "")
+            for k, inst in enumerate(group)
+        }
+        call = re.compile(r"function (" + "|".join(map(re.escape, calls)) + r")(?![\w./\-])")
+
+        for location, text in self.functions.items():
+            if "function " in text:
+                self.functions[location] = call.sub(lambda match: calls[match[1]], text)
+
+        return True
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import concurrent.futures
+import contextlib
+import dataclasses
+import hashlib
+import json
+import os
+import pathlib
+import typing
+import zipfile
+
+# content hashes of the files written by the last export, next to the pack so that they are not part of it
+_MANIFEST_SUFFIX = ".hashes.json"
+
+
+@dataclasses.dataclass
+class WriteStatistics:
+    written: int = 0
+    skipped: int = 0
+    removed: int = 0
+    bytes_written: int = 0
+
+
+class PackWriter(typing.Protocol):
+    statistics: WriteStatistics
+
+    def write(self, relative_path: str, data: bytes):
+        ...
+
+    def close(self):
+        ...
+
+    def abort(self):
+        ...
+
+
+@dataclasses.dataclass
+class DirectoryWriter:
+    """Writes files into a directory, on a thread pool with ``jobs > 1``.
+
+    Files whose content hash and stat did not change since the last export are not rewritten. Files of earlier
+    exports that are not part of this one are removed on close.
+    """
+
+    root: pathlib.Path
+    jobs: int = 1
+    statistics: WriteStatistics = dataclasses.field(default_factory=WriteStatistics)
+
+    def __post_init__(self):
+        self._manifest_path = self.root.with_name(self.root.name + _MANIFEST_SUFFIX)
+
+        try:
+            self._old_manifest: dict[str, list] = json.loads(self._manifest_path.read_text("utf-8"))
+        except (FileNotFoundError, ValueError):
+            self._old_manifest = {}
+
+        self._manifest: dict[str, list] = {}
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs) if self.jobs > 1 else None
+        self._pending: dict[concurrent.futures.Future, str] = {}
+
+    def write(self, relative_path: str, data: bytes):
+        if self._executor is None:
+            self._record(relative_path, *self._write(relative_path, data))
+            return
+
+        # bound the number of files held in memory
+        if len(self._pending) >= 4 * self.jobs:
+            done, _ = concurrent.futures.wait(self._pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            self._collect(done)
+
+        self._pending[self._executor.submit(self._write, relative_path, data)] = relative_path
+
+    def _collect(self, futures: typing.Iterable[concurrent.futures.Future]):
+        for future in futures:
+            self._record(self._pending.pop(future), *future.result())
+
+    def _record(self, relative_path: str, entry: list, bytes_written: int | None):
+        self._manifest[relative_path] = entry
+
+        if bytes_written is None:
+            self.statistics.skipped += 1
+        else:
+            self.statistics.written += 1
+            self.statistics.bytes_written += bytes_written
+
+    def _write(self, relative_path: str, data: bytes) -> tuple[list, int | None]:
+        path = self.root / relative_path
+        digest = hashlib.sha256(data).hexdigest()
+        old = self._old_manifest.get(relative_path)
+
+        if old is not None and old[0] == digest:
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                pass
+            else:
+                if [stat.st_size, stat.st_mtime_ns] == old[1:]:
+                    return old, None
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+        stat = path.stat()
+        return [digest, stat.st_size, stat.st_mtime_ns], len(data)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._collect(list(self._pending))
+
+        for directory, _, files in os.walk(self.root, topdown=False):
+            for file in files:
+                path = pathlib.Path(directory, file)
+                if path.relative_to(self.root).as_posix() not in self._manifest:
+                    path.unlink()
+                    self.statistics.removed += 1
+
+            with contextlib.suppress(OSError):
+                # only succeeds for empty directories
+                pathlib.Path(directory).rmdir()
+
+        self._manifest_path.write_text(json.dumps(self._manifest, sort_keys=True), "utf-8")
+
+    def abort(self):
+        # keeps the old manifest, files written so far are detected as changed by the next export
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+@dataclasses.dataclass
+class ZipWriter:
+    """Streams files into a zip archive. The archive replaces the old one once it is complete."""
+
+    path: pathlib.Path
+    compression: int = zipfile.ZIP_DEFLATED
+    statistics: WriteStatistics = dataclasses.field(default_factory=WriteStatistics)
+
+    def __post_init__(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._temp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        self._zip = zipfile.ZipFile(self._temp_path, "w", compression=self.compression)
+
+    def write(self, relative_path: str, data: bytes):
+        self._zip.writestr(relative_path, data)
+
+        self.statistics.written += 1
+        self.statistics.bytes_written += len(data)
+
+    def close(self):
+        self._zip.close()
+        os.replace(self._temp_path, self.path)
+
+    def abort(self):
+        self._zip.close()
+        self._temp_path.unlink()
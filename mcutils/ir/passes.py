@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+import dataclasses
+import time
+import typing
+
+from . import blocks, peephole, tree, tree_statements_base
+from ..errors import compile_assert
+
+Statements = typing.Sequence[tree_statements_base.Statement]
+
+
+@dataclasses.dataclass(frozen=True)
+class PassContext:
+    std_lib_config: blocks.StdLibConfig
+    scope: tree.Scope
+
+
+@dataclasses.dataclass(frozen=True)
+class Pass:
+    """A rewrite of the statements of a block.
+
+    A pass only runs on blocks that contain a statement of a type it ``consumes``. Whenever it changes a block, all
+    passes that consume any of the types it ``produces`` are scheduled again.
+    """
+
+    name: str
+    function: typing.Callable[[Statements, PassContext], list[tree_statements_base.Statement]]
+    consumes: tuple[type[tree_statements_base.Statement], ...]
+    produces: tuple[type[tree_statements_base.Statement], ...]
+
+    def applies_to(self, statements: Statements) -> bool:
+        return any(isinstance(statement, self.consumes) for statement in statements)
+
+    def feeds(self, other: Pass) -> bool:
+        # produced types may be base classes, e.g. Statement for passes that can produce anything
+        return any(
+            issubclass(produced, consumed) or issubclass(consumed, produced)
+            for produced in self.produces
+            for consumed in other.consumes
+        )
+
+
+@dataclasses.dataclass
+class PassStatistics:
+    runs: int = 0
+    skipped: int = 0
+    unchanged: int = 0
+    seconds: float = 0.0
+    statements_before: int = 0
+    statements_after: int = 0
+
+    def add(self, other: PassStatistics):
+        for field in dataclasses.fields(self):
+            setattr(self, field.name, getattr(self, field.name) + getattr(other, field.name))
+
+
+@dataclasses.dataclass
+class PassManager:
+    """Runs passes on a block until none of them changes it anymore."""
+
+    passes: list[Pass]
+    max_runs: int = 1000
+    statistics: dict[str, PassStatistics] = dataclasses.field(default_factory=dict)
+
+    def __post_init__(self):
+        self._feeds = [[j for j, other in enumerate(self.passes) if pass_.feeds(other)] for pass_ in self.passes]
+
+        for pass_ in self.passes:
+            self.statistics.setdefault(pass_.name, PassStatistics())
+
+    def run(self, statements: Statements, context: PassContext) -> list[tree_statements_base.Statement]:
+        statements = list(statements)
+        # passes run in the order they were given, the earliest pending one first
+        pending = set(range(len(self.passes)))
+        runs = 0
+
+        while pending:
+            i = min(pending)
+            pending.remove(i)
+            pass_ = self.passes[i]
+
+            if not pass_.applies_to(statements):
+                self._record(pass_, skipped=True)
+                continue
+
+            runs += 1
+            compile_assert(runs <= self.max_runs, f"Passes did not reach a fixed point after {self.max_runs} runs.")
+
+            start = time.perf_counter()
+            new_statements = list(pass_.function(statements, context))
+            seconds = time.perf_counter() - start
+
+            changed = len(new_statements) != len(statements) or any(
+                a is not b for a, b in zip(new_statements, statements)
+            )
+
+            self._record(pass_, changed=changed, seconds=seconds, before=len(statements), after=len(new_statements))
+
+            if changed:
+                pending.update(self._feeds[i])
+                statements = new_statements
+
+        return statements
+
+    def _record(
+        self,
+        pass_: Pass,
+        skipped: bool = False,
+        changed: bool = False,
+        seconds: float = 0.0,
+        before: int = 0,
+        after: int = 0
+    ):
+        statistics = self.statistics[pass_.name]
+
+        if skipped:
+            statistics.skipped += 1
+            return
+
+        statistics.runs += 1
+        statistics.unchanged += not changed
+        statistics.seconds += seconds
+        statistics.statements_before += before
+        statistics.statements_after += after
+
+    def report(self) -> str:
+        width = max(map(len, self.statistics), default=0) + 1
+        lines = [f"{'pass':<{width}} {'runs':>7} {'skipped':>8} {'unchanged':>10} {'ms':>10} {'statements':>18}"]
+
+        for name, statistics in sorted(self.statistics.items(), key=lambda item: -item[1].seconds):
+            delta = statistics.statements_after - statistics.statements_before
+            lines.append(
+                f"{name:<{width}} {statistics.runs:>7} {statistics.skipped:>8} {statistics.unchanged:>10} "
+                f"{statistics.seconds * 1000:>10.2f} {statistics.statements_before:>8} {delta:>+9}"
+            )
+
+        return "\n".join(lines)
+
+
+def middle_end(peephole_rules: typing.Iterable[str] | None = None) -> PassManager:
+    """The statement passes that lower blocks to primitive assignments, function calls and literal commands.
+
+    They are followed by the given peephole rules (see peephole.rules), all of them by default.
+    """
+
+    rules = peephole.rules()
+
+    if peephole_rules is None:
+        peephole_rules = rules
+
+    return PassManager([
+        Pass(
+            name="returns",
+            function=lambda statements, context: blocks.BlockedFunction.transform_returns(statements),
+            consumes=(tree.ReturnStatement,),
+            produces=(tree.AssignmentStatement,)
+        ),
+        Pass(
+            name="assignments",
+            function=lambda statements, context: blocks.BlockedFunction.transform_assignments(statements),
+            consumes=(tree.AssignmentStatement,),
+            produces=(
+                blocks.SimpleAssignmentStatement, blocks.FunctionCallStatement, tree.LiteralStatement,
+                tree.StackPushStatement, tree.StackPopStatement
+            )
+        ),
+        Pass(
+            name="stack_ops",
+            function=lambda statements, context: blocks.BlockedFunction.transform_stack_ops(
+                statements, context.std_lib_config
+            ),
+            consumes=(tree.StackPushStatement, tree.StackPopStatement),
+            produces=(tree.AssignmentStatement,)
+        ),
+        Pass(
+            name="pyfuncs",
+            function=lambda statements, context: blocks.BlockedFunction.expand_pyfuncs(statements, context.scope),
+            consumes=(blocks.FunctionCallStatement,),
+            # py functions may return any statement
+            produces=(tree_statements_base.Statement,)
+        ),
+        *(
+            Pass(
+                name=f"peephole.{rule.name}",
+                function=lambda statements, context, rule=rule: rule.function(statements),
+                consumes=rule.consumes,
+                produces=rule.consumes
+            )
+            for rule in map(rules.__getitem__, peephole_rules)
+        ),
+    ])
@@ -0,0 +1,283 @@
+"""Peephole rules that remove redundant primitive assignments from the statements of a block.
+
+Every rule runs as a pass of the middle end (see passes.middle_end), so it can be turned off and its statistics show
+how many statements it removed. Rules only rewrite SimpleAssignmentStatements and InPlaceOperationStatements, which
+lower to one command each on scoreboards.
+
+Scratch locations (see std.temporary) are written before they are read in the same block, so a function never reads
+the temporaries of its caller and calls do not make them live.
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import functools
+import typing
+
+from . import blocks, tree, tree_statements_base
+from .. import strings
+from ..data import stores
+from ..lib import std
+
+Statements = typing.Sequence[tree_statements_base.Statement]
+
+# ("score", player, objective) or ("nbt", container type, container argument, path)
+Location = tuple
+
+
+@dataclasses.dataclass(frozen=True)
+class Rule:
+    name: str
+    function: typing.Callable[[Statements], list[tree_statements_base.Statement]]
+    consumes: tuple[type[tree_statements_base.Statement], ...]
+
+
+def _normalize(string: strings.String | str) -> strings.String | str:
+    if isinstance(string, strings.LiteralString) and not string.args:
+        return string.literal
+
+    return string
+
+
+def location(store: stores.ReadableStore) -> Location | None:
+    match store:
+        case stores.ScoreboardStore(player=player, objective=objective):
+            return "score", _normalize(player), _normalize(objective)
+        case stores.NbtStore(nbt_container_type=type_, nbt_container_argument=argument, path=path):
+            return "nbt", type_, _normalize(argument), _normalize(path)
+
+    return None
+
+
+def _paths_overlap(a: strings.String | str, b: strings.String | str) -> bool:
+    if not isinstance(a, str) or not isinstance(b, str):
+        return True
+
+    a, b = sorted((a, b), key=len)
+    return b == a or b.startswith((a + ".", a + "["))
+
+
+def may_alias(a: Location | None, b: Location | None) -> bool:
+    if a is None or b is None or a[0] != b[0]:
+        return False
+
+    if a[0] == "score":
+        return a == b
+
+    # entity selectors may select the same entity
+    if a[1] != b[1] or (a[1] == "storage" and a[2] != b[2]):
+        return False
+
+    return _paths_overlap(a[3], b[3])
+
+
+def is_plain_move(src: stores.ReadableStore, dst: stores.WritableStore) -> bool:
+    """Whether the assignment copies the value without a conversion, see stores_conv.nbt_to_nbt."""
+
+    match src, dst:
+        case stores.ScoreboardStore(), stores.ScoreboardStore():
+            return True
+        case stores.NbtStore(), stores.NbtStore():
+            return (
+                src.is_data_type(stores.AnyDataType) or dst.is_data_type(stores.AnyDataType)
+                or dst.is_data_type(src.dtype_obj)
+            )
+
+    return False
+
+
+def _temporaries() -> dict[Location, bool]:
+    # rebuilt every time, temporaries are registered lazily (see expressions.get_temp_var)
+    return {location(store): live_out for store, live_out in list(std.TEMPORARIES)}
+
+
+def _mentions(string: strings.String | str, loc: Location) -> bool:
+    """Whether a command may refer to a location."""
+
+    # scores are told apart by their player, scratch nbt tags by their storage
+    key = loc[1] if loc[0] == "score" else loc[2]
+
+    match string:
+        case str():
+            return isinstance(key, str) and key in string
+        case strings.LiteralString(literal=literal, args=args):
+            return _mentions(literal, loc) or any(_mentions(arg, loc) for arg in args)
+        case strings.UniqueString():
+            return string == key
+        case strings.Comment():
+            return False
+
+    return True
+
+
+def live_temporaries(statements: Statements) -> list[frozenset[Location]]:
+    """The temporaries that may be read after each statement."""
+
+    temporaries = _temporaries()
+    live = {loc for loc, live_out in temporaries.items() if live_out}
+    out = [frozenset()] * len(statements)
+
+    def read(store: stores.ReadableStore):
+        live.update(loc for loc in temporaries if may_alias(location(store), loc))
+
+    for i in range(len(statements) - 1, -1, -1):
+        out[i] = frozenset(live)
+
+        match statements[i]:
+            case blocks.SimpleAssignmentStatement(src=src, dst=dst):
+                live.discard(location(dst))
+                read(src)
+            case tree.InPlaceOperationStatement(src=src, dst=dst):
+                read(src)
+                read(dst)
+            case blocks.ConditionalBlockCallStatement(condition=condition) | blocks.ConditionalReturnStatement(
+                condition=condition
+            ) as statement:
+                # the mcfunction ends here if it returns
+                if isinstance(statement, blocks.ConditionalReturnStatement) or statement.return_:
+                    live.update(loc for loc, live_out in temporaries.items() if live_out)
+
+                match condition:
+                    case blocks.ScoreComparison(left=left, right=right):
+                        read(left)
+                        read(right)
+                    case _:
+                        read(condition)
+            case tree.LiteralStatement(strings=strings_):
+                live.update(loc for loc in temporaries if any(_mentions(string, loc) for string in strings_))
+            case (
+                blocks.FunctionCallStatement() | blocks.BlockCallStatement() | blocks.ScheduledBlockCallStatement()
+                | tree.CommentStatement()
+            ):
+                pass
+            case _:
+                live = set(temporaries)
+
+    return out
+
+
+def remove_self_moves(statements: Statements) -> list[tree_statements_base.Statement]:
+    return [
+        statement for statement in statements
+        if not (
+            isinstance(statement, blocks.SimpleAssignmentStatement)
+            and location(statement.src) is not None
+            and location(statement.src) == location(statement.dst)
+            and is_plain_move(statement.src, statement.dst)
+        )
+    ]
+
+
+def forward_temporaries(statements: Statements) -> list[tree_statements_base.Statement]:
+    """``x -> temp; temp -> y`` becomes ``x -> y`` if the temporary is not read afterwards and one of the two
+    assignments is a plain move."""
+
+    temporaries = _temporaries()
+    live = live_temporaries(statements)
+    out = []
+    i = 0
+
+    while i < len(statements):
+        match statements[i:i + 2]:
+            case [
+                blocks.SimpleAssignmentStatement(src=src, dst=temp),
+                blocks.SimpleAssignmentStatement(src=temp2, dst=dst)
+            ] if (
+                location(temp) in temporaries
+                and location(temp2) == location(temp) != location(dst)
+                and location(temp) not in live[i + 1]
+            ):
+                # the value must be converted exactly like it was from or to the temporary
+                if is_plain_move(temp2, dst):
+                    if isinstance(dst, stores.NbtStore):
+                        dst = dst.with_dtype(temp.dtype_obj)
+                elif is_plain_move(src, temp):
+                    if isinstance(src, stores.NbtStore):
+                        src = src.with_dtype(temp2.dtype_obj)
+                else:
+                    out.append(statements[i])
+                    i += 1
+                    continue
+
+                out.append(blocks.SimpleAssignmentStatement(src, dst))
+                i += 2
+            case _:
+                out.append(statements[i])
+                i += 1
+
+    return out
+
+
+def remove_dead_temporary_stores(statements: Statements) -> list[tree_statements_base.Statement]:
+    temporaries = _temporaries()
+    live = live_temporaries(statements)
+
+    return [
+        statement for statement, live_after in zip(statements, live)
+        if not (
+            isinstance(statement, blocks.SimpleAssignmentStatement)
+            and location(statement.dst) in temporaries
+            and location(statement.dst) not in live_after
+        )
+    ]
+
+
+def _const_increment(statement: tree_statements_base.Statement) -> int | None:
+    match statement:
+        case tree.InPlaceOperationStatement(src=stores.ConstInt(value=value), op="+"):
+            return int(value)
+        case tree.InPlaceOperationStatement(src=stores.ConstInt(value=value), op="-"):
+            return -int(value)
+
+    return None
+
+
+def remove_zero_adds(statements: Statements) -> list[tree_statements_base.Statement]:
+    return [statement for statement in statements if _const_increment(statement) != 0]
+
+
+def fold_adds(statements: Statements) -> list[tree_statements_base.Statement]:
+    """Merge consecutive additions of constants to the same whole number."""
+
+    out = []
+
+    for statement in statements:
+        increment = _const_increment(statement)
+
+        if (
+            out
+            and increment is not None
+            and (previous := _const_increment(out[-1])) is not None
+            and location(out[-1].dst) == location(statement.dst)
+            and out[-1].dst.is_data_type(stores.WholeNumberType)
+            and statement.dst.is_data_type(out[-1].dst.dtype_obj)
+        ):
+            # scores wrap around at 32 bits
+            total = (previous + increment + 2 ** 31) % 2 ** 32 - 2 ** 31
+
+            # scoreboard players remove cannot remove 2^31
+            if total != -2 ** 31:
+                out[-1] = dataclasses.replace(out[-1], src=stores.ConstInt(total), op="+")
+                continue
+
+        out.append(statement)
+
+    return out
+
+
+# built on first use, the statement classes do not exist yet while blocks imports this module
+@functools.cache
+def rules() -> dict[str, Rule]:
+    assignments = (blocks.SimpleAssignmentStatement,)
+    in_place_operations = (tree.InPlaceOperationStatement,)
+
+    return {
+        rule.name: rule
+        for rule in (
+            Rule("self_moves", remove_self_moves, assignments),
+            Rule("forward_temporaries", forward_temporaries, assignments),
+            Rule("dead_temporary_stores", remove_dead_temporary_stores, assignments),
+            Rule("zero_adds", remove_zero_adds, in_place_operations),
+            Rule("fold_adds", fold_adds, in_place_operations),
+        )
+    }
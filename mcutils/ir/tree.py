@@ -1,18 +1,53 @@
 from __future__ import annotations
 
 import base64
+import collections
 
 import ast_comments as ast
 import dataclasses
 import typing
+import weakref
 
 from .tree_statements_base import Statement, StoppingStatement, ContinueStatement, BreakStatement
 from ..data import stores, object_model, expressions
 from ..errors import CompilationError, compile_assert
-from .. import strings, nbt
+from .. import strings, nbt, profiling
 from ..lib import std
 
 
+class _Undefined:
+    def __repr__(self):
+        return "UNDEFINED"
+
+
+# returned by Scope.lookup for names that don't resolve, since None is a valid compile-time arg
+UNDEFINED: typing.Final = _Undefined()
+
+# decorators of the templates that the pack runs on its own, with the function tag that runs them
+ENTRY_POINT_DECORATORS: typing.Final[dict[str, str | None]] = {
+    "load": "minecraft:load",
+    "tick": "minecraft:tick",
+    # compiled even if nothing calls it, e.g. to be run by hand
+    "export": None,
+}
+
+# dtypes of unspecified variables that become scores if they only hold ints, see TreeFunction.infer_int_variables
+_PROMOTABLE_DTYPES = (stores.AnyDataType, stores.NumberType, stores.WholeNumberType)
+_INT_DTYPES = (stores.ByteType, stores.ShortType, stores.IntType)
+# binary operators that are scoreboard operations, see BinOpExpression.fetch_to
+_INT_OPERATORS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Mod)
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Symbol:
+    """Everything a name resolves to in a scope, one slot per kind."""
+
+    variable_type: VariableType | _Undefined = UNDEFINED
+    variable: stores.ReadableStore | stores.WritableStore | _Undefined = UNDEFINED
+    string: strings.String | _Undefined = UNDEFINED
+    pyfunc: typing.Callable | _Undefined = UNDEFINED
+    compile_time_arg: typing.Any = UNDEFINED
+
+
 @dataclasses.dataclass
 class Scope:
     parent_scope: Scope | None = None
@@ -23,57 +58,107 @@ class Scope:
     pyfuncs: dict[str, typing.Callable] = dataclasses.field(default_factory=dict)
     compile_time_args: dict[str, typing.Any] = dataclasses.field(default_factory=dict)
 
+    # flattened view of this scope and all of its parents, None until it is built and after one of them changed
+    _table: dict[str, Symbol] | None = dataclasses.field(default=None, init=False, repr=False, compare=False)
+    _collapsed: Scope | None = dataclasses.field(default=None, init=False, repr=False, compare=False)
+    # the scopes that have this one as their parent, by id, whose tables a change of this scope invalidates
+    _children: weakref.WeakValueDictionary[int, Scope] = dataclasses.field(
+        default_factory=weakref.WeakValueDictionary, init=False, repr=False, compare=False
+    )
+
     _ALLOWED_TYPES = typing.Literal["variable_type", "string", "pyfunc", "compile_time_arg", "variable"]
 
+    def __post_init__(self):
+        if self.parent_scope is not None:
+            self.parent_scope._children[id(self)] = self
+
+    def _own_symbols(self) -> typing.Iterator[tuple[str, dict[str, typing.Any]]]:
+        yield "variable_type", self.variable_types
+        yield "variable", self.variables
+        yield "string", self.strings_
+        yield "pyfunc", self.pyfuncs
+        yield "compile_time_arg", self.compile_time_args
+
+    @staticmethod
+    def _define(table: dict[str, Symbol], kind: str, symbols: dict[str, typing.Any]):
+        # symbols are shared with the tables of parent scopes, so they are replaced instead of changed
+        for name, value in symbols.items():
+            table[name] = dataclasses.replace(table.get(name, _EMPTY_SYMBOL), **{kind: value})
+
+    def _invalidate_children(self):
+        """Drop the tables of all scopes below this one. Changes to other scopes (e.g. sibling function scopes) keep
+        them valid."""
+
+        for child in list(self._children.values()):
+            # a scope without a table has none below it either, they are built from its table
+            if child._table is not None:
+                child._table = None
+                child._collapsed = None
+                child._invalidate_children()
+
+    def symbol_table(self) -> dict[str, Symbol]:
+        """A copy of the parent's table with the own symbols on top, rebuilt after this scope or one of its parents
+        changed."""
+
+        if self._table is None:
+            table = {} if self.parent_scope is None else dict(self.parent_scope.symbol_table())
+
+            for kind, symbols in self._own_symbols():
+                self._define(table, kind, symbols)
+
+            self._table = table
+
+        return self._table
+
+    def lookup(self, name: str, type_: _ALLOWED_TYPES | tuple[_ALLOWED_TYPES, ...]) -> typing.Any:
+        """Resolve a name to the first of the given kinds that it is defined as, or ``UNDEFINED``."""
+
+        table = self._table
+        symbol = (self.symbol_table() if table is None else table).get(name)
+
+        if symbol is None:
+            return UNDEFINED
+
+        if isinstance(type_, str):
+            return getattr(symbol, type_)
+
+        for t in type_:
+            value = getattr(symbol, t)
+            if value is not UNDEFINED:
+                return value
+
+        return UNDEFINED
+
     def get(self, name: str, type_: _ALLOWED_TYPES | tuple[_ALLOWED_TYPES, ...]):
-        try:
-            if isinstance(type_, tuple):
-                for t in type_:
-                    try:
-                        return self.get(name, t)
-                    except KeyError:
-                        pass
-                raise KeyError(f"Undefined {type_} {name!r}.")
-
-            if type_ == "variable_type":
-                return self.variable_types[name]
-            elif type_ == "variable":
-                return self.variables[name]
-            elif type_ == "string":
-                return self.strings_[name]
-            elif type_ == "pyfunc":
-                return self.pyfuncs[name]
-            elif type_ == "compile_time_arg":
-                return self.compile_time_args[name]
-            else:
-                assert False
-        except KeyError as e:
-            if self.parent_scope is not None:
-                return self.parent_scope.get(name, type_)
-            else:
-                raise KeyError(f"Undefined {type_} {name!r}.") from e
+        value = self.lookup(name, type_)
+
+        if value is UNDEFINED:
+            raise KeyError(f"Undefined {type_} {name!r}.")
+
+        return value
 
     def collapse(self) -> Scope:
         if self.parent_scope is None:
             return self
 
-        parent = self.parent_scope.collapse()
+        if self._collapsed is None:
+            table = self.symbol_table()
 
-        return Scope(
-            parent_scope=None,
-            variable_types=parent.variable_types | self.variable_types,
-            variables=parent.variables | self.variables,
-            strings_=parent.strings_ | self.strings_,
-            pyfuncs=parent.pyfuncs | self.pyfuncs,
-            compile_time_args=parent.compile_time_args | self.compile_time_args,
-        )
+            collapsed = Scope(parent_scope=None)
+            for kind, symbols in collapsed._own_symbols():
+                symbols.update(
+                    (name, value) for name, symbol in table.items()
+                    if (value := getattr(symbol, kind)) is not UNDEFINED
+                )
+
+            # a copy, since add updates the own table in place
+            collapsed._table = dict(table)
+            self._collapsed = collapsed
+
+        return self._collapsed
 
     def contains(self, name: str, type_: _ALLOWED_TYPES | tuple[_ALLOWED_TYPES, ...]) -> bool:
-        try:
-            self.get(name, type_)
-            return True
-        except KeyError:
-            return False
+        return self.lookup(name, type_) is not UNDEFINED
 
     def add(
         self,
@@ -93,6 +178,21 @@ class Scope:
         if compile_time_args is not None:
             self.compile_time_args.update(compile_time_args)
 
+        if self._table is not None:
+            # the own table can be updated in place, the tables of child scopes are rebuilt
+            for kind, symbols in (
+                ("variable_type", variable_types), ("variable", variables), ("string", strings_),
+                ("pyfunc", pyfuncs), ("compile_time_arg", compile_time_args)
+            ):
+                if symbols is not None:
+                    self._define(self._table, kind, symbols)
+
+        self._collapsed = None
+        self._invalidate_children()
+
+
+_EMPTY_SYMBOL = Symbol()
+
 
 def compile_time_args_to_str(args: tuple) -> str:
     if not args:
@@ -128,8 +228,20 @@ class File:
     function_templates: dict[tuple[str, ...], FunctionTemplate]
     scope: Scope
 
+    @classmethod
+    def from_source(cls, source: str, py_library: typing.Type | None) -> File:
+        with profiling.phase("ast.parse"):
+            node = ast.parse(source)
+
+        return cls.from_py_ast(node, py_library)
+
     @classmethod
     def from_py_ast(cls, node: ast.Module, py_library: typing.Type | None):
+        with profiling.phase("File.from_py_ast"):
+            return cls._from_py_ast(node, py_library)
+
+    @classmethod
+    def _from_py_ast(cls, node: ast.Module, py_library: typing.Type | None):
         scope = Scope(pyfuncs={f: getattr(py_library, f) for f in py_library.__pyfuncs__})
 
         function_templates = {}
@@ -141,19 +253,19 @@ class File:
 
                 case ast.AnnAssign(target=ast.Name(id=name),
                                    annotation=ast.Subscript(value=ast.Name(id="ScoreboardObjective"), slice=s)):
-                    scope.strings_[name] = strings.UniqueScoreboardObjective(
+                    scope.add(strings_={name: strings.UniqueScoreboardObjective(
                         parse_string(s, scope)
-                    )
+                    )})
                 case ast.AnnAssign(target=ast.Name(id=name),
                                    annotation=ast.Subscript(value=ast.Name(id="Tag"), slice=s)):
-                    scope.strings_[name] = strings.UniqueTag(parse_string(s, scope))
+                    scope.add(strings_={name: strings.UniqueTag(parse_string(s, scope))})
                 case ast.Assign(targets=[ast.Name(id=name)], value=ast.BinOp(left=ast.Constant(value=val), op=ast.Mod(),
                                                                              right=ast.Tuple(elts=elts))):
-                    scope.strings_[name] = strings.LiteralString(val, *[
+                    scope.add(strings_={name: strings.LiteralString(val, *[
                         parse_string(el, scope) for el in elts
-                    ])
+                    ])})
                 case ast.AnnAssign(target=ast.Name(id=name), annotation=ann):
-                    scope.variable_types[name] = parse_annotation(ann, scope)
+                    scope.add(variable_types={name: parse_annotation(ann, scope)})
                 case ast.Comment():
                     pass
                 case _:
@@ -238,24 +350,22 @@ def parse_expression(node: ast.expr, context: Scope) -> stores.ReadableStore:
         case ast.Call():
             return parse_func_call(node, context)
         case ast.Name(id=id):
-            try:
-                return context.get(id, "variable")
-            except KeyError:
-                pass
+            variable = context.lookup(id, "variable")
+            if variable is not UNDEFINED:
+                return variable
 
-            try:
-                compile_time_arg = context.get(id, "compile_time_arg")
-            except KeyError:
+            compile_time_arg = context.lookup(id, "compile_time_arg")
+            if compile_time_arg is UNDEFINED:
                 raise CompilationError(f"Unresolved identifier {id!r}.")
-            else:
-                try:
-                    match compile_time_arg:
-                        case int():
-                            return stores.ConstInt(compile_time_arg)
-                        case _:
-                            return stores.ConstStore(nbt.dumps(compile_time_arg))
-                except TypeError as e:
-                    raise CompilationError(f"Invalid expression {node!r}") from e
+
+            try:
+                match compile_time_arg:
+                    case int():
+                        return stores.ConstInt(compile_time_arg)
+                    case _:
+                        return stores.ConstStore(nbt.dumps(compile_time_arg))
+            except TypeError as e:
+                raise CompilationError(f"Invalid expression {node!r}") from e
         case _:
             try:
                 v = ast.literal_eval(node)
@@ -271,10 +381,9 @@ def parse_expression(node: ast.expr, context: Scope) -> stores.ReadableStore:
 def parse_value(node: ast.expr, context: Scope):
     match node:
         case ast.Name(id=id):
-            try:
-                return context.get(id, ("string", "pyfunc", "compile_time_arg", "variable"))
-            except KeyError:
-                pass
+            value = context.lookup(id, ("string", "pyfunc", "compile_time_arg", "variable"))
+            if value is not UNDEFINED:
+                return value
         case _:
             try:
                 return ast.literal_eval(node)
@@ -369,25 +478,20 @@ def parse_string(expr: ast.expr, context: Scope) -> strings.String:
         case ast.Constant(value=val):
             return strings.LiteralString(val)
         case ast.Name(id=name):
-            try:
-                return context.get(name, "string")
-            except KeyError:
-                pass
-
-            try:
-                val = context.get(name, "compile_time_arg")
-                match val:
-                    case str(val):
-                        return strings.LiteralString(val)
-                    case strings.String():
-                        return val
-                    case _:
-                        raise CompilationError(
-                            f"Compile-time arg {name!r} with value {val!r} cannot be interpreted as a string.")
-            except KeyError:
-                pass
-
-            raise CompilationError(f"Unresolved string {name!r}.")
+            string = context.lookup(name, "string")
+            if string is not UNDEFINED:
+                return string
+
+            match context.lookup(name, "compile_time_arg"):
+                case _Undefined():
+                    raise CompilationError(f"Unresolved string {name!r}.")
+                case str(val):
+                    return strings.LiteralString(val)
+                case strings.String() as val:
+                    return val
+                case val:
+                    raise CompilationError(
+                        f"Compile-time arg {name!r} with value {val!r} cannot be interpreted as a string.")
         case ast.Call(func=ast.Subscript(value=ast.Name(id=func_name), slice=s), args=[], keywords=[]):
             match s:
                 case ast.Tuple(elts=elts):
@@ -439,6 +543,17 @@ class FunctionTemplate:
     def get_compile_time_args(self) -> list[str]:
         return [s.name for s in self.node.type_params]
 
+    def get_entry_point_decorators(self) -> list[str]:
+        return [
+            decorator.id for decorator in self.node.decorator_list
+            if isinstance(decorator, ast.Name) and decorator.id in ENTRY_POINT_DECORATORS
+        ]
+
+    def get_function_tags(self) -> list[str]:
+        return [
+            tag for tag in map(ENTRY_POINT_DECORATORS.__getitem__, self.get_entry_point_decorators()) if tag is not None
+        ]
+
 
 @dataclasses.dataclass
 class TreeFunction:
@@ -452,30 +567,67 @@ class TreeFunction:
             arg.arg: object_model.get_var_of_arg_i(i).with_dtype(unpack_annotation(arg.annotation)[0])
             for i, arg in enumerate(node.args.args)
         }
-        scope = Scope(parent_scope=scope, variables=args)
+        scope = Scope(parent_scope=scope, variables=dict(args))
+        iterations_per_tick = cls.get_iterations_per_tick(node, scope)
 
         cls.search_for_var_types(node.body, scope)
+        cls.infer_int_variables(node.body, scope)
         scope.add(variables=cls.assign_symbols(scope.variable_types))
 
         statements = []
+
+        if iterations_per_tick is not None:
+            # the arg slots belong to the next call, which may happen while a loop is paused
+            copies = {
+                name: cls.get_store_from_variable_type(name, UnspecifiedVariableType(arg.dtype_obj))
+                for name, arg in args.items() if name not in scope.variable_types
+            }
+            scope.add(variables=copies)
+            statements += [AssignmentStatement(args[name], copy) for name, copy in copies.items()]
+
         for stmt in node.body:
             statements += parse_statement(stmt, scope)
 
+        if iterations_per_tick is not None:
+            statements = slice_loops(statements, iterations_per_tick)
+
         return cls(
             statements=statements,
             args=tuple(args.keys()),
             scope=scope
         )
 
+    @classmethod
+    def get_iterations_per_tick(cls, node: ast.FunctionDef, scope: Scope) -> int | None:
+        """The iteration budget of ``@tick_sliced[n]``, or None if the loops are not sliced."""
+
+        iterations_per_tick = None
+
+        for decorator in node.decorator_list:
+            match decorator:
+                case ast.Subscript(value=ast.Name(id="tick_sliced"), slice=s):
+                    iterations_per_tick = parse_value(s, scope)
+                    compile_assert(
+                        type(iterations_per_tick) is int and iterations_per_tick > 0,
+                        f"Invalid iteration budget {ast.unparse(s)}."
+                    )
+                case ast.Name(id=name) if name in ENTRY_POINT_DECORATORS:
+                    # see CompileNamespace.resolve_templates
+                    pass
+                case _:
+                    raise CompilationError(f"Invalid decorator {ast.unparse(decorator)}.")
+
+        return iterations_per_tick
+
     @classmethod
     def search_for_var_types(cls, statements: list[ast.stmt], scope: Scope):
         for statement in statements:
             match statement:
                 case ast.AnnAssign(target=ast.Name(id=name), annotation=ann):
-                    scope.variable_types[name] = parse_annotation(ann, scope)
+                    scope.add(variable_types={name: parse_annotation(ann, scope)})
                 case ast.Assign(targets=[ast.Name(id=name)]):
                     if name not in scope.variable_types:
-                        scope.variable_types[name] = UnspecifiedVariableType(stores.AnyDataType)
+                        scope.add(variable_types={name: UnspecifiedVariableType(stores.AnyDataType)})
                 case ast.If(test=test, body=body, orelse=orelse):
                     cls.search_for_var_types(body, scope)
                     cls.search_for_var_types(orelse, scope)
@@ -484,6 +636,52 @@ class TreeFunction:
                 case _:
                     pass
 
+    @classmethod
+    def infer_int_variables(cls, statements: list[ast.stmt], scope: Scope):
+        """Keep the unspecified variables that only ever hold 32-bit ints in scores instead of nbt.
+
+        A variable has one store for the whole function, so every assignment to it has to assign an int, in loops
+        and in both branches of ifs alike. The candidates are assumed to be ints while the assignments are checked,
+        which keeps ``i = i + 1`` a candidate, and candidates are dropped until all remaining ones are consistent.
+        """
+
+        assignments = collections.defaultdict(list)
+        cls.collect_assignments(statements, assignments)
+
+        candidates = {
+            name for name, var_type in scope.variable_types.items()
+            if isinstance(var_type, UnspecifiedVariableType) and var_type.dtype in _PROMOTABLE_DTYPES
+            and assignments[name]
+        }
+
+        while dropped := {
+            name for name in candidates
+            if not all(_is_int_expression(value, scope, candidates) for value in assignments[name])
+        }:
+            candidates -= dropped
+
+        if candidates:
+            scope.add(variable_types={name: UnspecifiedVariableType(stores.IntType) for name in candidates})
+
+    @classmethod
+    def collect_assignments(cls, statements: list[ast.stmt], out: dict[str, list[ast.expr]]):
+        """The values assigned to every name, in-place operations as the equivalent binary operation."""
+
+        for statement in statements:
+            match statement:
+                case ast.Assign(targets=[ast.Name(id=name)], value=value) | \
+                     ast.AnnAssign(target=ast.Name(id=name), value=value) if value is not None:
+                    out[name].append(value)
+                case ast.AugAssign(target=ast.Name(id=name) as target, op=op, value=value):
+                    out[name].append(ast.BinOp(left=target, op=op, right=value))
+                case ast.If(body=body, orelse=orelse):
+                    cls.collect_assignments(body, out)
+                    cls.collect_assignments(orelse, out)
+                case ast.While(body=body):
+                    cls.collect_assignments(body, out)
+                case _:
+                    pass
+
     @classmethod
     def assign_symbols(cls, var_types: dict[str, VariableType]):
         symbols = {}
@@ -530,6 +728,84 @@ class TreeFunction:
                 raise CompilationError(f"Invalid variable type {var_type!r}.")
 
 
+def _fits_int(value) -> bool:
+    return type(value) is int and -2 ** 31 <= value < 2 ** 31
+
+
+def _is_int_expression(node: ast.expr, scope: Scope, ints: set[str]) -> bool:
+    """Whether an expression always evaluates to a 32-bit int, assuming that the variables ``ints`` hold ints."""
+
+    match node:
+        case ast.Constant(value=value):
+            return _fits_int(value)
+        case ast.UnaryOp(op=ast.USub(), operand=ast.Constant(value=value)):
+            return type(value) is int and _fits_int(-value)
+        case ast.BinOp(left=left, op=op, right=right):
+            return (
+                isinstance(op, _INT_OPERATORS)
+                and _is_int_expression(left, scope, ints) and _is_int_expression(right, scope, ints)
+            )
+        case ast.Compare() | ast.BoolOp():
+            # the operands are compared in scores, the result is a score
+            return True
+        case ast.Name(id=name) if name in ints:
+            return True
+        case ast.Name(id=name) if name in scope.variable_types:
+            match scope.variable_types[name]:
+                case ScoreType():
+                    return True
+                case UnspecifiedVariableType(dtype=dtype) | NbtType(dtype=dtype):
+                    return issubclass(dtype, _INT_DTYPES)
+                case _:
+                    return False
+        case ast.Name(id=name):
+            match scope.lookup(name, ("variable", "compile_time_arg")):
+                case stores.ScoreboardStore():
+                    return True
+                case stores.NbtStore() as store:
+                    return store.is_data_type(*_INT_DTYPES)
+                case value:
+                    return _fits_int(value)
+        case _:
+            # function calls return nbt of any dtype
+            return False
+
+
+def slice_loops(statements: list[Statement], iterations_per_tick: int) -> list[Statement]:
+    """Limit all while loops, including nested ones, to a number of iterations per tick, see ``@tick_sliced[n]``.
+
+    Once the budget of a loop is used up, the loop continues in the next tick with ``schedule function`` and the
+    function returns to its caller, so the code after the loop runs in a later tick, too. Scheduled functions run as
+    the server, so ``@s`` and the position are not kept. Variables are scores and nbt, so they keep their values. The
+    args are read from slots that the next call overwrites, so TreeFunction.from_py_ast copies them to variables on
+    entry.
+
+    The variables and budgets are not per call: a call while a loop of the same instantiation is paused shares them
+    with the paused run.
+    """
+
+    out = []
+
+    for statement in statements:
+        match statement:
+            case WhileLoopStatement(body=body):
+                out.append(dataclasses.replace(
+                    statement,
+                    body=slice_loops(body, iterations_per_tick),
+                    iterations_per_tick=iterations_per_tick
+                ))
+            case IfStatement(true_body=true_body, false_body=false_body):
+                out.append(dataclasses.replace(
+                    statement,
+                    true_body=slice_loops(true_body, iterations_per_tick),
+                    false_body=slice_loops(false_body, iterations_per_tick)
+                ))
+            case _:
+                out.append(statement)
+
+    return out
+
+
 def parse_unary_op(node: ast.UnaryOp):
     breakpoint()
     raise NotImplementedError
@@ -628,6 +904,8 @@ class NestedStatement(Statement):
 class WhileLoopStatement(NestedStatement):
     condition: stores.ReadableStore
     body: list[Statement]
+    # None runs the whole loop in the current tick
+    iterations_per_tick: int | None = None
 
 
 @dataclasses.dataclass
@@ -1,9 +1,22 @@
+import typing
+
 from .. import strings
 from ..data import stores
 
 
 MCUTILS_STD_OBJECTIVE = strings.UniqueScoreboardObjective(strings.LiteralString("mcutils_std"))
 
+# Scratch locations of the generated code, see ir.peephole. Their values are only read in the block that wrote them,
+# except for live-out ones, which a caller reads after the block returned.
+TEMPORARIES: list[tuple[stores.PrimitiveWritableStore, bool]] = []
+
+_T = typing.TypeVar("_T", bound=stores.PrimitiveWritableStore)
+
 
 def get_temp_var(name: str) -> stores.ScoreboardStore:
     return stores.ScoreboardStore(strings.UniqueScoreboardPlayer(strings.LiteralString(name)), MCUTILS_STD_OBJECTIVE)
+
+
+def temporary(store: _T, live_out: bool = False) -> _T:
+    TEMPORARIES.append((store, live_out))
+    return store
@@ -29,6 +29,7 @@ def scoreboard_add_objective[name]():
     "scoreboard objectives add %s dummy" % (name,)
 
 
+@load
 def load():
     scoreboard_add_objective[STD_STACK_INDEX_OBJECTIVE]()
     # scoreboard_add_objective[STD_STACK_VALUE_OBJECTIVE]()
@@ -102,6 +103,27 @@ def pop[stack_nr]():
     stack_length -= 1
 
 
+# stacks in a storage list, every operation is a constant number of commands independent of the entity count
+# elements are wrapped in compounds, since nbt lists can only hold values of one type
+
+def storage_peek[stack_nr]():
+    v: StorageData[storage_of_stack_nr[stack_nr](), "stack[-1].value"]
+
+    return v
+
+
+def storage_push[stack_nr](value: Any):
+    "data modify storage %s stack append value {}" % (storage_of_stack_nr[stack_nr](),)
+
+    v: StorageData[storage_of_stack_nr[stack_nr](), "stack[-1].value"] = value
+
+
+def storage_pop[stack_nr]():
+    storage_peek[stack_nr]()
+
+    "data remove storage %s stack[-1]" % (storage_of_stack_nr[stack_nr](),)
+
+
 def _pop_any[stack_nr, index]():
     peek_any[stack_nr, index]()
 
@@ -365,6 +387,8 @@ def main():
     nbt_test()
     early_return_test()
     fact_test()
+    binop_test()
+    sliced_test()
     # fib_test()
 
     # a[1]()
@@ -584,3 +608,47 @@ def fact_test():
         print[{"color": "gray"}, "fact(", {"color": "light_purple"}, x, {"color": "gray"}, ") = ", {
             "color": "gold"}, out]()
         x += 1
+
+
+def binop_test():
+    x: Int = 3
+    y: Int = 4
+
+    r1: Int = (x + y) + (x * 2 + y)
+    print_var["r1", r1]()
+
+    r2: Int = (x * 2 - y * 3) * (y - 1)
+    print_var["r2", r2]()
+
+    r3: Int = (x * 2 + y) - (x * 2 + y)
+    print_var["r3", r3]()
+
+    r4: Int = (x * 2 + y) == (x * 2 + y)
+    print_var["r4", r4]()
+
+    # args that are live across a call are kept on the stack, see StdLibConfig
+    r5 = sum(x * y, fact(x))
+    print_var["r5", r5]()
+
+    r6 = sum(x + y, sum(x * y, fact(x)))
+    print_var["r6", r6]()
+
+
+@tick_sliced[2]
+def sliced(n: Int):
+    i: Int = 0
+    while i < n:
+        i += 1
+
+    print_var["sliced_i", i]()
+    print_var["sliced_n", n]()
+
+
+def sliced_other(n: Int):
+    print_var["other_n", n]()
+
+
+def sliced_test():
+    # the loop pauses after 2 iterations, sliced_other runs before it is done
+    sliced(5)
+    sliced_other(9)
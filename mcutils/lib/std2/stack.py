@@ -1,3 +1,4 @@
+import dataclasses
 import typing
 
 from ...data import stores
@@ -7,8 +8,49 @@ from ... import tellraw, strings
 from ...errors import CompilationError
 
 
+# a class instead of a closure so that lowered functions stay picklable, see ir.compile_cache
+@dataclasses.dataclass(eq=False)
+class _Tellraw:
+    args: tuple
+
+    def __call__(self, existing_strings: dict[str, set[str]], resolve_string: typing.Callable[[strings.String], str]):
+        out_text_components: list[tellraw.TextComponent] = []
+
+        curr_style = {}
+
+        for arg in self.args:
+            match arg:
+                case dict():
+                    curr_style |= {k: tellraw.UNSET if v is None else v for k, v in arg.items()}
+                case str():
+                    out_text_components.append(tellraw.PlainText(text=arg, **curr_style))
+                case int():
+                    out_text_components.append(tellraw.PlainText(text=str(arg), **curr_style))
+                case float():
+                    out_text_components.append(tellraw.PlainText(text=str(arg), **curr_style))
+                case stores.ScoreboardStore(player=player, objective=objective):
+                    out_text_components.append(
+                        tellraw.ScoreboardValue(player=resolve_string(player), objective=resolve_string(objective),
+                                                **curr_style)
+                    )
+                case stores.NbtStore(nbt_container_type=type_, nbt_container_argument=arg, path=path):
+                    out_text_components.append(
+                        tellraw.NbtValue(
+                            path=resolve_string(path),
+                            block=resolve_string(arg) if type_ == "block" else tellraw.UNSET,
+                            entity=resolve_string(arg) if type_ == "entity" else tellraw.UNSET,
+                            storage=resolve_string(arg) if type_ == "storage" else tellraw.UNSET,
+                            **curr_style
+                        )
+                    )
+                case _:
+                    raise CompilationError(f"Invalid argument {arg!r}")
+
+        return f"tellraw @a {tellraw.get_raw_json(*out_text_components)}"
+
+
 class Library:
-    __pyfuncs__ = "tag_of_stack_nr", "get_player", "get_objective", "print", "log"
+    __pyfuncs__ = "tag_of_stack_nr", "storage_of_stack_nr", "get_player", "get_objective", "print", "log"
 
     def __init__(self):
         self.std_stack_tags = {}
@@ -19,6 +61,9 @@ class Library:
 
         return self.std_stack_tags[stack_nr]
 
+    def storage_of_stack_nr(self, stack_nr: int) -> LiteralString:
+        return LiteralString(f"mcutils:stack{stack_nr}")
+
     def get_player(self, var):
         # breakpoint()
         return var.player
@@ -28,42 +73,7 @@ class Library:
         return var.objective
 
     def print(self, *args):
-        def _print(existing_strings: dict[str, set[str]], resolve_string: typing.Callable[[strings.String], str]):
-            out_text_components: list[tellraw.TextComponent] = []
-
-            curr_style = {}
-
-            for arg in args:
-                match arg:
-                    case dict():
-                        curr_style |= {k: tellraw.UNSET if v is None else v for k, v in arg.items()}
-                    case str():
-                        out_text_components.append(tellraw.PlainText(text=arg, **curr_style))
-                    case int():
-                        out_text_components.append(tellraw.PlainText(text=str(arg), **curr_style))
-                    case float():
-                        out_text_components.append(tellraw.PlainText(text=str(arg), **curr_style))
-                    case stores.ScoreboardStore(player=player, objective=objective):
-                        out_text_components.append(
-                            tellraw.ScoreboardValue(player=resolve_string(player), objective=resolve_string(objective),
-                                                    **curr_style)
-                        )
-                    case stores.NbtStore(nbt_container_type=type_, nbt_container_argument=arg, path=path):
-                        out_text_components.append(
-                            tellraw.NbtValue(
-                                path=resolve_string(path),
-                                block=resolve_string(arg) if type_ == "block" else tellraw.UNSET,
-                                entity=resolve_string(arg) if type_ == "entity" else tellraw.UNSET,
-                                storage=resolve_string(arg) if type_ == "storage" else tellraw.UNSET,
-                                **curr_style
-                            )
-                        )
-                    case _:
-                        raise CompilationError(f"Invalid argument {arg!r}")
-
-            return f"tellraw @a {tellraw.get_raw_json(*out_text_components)}"
-
-        return tree.LiteralStatement([strings.DynamicString(_print)]),
+        return tree.LiteralStatement([strings.DynamicString(_Tellraw(args))]),
 
     def log(self, prefix, *args):
         return self.print({"color": "light_purple"}, f"[{prefix}]", {"color": None}, " ", *args)
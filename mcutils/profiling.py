@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import collections
+import contextlib
+import dataclasses
+import json
+import logging
+import os
+import pathlib
+import sys
+import threading
+import time
+import tracemalloc
+import typing
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+logger = logging.getLogger("mcutils")
+
+_active: Profiler | None = None
+
+
+def set_verbosity(level: int | str):
+    """Show the compiler's progress messages of the given level (e.g. ``logging.INFO``) and above on stderr."""
+
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+
+    logger.setLevel(level)
+
+
+@dataclasses.dataclass
+class Span:
+    name: str
+    start_ns: int
+    duration_ns: int
+    thread_id: int
+    args: dict[str, typing.Any]
+
+
+@dataclasses.dataclass
+class Profiler:
+    """Records the time spent in every compiler phase and a few counters while it is active.
+
+    >>> with Profiler() as profiler:
+    ...     ...
+    >>> profiler.write_trace(pathlib.Path("trace.json"))
+    """
+
+    trace_memory: bool = False
+    spans: list[Span] = dataclasses.field(default_factory=list)
+    counters: collections.Counter[str] = dataclasses.field(default_factory=collections.Counter)
+    peak_traced_memory: int = 0
+    _origin_ns: int = dataclasses.field(default_factory=time.perf_counter_ns)
+    _lock: threading.Lock = dataclasses.field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def __enter__(self) -> Profiler:
+        global _active
+        _active = self
+
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        global _active
+        _active = None
+
+        if self.trace_memory and tracemalloc.is_tracing():
+            self.peak_traced_memory = max(self.peak_traced_memory, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+
+    @contextlib.contextmanager
+    def phase(self, name: str, **args: typing.Any) -> typing.Iterator[None]:
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            # list.append is atomic, phases may end on several threads at once
+            self.spans.append(Span(name, start - self._origin_ns, time.perf_counter_ns() - start,
+                                   threading.get_ident(), args))
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] += n
+
+    @staticmethod
+    def peak_rss() -> int | None:
+        """Peak resident set size of the process in bytes."""
+
+        if resource is None:
+            return None
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return peak if sys.platform == "darwin" else peak * 1024
+
+    def summary(self) -> dict[str, typing.Any]:
+        phases: dict[str, dict[str, float]] = {}
+
+        for span in self.spans:
+            phase = phases.setdefault(span.name, {"count": 0, "seconds": 0.0})
+            phase["count"] += 1
+            phase["seconds"] += span.duration_ns / 1e9
+
+        return {
+            "phases": phases,
+            "counters": dict(self.counters),
+            "peak_rss": self.peak_rss(),
+            "peak_traced_memory": self.peak_traced_memory if self.trace_memory else None,
+        }
+
+    def chrome_trace(self) -> dict[str, typing.Any]:
+        """The spans in the Trace Event Format, which chrome://tracing, Perfetto and speedscope show as flame graphs."""
+
+        return {
+            "traceEvents": [
+                {
+                    "name": span.name,
+                    "ph": "X",
+                    "ts": span.start_ns / 1000,
+                    "dur": span.duration_ns / 1000,
+                    "pid": os.getpid(),
+                    "tid": span.thread_id,
+                    "args": {k: str(v) for k, v in span.args.items()},
+                }
+                for span in self.spans
+            ],
+            "displayTimeUnit": "ms",
+        }
+
+    def write_json(self, path: pathlib.Path):
+        path.write_text(json.dumps(self.summary(), indent=2), "utf-8")
+
+    def write_trace(self, path: pathlib.Path):
+        path.write_text(json.dumps(self.chrome_trace()), "utf-8")
+
+
+def phase(name: str, **args: typing.Any) -> typing.ContextManager[None]:
+    """Time a phase of the active profiler. Does nothing if there is none."""
+
+    if _active is None:
+        return contextlib.nullcontext()
+
+    return _active.phase(name, **args)
+
+
+def count(name: str, n: int = 1):
+    if _active is not None:
+        _active.count(name, n)
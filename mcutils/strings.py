@@ -3,12 +3,52 @@ from __future__ import annotations
 import abc
 import dataclasses
 import itertools
+import threading
 import typing
+import weakref
 from collections import defaultdict
 
 from .errors import CompilationError
 
 _ID = 0
+_ID_LOCK = threading.Lock()
+# all live strings by id, used to re-link cached IR to the strings of the current build
+_REGISTRY: weakref.WeakValueDictionary[int, String] = weakref.WeakValueDictionary()
+
+
+def _next_id(string: String) -> int:
+    global _ID
+
+    with _ID_LOCK:
+        id_ = _ID
+        _ID += 1
+        _REGISTRY[id_] = string
+
+    return id_
+
+
+def get_next_id() -> int:
+    return _ID
+
+
+def skip_ids(count: int):
+    """Advance the id counter as if ``count`` strings had been created."""
+
+    global _ID
+
+    with _ID_LOCK:
+        _ID += count
+
+
+def register(string: String):
+    """Make a string that was not created through ``String.__init__`` (e.g. unpickled) findable by id."""
+
+    with _ID_LOCK:
+        _REGISTRY[string._id] = string
+
+
+def get_by_id(id_: int) -> String | None:
+    return _REGISTRY.get(id_)
 
 
 class StringResolver:
@@ -33,9 +73,7 @@ class StringResolver:
 
 class String(abc.ABC):
     def __init__(self):
-        global _ID
-        self._id = _ID
-        _ID += 1
+        self._id = _next_id(self)
 
     @abc.abstractmethod
     def get_str(
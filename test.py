@@ -1,35 +1,78 @@
-import ast_comments as ast
+import json
+import logging
 import pathlib
+import tempfile
 
-from mcutils import strings
+from mcutils import executor, profiling, strings
 from mcutils.ir import tree, commands, datapack, blocks
 
 
-def main():
+def compile_stack_test(std_lib_config: blocks.StdLibConfig) -> commands.CompileNamespace:
     from mcutils.lib.std2 import stack
 
     py_lib = stack.Library()
 
-    a = tree.File.from_py_ast(
-        ast.parse(pathlib.Path("mcutils/lib/std2/stack.mc.py").read_text("utf-8")),
+    a = tree.File.from_source(
+        pathlib.Path("mcutils/lib/std2/stack.mc.py").read_text("utf-8"),
         py_library=py_lib
     )
 
     b = commands.CompileNamespace.from_tree_namespace(a)
+    b.resolve_templates(["main"], std_lib_config)
 
-    std_lib_config = blocks.StdLibConfig(
-        stack_push=(("push",), (1,)),
-        stack_pop=(("pop",), (1,)),
-        stack_peek=(("peek",), (1,)),
-    )
+    return b
 
-    b.resolve_templates(["main"], std_lib_config)
 
-    d = datapack.Datapack("test", {"test": b})
-    d.export(pathlib.Path("testout").absolute())
+def main():
+    std_lib_config = blocks.StdLibConfig.entity_stack(1)
+
+    d = datapack.Datapack("test", {"test": compile_stack_test(std_lib_config)}, deduplicate=True)
+    functions = d.resolve_functions()
+    d.export(pathlib.Path("testout").absolute(), functions)
+    cost_report = d.write_cost_report(pathlib.Path("testout").absolute(), functions=functions)
+
+    e = executor.Executor.load(pathlib.Path("testout"))
+    main_commands = e.run("test:main/0")
+    main_output = list(e.output)
+    profiling.logger.info("main: %s commands executed", main_commands)
+
+    # the tick-sliced loop of sliced_test runs 2 of its 5 iterations per tick, sliced_other runs in between
+    profiling.logger.info("ticks: %s commands executed", e.tick(2))
+    assert e.output[-3:] == ["other_n = 9", "sliced_i = 5", "sliced_n = 5"], e.output[-3:]
+
+    # macro functions run the same commands, the cost report has to see the calls out of macro lines
+    with tempfile.TemporaryDirectory() as directory:
+        macro_pack = datapack.Datapack(
+            "test", {"test": compile_stack_test(std_lib_config)}, pack_format=18, macro_functions=True
+        )
+        macro_functions = macro_pack.resolve_functions()
+        macro_pack.export(pathlib.Path(directory), macro_functions)
+        macro_cost_report = macro_pack.write_cost_report(pathlib.Path(directory), functions=macro_functions)
+
+        entry_points = json.loads(cost_report.read_text("utf-8"))["entry_points"]
+        macro_entry_points = json.loads(macro_cost_report.read_text("utf-8"))["entry_points"]
+        # instantiations with string args are named after the string ids, which differ between the two builds
+        shared = entry_points.keys() & macro_entry_points.keys()
+        assert "test:main/0" in shared
+        for location in shared:
+            assert macro_entry_points[location] == entry_points[location], location
+
+        macro_e = executor.Executor.load(pathlib.Path(directory))
+        assert macro_e.run("test:main/0") == main_commands and macro_e.output == main_output
+
+    # the storage-list backend of the stack computes the same values as the entity backend
+    with tempfile.TemporaryDirectory() as directory:
+        storage_pack = datapack.Datapack("test", {"test": compile_stack_test(blocks.StdLibConfig.storage_stack(1))})
+        storage_pack.export(pathlib.Path(directory))
+
+        storage_e = executor.Executor.load(pathlib.Path(directory))
+        profiling.logger.info("main (storage stack): %s commands executed", storage_e.run("test:main/0"))
+        storage_e.tick(2)
+        assert storage_e.output == e.output, [(a, b) for a, b in zip(storage_e.output, e.output) if a != b]
 
     print(strings._ID)
 
 
 if __name__ == '__main__':
+    profiling.set_verbosity(logging.DEBUG)
     main()